@@ -0,0 +1,127 @@
+import contextlib
+
+import fitz  # PyMuPDF
+import numpy as np
+from PIL import Image
+
+from instrument import stage
+from pdf_stream_writer import StreamingPdfWriter
+from pixmap_view import pixmap_array
+
+# band_render.py
+# ラスタの2in1を、B4のキャンバスを作らずに帯(横長の短冊)ごとに作る。
+#   - 各ページを B5 の画素格子にぴったり合う変換行列で、クリップ矩形を使って BAND_ROWS 行ずつレンダリングする
+#     (B5 へのリサイズは不要。MuPDF の丸めで行や列がずれた分は、切り取るか白で埋めて正確な大きさにそろえる)
+#   - 左右のページの帯を並べて1枚の画像としてエンコードし、シートの該当する高さに配置する
+# 1シートあたりのメモリは帯1本分(400dpi で約 4MB、600dpi で約 7MB)とページの表示リストだけなので、
+# --dpi 600 でもメモリはほとんど増えない(画像のあるページは、デコード済みの画像も MuPDF のキャッシュに載る)。
+#
+# シートの種類(カラー / グレー / 白黒2値)は、書き始める前に 1/THUMB_SCALE の解像度のサムネイルで判定し、
+# シートのすべての帯を同じ形式(JPEG / Flate / CCITT G4。PageEncoder の設定に従う)でエンコードする。
+# サムネイルはアンチエイリアスなしでレンダリングし、raster エンジンの間引き判定と結果をそろえる。
+# BAND_ROWS は JPEG のブロック(16行)の倍数にして、帯の継ぎ目でブロックが分断されないようにする。
+# ただしカラーJPEGの色差の補間は帯をまたがないため、継ぎ目の1行は raster エンジンよりわずかに誤差が大きい。
+
+DEFAULT_DPI = 400
+BAND_ROWS = 256
+THUMB_SCALE = 4
+
+
+def b5_size(dpi):
+    """dpi での B5 の大きさ(ピクセル)"""
+    return int(182 / 25.4 * dpi), int(257 / 25.4 * dpi)
+
+
+def page_matrix(page, width, height):
+    """page を width x height ピクセルいっぱいに引き伸ばす変換行列"""
+    return fitz.Matrix(width / page.rect.width, height / page.rect.height)
+
+
+def render_band(display_list, matrix, width, top, bottom, colorspace, out):
+    """
+    display_list(表示リストまたはページ)の top〜bottom 行(0〜width 列)をレンダリングして out に書き込む
+
+    MuPDF が返す画素範囲は丸めで1行・1列ずれることがあるため、はみ出した分は捨て、足りない分は白にする。
+    """
+    clip = fitz.Rect(0, top, width, bottom) * ~matrix
+    pix = display_list.get_pixmap(matrix=matrix, colorspace=colorspace, alpha=False, clip=clip)
+    rows = pixmap_array(pix)
+    r0, r1 = max(top, pix.y), min(bottom, pix.y + pix.height)
+    c0, c1 = max(0, pix.x), min(width, pix.x + pix.width)
+    if (r0, r1, c0, c1) != (top, bottom, 0, width):
+        out[:] = 255
+    out[r0 - top:r1 - top, c0:c1] = rows[r0 - pix.y:r1 - pix.y, c0 - pix.x:c1 - pix.x]
+
+
+@contextlib.contextmanager
+def _without_antialiasing():
+    previous = fitz.TOOLS.show_aa_level()["graphics"]
+    fitz.TOOLS.set_aa_level(0)
+    try:
+        yield
+    finally:
+        fitz.TOOLS.set_aa_level(previous)
+
+
+def classify_sheet(pair, width, height, encoder):
+    """左右のページを低解像度でレンダリングして、シートの種類を判定する"""
+    if encoder.encoding != "auto":
+        return encoder.encoding
+    thumb_w, thumb_h = width // THUMB_SCALE, height // THUMB_SCALE
+    thumb = np.full((thumb_h, thumb_w * 2, 3), 255, dtype=np.uint8)
+    with _without_antialiasing():
+        for slot, page in enumerate(pair):
+            render_band(page, page_matrix(page, thumb_w, thumb_h), thumb_w, 0, thumb_h, fitz.csRGB,
+                        thumb[:, thumb_w * slot:thumb_w * (slot + 1)])
+    return encoder.classify(Image.fromarray(thumb), step=1)
+
+
+def write_sheet(writer, pair, kind, width, height, encoder, band_rows=BAND_ROWS):
+    """pair の1〜2ページを左右に並べたシートを、帯ごとにエンコードして writer に書き出す"""
+    colorspace = fitz.csRGB if kind == "color" else fitz.csGRAY
+    with stage("render"):
+        layers = [(page.get_displaylist(), page_matrix(page, width, height)) for page in pair]
+        for page, (display_list, matrix) in zip(pair, layers):
+            if page.get_images():
+                # クリップしてレンダリングすると MuPDF は画像の必要な部分だけをデコードするため、
+                # 帯ごとに大きなJPEGを先頭からデコードし直すことになる。先に1度ページ全体をグレーで
+                # レンダリングして、デコード済みの画像を MuPDF のキャッシュに載せておく
+                display_list.get_pixmap(matrix=matrix, colorspace=fitz.csGRAY, alpha=False)
+
+    band = np.empty((band_rows, width * 2, colorspace.n), dtype=np.uint8)
+    placements = []
+    for top in range(0, height, band_rows):
+        bottom = min(height, top + band_rows)
+        rows = band[:bottom - top]
+        # 奇数ページの最後のシートは右半分を白紙にする
+        rows[:, width * len(layers):] = 255
+        for slot, (display_list, matrix) in enumerate(layers):
+            with stage("render"):
+                render_band(display_list, matrix, width, top, bottom, colorspace,
+                            rows[:, width * slot:width * (slot + 1)])
+        image = Image.fromarray(rows[..., 0] if colorspace.n == 1 else rows)
+        image_id = writer.add_image(encoder.encode_as(image, kind))
+        # 配置の座標は左下原点なので、上から top 行目の帯は下から height - bottom の位置になる
+        placements.append((image_id, (width * 2, 0, 0, bottom - top, 0, height - bottom)))
+    writer.add_page(width * 2, height, placements)
+
+
+def band_2in1(pages, output_pdf, encoder, dpi=DEFAULT_DPI, band_rows=BAND_ROWS):
+    """
+    ページを2枚ずつ横に並べたB4(横)のラスタPDFを、帯ごとにレンダリング・エンコードして作成する
+
+    Args:
+        pages (list[tuple[fitz.Document, int]]): 並べる順の (ドキュメント, ページ番号)
+        output_pdf (str): 出力PDFファイル
+        encoder (PageEncoder): シートの種類の判定と帯のエンコードに使う
+        dpi (int): レンダリング解像度
+        band_rows (int): 一度にレンダリング・エンコードする行数
+    """
+    width, height = b5_size(dpi)
+    with StreamingPdfWriter(output_pdf, dpi=dpi) as writer:
+        for i in range(0, len(pages), 2):
+            pair = [doc[page_number] for doc, page_number in pages[i:i + 2]]
+            with stage("classify"):
+                kind = classify_sheet(pair, width, height, encoder)
+            encoder.stats[kind] += 1
+            write_sheet(writer, pair, kind, width, height, encoder, band_rows)
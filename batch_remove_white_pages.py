@@ -1,73 +1,87 @@
 import fitz  # PyMuPDF
-from PIL import Image
-import numpy as np
+import argparse
 import os
-import sys
+
+from blank_detect import BlankDetector
+from file_pool import run_file_jobs
+from instrument import add_profile_arguments, count_input, count_output, profiling, stage
+from page_select import SAVE_OPTIONS, select_pages
+from scan_plan import add_plan_arguments, list_files, pdf_cost, plan_jobs
 
 def is_white_page(page, threshold=255.0):
-    """ページを画像化して白紙判定する"""
-    pix = page.get_pixmap(dpi=72)
-    img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
-    avg = np.asarray(img).mean()
-    print(avg)
-    return avg >= threshold
+    """ページを白紙判定する(threshold 未満の明るさの画素があれば白紙でない)"""
+    return BlankDetector(tolerance=255 - threshold, dpi=72).is_blank(page)
 
 
 def remove_white_pages(input_pdf, output_pdf, threshold=255.0):
     doc = fitz.open(input_pdf)
-    new_doc = fitz.open()
+    detector = BlankDetector(tolerance=255 - threshold, dpi=72)
 
     removed_pages = []
+    kept_pages = []
 
     for i, page in enumerate(doc):
-        if is_white_page(page, threshold):
+        if detector.is_blank(page):
             removed_pages.append(i + 1)
         else:
-            new_doc.insert_pdf(doc, from_page=i, to_page=i)
+            kept_pages.append(i)
+
+    # 白紙以外のページだけを残す(リソースは元のPDFのまま共有する)
+    select_pages(doc, kept_pages)
 
     # 元PDFが全部白紙の場合に空PDFになるのを避ける
-    if len(new_doc) == 0:
-        new_doc.new_page()
+    if len(doc) == 0:
+        doc.new_page()
 
-    new_doc.save(output_pdf)
-    new_doc.close()
+    with stage("save"):
+        doc.save(output_pdf, **SAVE_OPTIONS)
     doc.close()
+    count_input([input_pdf])
+    count_output(output_pdf)
 
     print(f"[OK] {os.path.basename(input_pdf)} → {os.path.basename(output_pdf)}")
     print(f"     白紙ページ: {removed_pages}")
+    print(f"     {detector.summary()}")
 
 
-def batch_process(input_dir, output_dir):
+def batch_process(input_dir, output_dir, threshold=255.0, workers=1, plan=None):
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
 
     # 対象ファイルを選別
-    pdf_files = [
-        f for f in os.listdir(input_dir)
-        if f.lower().endswith(".pdf") and "mondai" in f.lower()
-    ]
+    pdf_files = [f for f in list_files(input_dir, ".pdf") if "mondai" in f.lower()]
 
     if not pdf_files:
         print("対象となる'mondai'を含むPDFがありません。")
         return
 
+    jobs = []
     for filename in pdf_files:
         input_path = os.path.join(input_dir, filename)
         output_name = os.path.splitext(filename)[0] + "_no_white.pdf"
         output_path = os.path.join(output_dir, output_name)
 
-        remove_white_pages(input_path, output_path)
+        jobs.append((filename, (input_path, output_path, threshold)))
 
+    # workers > 1 ならページ数の多いファイルから順にプロセスへ分散する
+    jobs = plan_jobs(jobs, lambda name: pdf_cost(os.path.join(input_dir, name)), workers, plan)
+    run_file_jobs(remove_white_pages, jobs, workers)
 
-def main():
-    if len(sys.argv) < 3:
-        print("使い方: python batch_remove_white_pages.py <input_dir> <output_dir>")
-        return
 
-    input_dir = sys.argv[1]
-    output_dir = sys.argv[2]
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="'mondai' を含むPDFから白紙ページを削除する")
+    parser.add_argument("input_dir")
+    parser.add_argument("output_dir")
+    parser.add_argument("--threshold", type=float, default=255.0,
+                        help="これ未満の明るさ(0-255)の画素があるページは白紙とみなさない")
+    parser.add_argument("--workers", type=int, default=1, metavar="N",
+                        help="PDFをファイル単位で並列処理するプロセス数")
+    add_plan_arguments(parser)
+    add_profile_arguments(parser)
+    args = parser.parse_args(argv)
 
-    batch_process(input_dir, output_dir)
+    with profiling(args):
+        batch_process(args.input_dir, args.output_dir, args.threshold, args.workers, args.plan)
 
 
 if __name__ == "__main__":
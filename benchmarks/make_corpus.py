@@ -0,0 +1,162 @@
+import argparse
+import io
+import os
+import random
+
+import fitz  # PyMuPDF
+from PIL import Image, ImageDraw
+
+# benchmarks/make_corpus.py
+# ベンチマーク用の入力データを決まった乱数シードで生成する(何度実行しても同じ内容になる)。
+#
+#   <out>/jpgs/<解像度名>/scanNN.jpg   EXIFの方向1〜8を順に付けたスキャン風JPEG
+#   <out>/pdfs/                        テキスト・図形・画像を含むB5 PDF(サブフォルダあり)
+#   <out>/blank/                       白紙ページが混ざった 'mondai' / 'kokugo' PDF
+
+# 解像度名 → (幅, 高さ)。向き補正後の縦長サイズ
+RESOLUTIONS = {
+    "a4_150dpi": (1240, 1754),
+    "a4_300dpi": (2480, 3508),
+    "phone_48mp": (6000, 8000),
+}
+
+# EXIF方向ごとに、表示向きの画像から格納画像を作る変換
+STORE_TRANSPOSE = {
+    1: None,
+    2: Image.Transpose.FLIP_LEFT_RIGHT,
+    3: Image.Transpose.ROTATE_180,
+    4: Image.Transpose.FLIP_TOP_BOTTOM,
+    5: Image.Transpose.TRANSPOSE,
+    6: Image.Transpose.ROTATE_90,
+    7: Image.Transpose.TRANSVERSE,
+    8: Image.Transpose.ROTATE_270,
+}
+
+B5_WIDTH_PT = 182 / 25.4 * 72
+B5_HEIGHT_PT = 257 / 25.4 * 72
+FIXED_DATE = "D:20240101000000Z"
+
+
+def scan_image(size, rng: random.Random) -> Image.Image:
+    """紙のスキャン風の画像(薄い地色・文字行のような帯・図)を作る"""
+    width, height = size
+    paper = tuple(rng.randint(235, 250) for _ in range(3))
+    img = Image.new("RGB", size, paper)
+    draw = ImageDraw.Draw(img)
+
+    margin = width // 12
+    line_height = max(8, height // 60)
+    y = margin
+    while y < height - margin:
+        x = margin
+        while x < width - margin:
+            word = rng.randint(line_height, line_height * 5)
+            ink = rng.randint(10, 60)
+            draw.rectangle((x, y, min(x + word, width - margin), y + line_height // 2),
+                           fill=(ink, ink, ink))
+            x += word + line_height // 2
+        y += line_height * rng.choice((1, 1, 1, 2))
+
+    if rng.random() < 0.5:
+        box = (width // 4, height // 3, width // 4 * 3, height // 2)
+        draw.ellipse(box, outline=(200, 30, 30), width=max(2, width // 300))
+    return img
+
+
+def make_jpgs(out_dir, count, rng):
+    for name, size in RESOLUTIONS.items():
+        folder = os.path.join(out_dir, "jpgs", name)
+        os.makedirs(folder, exist_ok=True)
+        for i in range(count):
+            orientation = i % 8 + 1
+            img = scan_image(size, rng)
+            transpose = STORE_TRANSPOSE[orientation]
+            if transpose is not None:
+                img = img.transpose(transpose)
+            exif = Image.Exif()
+            exif[0x0112] = orientation
+            img.save(os.path.join(folder, f"scan{i + 1:03d}.jpg"), quality=90, exif=exif)
+
+
+def add_content_page(doc, rng, kind):
+    """text / vector / image のいずれかの内容を持つB5ページを追加する"""
+    page = doc.new_page(width=B5_WIDTH_PT, height=B5_HEIGHT_PT)
+    if kind == "text":
+        y = 60
+        while y < B5_HEIGHT_PT - 60:
+            words = " ".join("x" * rng.randint(2, 9) for _ in range(rng.randint(4, 9)))
+            page.insert_text((50, y), words, fontsize=10)
+            y += 16
+    elif kind == "vector":
+        for _ in range(40):
+            x0, y0 = rng.uniform(30, 400), rng.uniform(30, 650)
+            rect = fitz.Rect(x0, y0, x0 + rng.uniform(10, 90), y0 + rng.uniform(10, 60))
+            page.draw_rect(rect, color=(0, 0, rng.random()), width=1)
+            page.draw_line(rect.tl, rect.br, color=(rng.random(), 0, 0))
+    else:
+        img = scan_image((900, 1270), rng)
+        stream = _jpeg_bytes(img)
+        page.insert_image(fitz.Rect(30, 30, B5_WIDTH_PT - 30, B5_HEIGHT_PT - 30), stream=stream)
+    return page
+
+
+def _jpeg_bytes(img: Image.Image) -> bytes:
+    buf = io.BytesIO()
+    img.save(buf, "JPEG", quality=85)
+    return buf.getvalue()
+
+
+def save_pdf(doc, path):
+    """作成日時とファイルIDを固定して保存する(同じシードなら同じバイト列になる)"""
+    doc.set_metadata({"creationDate": FIXED_DATE, "modDate": FIXED_DATE, "producer": "make_corpus"})
+    doc.save(path, garbage=3, deflate=True, no_new_id=True)
+    doc.close()
+
+
+def make_pdfs(out_dir, pages, rng):
+    kinds = ["text", "vector", "image"]
+    for folder, names in [("pdfs", ["text", "vector", "image", "mixed"]),
+                          (os.path.join("pdfs", "nested", "deeper"), ["mixed2"])]:
+        os.makedirs(os.path.join(out_dir, folder), exist_ok=True)
+        for name in names:
+            doc = fitz.open()
+            for i in range(pages):
+                kind = name if name in kinds else kinds[i % 3]
+                add_content_page(doc, rng, kind)
+            save_pdf(doc, os.path.join(out_dir, folder, f"{name}.pdf"))
+
+
+def make_blank_mix(out_dir, pages, rng):
+    folder = os.path.join(out_dir, "blank")
+    os.makedirs(folder, exist_ok=True)
+    for name in ["exam_mondai", "kokugo_mondai"]:
+        doc = fitz.open()
+        for i in range(pages):
+            if i % 3 == 2:
+                doc.new_page(width=B5_WIDTH_PT, height=B5_HEIGHT_PT)  # 白紙
+            else:
+                add_content_page(doc, rng, ["text", "vector", "image"][i % 3])
+        save_pdf(doc, os.path.join(folder, f"{name}.pdf"))
+
+
+def make_corpus(out_dir, jpg_count=8, pdf_pages=12, seed=1):
+    rng = random.Random(seed)
+    make_jpgs(out_dir, jpg_count, rng)
+    make_pdfs(out_dir, pdf_pages, rng)
+    make_blank_mix(out_dir, pdf_pages, rng)
+    print(f"ベンチマーク用データを作成しました: {out_dir}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="ベンチマーク用のJPG/PDFデータを生成する")
+    parser.add_argument("out_dir")
+    parser.add_argument("--jpgs", type=int, default=8, help="解像度ごとのJPG枚数")
+    parser.add_argument("--pages", type=int, default=12, help="PDFごとのページ数")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args(argv)
+
+    make_corpus(args.out_dir, args.jpgs, args.pages, args.seed)
+
+
+if __name__ == "__main__":
+    main()
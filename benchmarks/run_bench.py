@@ -0,0 +1,242 @@
+import argparse
+import datetime
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import fitz  # PyMuPDF
+
+from make_corpus import RESOLUTIONS
+
+# benchmarks/run_bench.py
+# 各ツールの入口関数を別プロセスで実行し、所要時間・ページ/秒・ピークRSS・出力サイズを JSON に記録する。
+# 結果にはコミットIDを入れるので、コミット間で比較できる(--compare 前回の.json)。
+#
+#   python benchmarks/run_bench.py --corpus bench_corpus -o bench.json
+#
+# ケースごとにコーパスを作業ディレクトリへコピーしてから実行するため、
+# 前回の出力やマニフェストが結果に影響しない。
+#
+# ピークRSSは子プロセス自身が /proc/self/status の VmHWM を読んで報告する。
+# Linux では fork/exec した子の ru_maxrss に親プロセスの最大RSSが引き継がれるため、wait4 の値は
+# ハーネス側で大きなメモリを使った後(コーパスの生成など)だと子の実際の使用量より大きくなる。
+# コーパスの生成も別プロセスで行い、ハーネス自体のメモリを小さく保つ。
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 子プロセスで実行するコード。kwargs は関数が受け取る引数だけを渡す。
+# 終了時に VmHWM(KB)を sys.argv[3] のファイルに書く(/proc の無い環境では書かない)
+CHILD_CODE = """
+import importlib, inspect, json, sys
+sys.path.insert(0, sys.argv[1])
+module, name, args, kwargs = json.loads(sys.argv[2])
+func = getattr(importlib.import_module(module), name)
+params = inspect.signature(func).parameters
+try:
+    func(*args, **{k: v for k, v in kwargs.items() if k in params})
+finally:
+    try:
+        with open("/proc/self/status") as status:
+            hwm = next(line.split()[1] for line in status if line.startswith("VmHWM:"))
+        with open(sys.argv[3], "w") as out:
+            out.write(hwm)
+    except (OSError, StopIteration):
+        pass
+"""
+
+
+def bench_cases(work):
+    """(ケース名, モジュール, 関数, 引数, 入力ページ数の対象, 出力パス) の一覧"""
+    cases = []
+    for res in RESOLUTIONS:
+        folder = os.path.join(work, "jpgs", res)
+        cases.append((f"jpgs_to_pdf/{res}", "jpgs_to_pdf_b5", "jpgs_to_pdf",
+                      [folder], folder, os.path.join(work, "jpgs", f"{res}.pdf")))
+        cases.append((f"jpgs_to_pdf_2in1/{res}", "jpgs_to_pdf_b4_2in1", "jpgs_to_pdf_2in1",
+                      [folder], folder, os.path.join(work, "jpgs", f"{res}_2in1_B4.pdf")))
+
+    pdfs = os.path.join(work, "pdfs")
+    mixed = os.path.join(pdfs, "mixed.pdf")
+    merge_inputs = [os.path.join(pdfs, f"{n}.pdf") for n in ("text", "vector", "image", "mixed")]
+    blank = os.path.join(work, "blank", "exam_mondai.pdf")
+    cases += [
+        ("pdf_to_2in1", "pdf_b5_to_b4_2in1", "pdf_to_2in1",
+         [mixed], mixed, os.path.join(pdfs, "mixed_2in1_B4.pdf")),
+        ("merge_pdfs", "merge_pdfs", "merge_pdfs",
+         [merge_inputs], merge_inputs, os.path.join(pdfs, "text_merged.pdf")),
+        ("remove_white_pages", "batch_remove_white_pages", "remove_white_pages",
+         [blank, os.path.join(work, "blank_removed.pdf")], blank, os.path.join(work, "blank_removed.pdf")),
+        ("process_folder_recursive", "process_pdf_recursive", "process_folder_recursive",
+         [pdfs, os.path.join(work, "processed")], pdfs, os.path.join(work, "processed")),
+    ]
+    return cases
+
+
+def count_pages(target):
+    """入力のページ数(JPGフォルダなら枚数、PDFフォルダなら全PDFの合計)"""
+    if isinstance(target, list):
+        return sum(count_pages(t) for t in target)
+    if os.path.isdir(target):
+        total = 0
+        for root, _, files in os.walk(target):
+            for f in files:
+                if f.lower().endswith(".jpg"):
+                    total += 1
+                elif f.lower().endswith(".pdf"):
+                    total += count_pages(os.path.join(root, f))
+        return total
+    with fitz.open(target) as doc:
+        return doc.page_count
+
+
+def output_size(path):
+    """出力ファイル(フォルダならその中のPDFの合計)のバイト数。無ければ None"""
+    if os.path.isdir(path):
+        return sum(os.path.getsize(os.path.join(root, f))
+                   for root, _, files in os.walk(path) for f in files if f.lower().endswith(".pdf"))
+    return os.path.getsize(path) if os.path.exists(path) else None
+
+
+def run_child(module, func, args, kwargs, log_path):
+    """子プロセスで func を実行し (終了コード, 所要秒, ピークRSS[MB]) を返す"""
+    hwm_path = log_path + ".hwm"
+    if os.path.exists(hwm_path):
+        os.remove(hwm_path)
+    cmd = [sys.executable, "-c", CHILD_CODE, REPO_DIR, json.dumps([module, func, args, kwargs]), hwm_path]
+    with open(log_path, "w", encoding="utf-8") as log:
+        start = time.perf_counter()
+        proc = subprocess.Popen(cmd, stdout=log, stderr=subprocess.STDOUT)
+        if hasattr(os, "wait4"):
+            _, status, usage = os.wait4(proc.pid, 0)
+            elapsed = time.perf_counter() - start
+            proc.returncode = os.waitstatus_to_exitcode(status)
+            # ru_maxrss は Linux では KB、macOS ではバイト
+            scale = 1 if sys.platform == "darwin" else 1024
+            peak_mb = usage.ru_maxrss * scale / (1024 * 1024)
+        else:
+            # Windows には wait4 が無いのでピークRSSは記録しない
+            proc.wait()
+            elapsed = time.perf_counter() - start
+            peak_mb = None
+    # 子が報告した VmHWM があればそちらを使う(Linux の ru_maxrss は親の最大RSSを引き継ぐ)
+    if os.path.exists(hwm_path):
+        with open(hwm_path, encoding="utf-8") as f:
+            peak_mb = int(f.read()) / 1024
+    return proc.returncode, elapsed, peak_mb
+
+
+def make_corpus_in_subprocess(corpus, seed):
+    """コーパスを別プロセスで生成する(ハーネスのメモリを増やさない)"""
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "make_corpus.py")
+    subprocess.run([sys.executable, script, corpus, "--seed", str(seed)], check=True)
+
+
+def git_commit():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=REPO_DIR,
+                                capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=REPO_DIR,
+                               capture_output=True, text=True, check=True).stdout.strip() != ""
+        return commit, dirty
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+
+
+def run_benchmarks(corpus, repeat=1, kwargs=None, only=None):
+    kwargs = kwargs or {}
+    results = {}
+    with tempfile.TemporaryDirectory(prefix="jpgs_to_pdf_bench_") as tmp:
+        for name, module, func, args, page_target, output in bench_cases(os.path.join(tmp, "work")):
+            if only and not any(name.startswith(o) for o in only):
+                continue
+            runs = []
+            for _ in range(repeat):
+                work = os.path.join(tmp, "work")
+                shutil.rmtree(work, ignore_errors=True)
+                shutil.copytree(corpus, work)
+                log_path = os.path.join(tmp, "child.log")
+                code, elapsed, peak_mb = run_child(module, func, args, kwargs, log_path)
+                if code != 0:
+                    with open(log_path, encoding="utf-8", errors="replace") as f:
+                        print(f.read(), end="")
+                    raise RuntimeError(f"{name} が終了コード {code} で失敗しました")
+                runs.append((elapsed, peak_mb, output_size(output)))
+
+            pages = count_pages(page_target)
+            # 繰り返し実行した場合は最短時間・最大RSSを採る
+            wall = min(r[0] for r in runs)
+            peaks = [r[1] for r in runs if r[1] is not None]
+            results[name] = {
+                "wall_s": round(wall, 4),
+                "pages": pages,
+                "pages_per_s": round(pages / wall, 3) if wall > 0 else None,
+                "peak_rss_mb": round(max(peaks), 1) if peaks else None,
+                "output_bytes": runs[-1][2],
+            }
+            print(f"{name:36s} {wall:8.2f} s {results[name]['pages_per_s']:8.2f} p/s "
+                  f"{results[name]['peak_rss_mb'] or 0:8.1f} MB {results[name]['output_bytes'] or 0:>12,d} B")
+    return results
+
+
+def print_comparison(old, new):
+    """前回の結果との比(新/旧)を表示する。1 より小さければ速く・小さくなっている"""
+    print(f"\n比較: {str(old.get('commit'))[:10]} → {str(new.get('commit'))[:10]}")
+    print(f"{'case':36s} {'wall':>8s} {'rss':>8s} {'size':>8s}")
+
+    def ratio(a, b):
+        return f"{b / a:8.2f}" if a and b is not None else f"{'-':>8s}"
+
+    for name, cur in new["cases"].items():
+        prev = old["cases"].get(name)
+        if prev is None:
+            continue
+        print(f"{name:36s} {ratio(prev['wall_s'], cur['wall_s'])} "
+              f"{ratio(prev['peak_rss_mb'], cur['peak_rss_mb'])} "
+              f"{ratio(prev['output_bytes'], cur['output_bytes'])}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="各ツールの処理時間・メモリ・出力サイズを計測する")
+    parser.add_argument("--corpus", default="bench_corpus",
+                        help="ベンチマーク用データのフォルダ(無ければ作成する)")
+    parser.add_argument("-o", "--output", help="結果を書き出す JSON ファイル")
+    parser.add_argument("--repeat", type=int, default=1, help="ケースごとの実行回数(最短時間を採る)")
+    parser.add_argument("--kwargs", type=json.loads, default={},
+                        help='入口関数に渡す追加の引数(JSON)。例: \'{"jobs": 4}\'')
+    parser.add_argument("--only", nargs="+", metavar="CASE", help="名前がこれで始まるケースだけ実行する")
+    parser.add_argument("--compare", metavar="JSON", help="前回の結果と比較して表示する")
+    parser.add_argument("--seed", type=int, default=1, help="データ作成時の乱数シード")
+    args = parser.parse_args(argv)
+
+    if not os.path.isdir(args.corpus):
+        make_corpus_in_subprocess(args.corpus, args.seed)
+
+    commit, dirty = git_commit()
+    report = {
+        "commit": commit,
+        "dirty": dirty,
+        "date": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "pymupdf": fitz.VersionBind,
+        "repeat": args.repeat,
+        "kwargs": args.kwargs,
+        "cases": run_benchmarks(args.corpus, args.repeat, args.kwargs, args.only),
+    }
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=1)
+        print(f"結果を保存しました: {args.output}")
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            print_comparison(json.load(f), report)
+
+
+if __name__ == "__main__":
+    main()
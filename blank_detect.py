@@ -0,0 +1,85 @@
+import re
+from collections import Counter
+
+import fitz  # PyMuPDF
+
+from instrument import count, stage
+from pixmap_view import pixmap_array
+
+# blank_detect.py
+# 白紙ページ判定を段階的に行う共通モジュール。
+#   1. content: 内容ストリームも注釈もない → 白紙
+#   2. objects: テキスト・画像・図形・Form XObject・注釈のどれもない → 白紙
+#      (インライン画像 BI…ID…EI とシェーディング sh はどの取得関数にも現れないため、含むページは次の段へ)
+#   3. raster : 低dpiのグレースケール画像をタイル単位で調べ、白でない画素が出た時点で打ち切る
+# 前の段で決まらなかったページだけが次の段に進むため、多くのページはラスタライズせずに判定できる。
+
+# 内容ストリーム中の BI / sh 演算子(名前 /sh などは除く)
+_HIDDEN_PAINT_OPS = re.compile(rb"(?<![^\x00\t\n\f\r ()<>\[\]{}%])(?:BI|sh)(?![^\x00\t\n\f\r ()<>\[\]{}/%])")
+
+
+class BlankDetector:
+    """
+    段階的な白紙ページ判定器
+
+    Args:
+        tolerance (int): 白とみなす明るさの許容幅(0なら255のみ白)
+        dpi (int): raster 段でレンダリングする解像度
+        raster (bool): False なら objects 段で何か見つかった時点で白紙でないと判定する
+        tile_rows (int): raster 段で一度に調べる行数
+    """
+
+    def __init__(self, tolerance=0, dpi=72, raster=True, tile_rows=64):
+        self.tolerance = tolerance
+        self.dpi = dpi
+        self.raster = raster
+        self.tile_rows = tile_rows
+        self.stats = Counter()
+
+    def is_blank(self, page) -> bool:
+        """ページが白紙なら True"""
+        with stage("blank_detect"):
+            blank, tier = self._decide(page)
+        self.stats[tier] += 1
+        if blank:
+            self.stats["blank"] += 1
+            count("blank_pages")
+        return blank
+
+    def _decide(self, page):
+        has_annots = page.first_annot is not None or page.first_widget is not None
+
+        # 1. 内容ストリームが空
+        contents = page.read_contents()
+        if not contents.strip() and not has_annots:
+            return True, "content"
+
+        # 2. 描画されうるオブジェクトの有無
+        has_objects = (
+            has_annots
+            or _HIDDEN_PAINT_OPS.search(contents)
+            or page.get_images()
+            or page.get_xobjects()
+            or page.get_text().strip()
+            or page.get_drawings()
+        )
+        if not has_objects:
+            return True, "objects"
+        if not self.raster:
+            return False, "objects"
+
+        # 3. 低dpiのグレースケール画像で白以外の画素を探す
+        pix = page.get_pixmap(dpi=self.dpi, colorspace=fitz.csGRAY, alpha=False)
+        rows = pixmap_array(pix)
+        white = 255 - self.tolerance
+        for top in range(0, pix.height, self.tile_rows):
+            if rows[top:top + self.tile_rows].min() < white:
+                return False, "raster"
+        return True, "raster"
+
+    def summary(self) -> str:
+        """段ごとの判定件数を1行にまとめる"""
+        return (
+            f"白紙判定: content={self.stats['content']} objects={self.stats['objects']}"
+            f" raster={self.stats['raster']} (白紙 {self.stats['blank']} ページ)"
+        )
@@ -0,0 +1,178 @@
+import contextlib
+import hashlib
+import json
+import os
+import time
+
+# build_manifest.py
+# 出力の横にビルドマニフェストを置き、入力ファイル(サイズ・更新時刻・内容ハッシュ)と
+# ツールのオプションが前回と同じジョブをスキップする。
+# 出力は一時ファイルに書いてから置き換えるため、中断しても書きかけのPDFは残らない。
+#
+# 記録はメモリ上にためて save_every 件ごと(と save() の呼び出し時)にまとめて書き出す。
+# 保存のたびにマニフェスト全体を書き直すため、1件ずつ保存すると数千ファイルのバッチでは
+# 保存の合計時間がファイル数の2乗で増える。
+#
+# 同じフォルダへ複数のプロセスが記録する場合(--workers、監視モード)に備え、読み直し・追加・置き換えは
+# ロックファイル(MANIFEST_NAME + ".lock"。O_EXCL で作成)を取ってから行う。
+# クラッシュで残ったロックは LOCK_STALE 秒たてば取り除く。
+
+MANIFEST_NAME = ".jpgs_to_pdf_manifest.json"
+# フォルダ単位のバッチで、まとめて保存する記録の件数
+SAVE_EVERY = 50
+# ロックを待つ最大時間と、残ったロックを放置されたものとみなす時間(秒)
+LOCK_TIMEOUT = 60.0
+LOCK_STALE = 120.0
+
+
+def file_digest(path: str) -> str:
+    """ファイル内容の SHA-256"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+@contextlib.contextmanager
+def atomic_output(path: str):
+    """
+    path への書き込みを一時ファイル経由で行う
+
+    with ブロックが正常に終わったときだけ一時ファイルを path に置き換え、
+    例外で抜けたときは一時ファイルを削除する。拡張子は path と同じにする。
+    """
+    directory, name = os.path.split(os.path.abspath(path))
+    base, ext = os.path.splitext(name)
+    tmp_path = os.path.join(directory, f".{base}.{os.getpid()}.tmp{ext}")
+    try:
+        yield tmp_path
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+@contextlib.contextmanager
+def file_lock(lock_path: str, timeout: float = LOCK_TIMEOUT):
+    """lock_path を O_EXCL で作成できるまで待ち、with ブロックの間だけ保持する"""
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            break
+        except FileExistsError:
+            try:
+                if time.time() - os.path.getmtime(lock_path) > LOCK_STALE:
+                    os.remove(lock_path)
+                    continue
+            except OSError:
+                # 待っている間に解放された
+                continue
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"ロックを取得できませんでした: {lock_path}")
+            time.sleep(0.02)
+    try:
+        os.write(fd, str(os.getpid()).encode())
+        os.close(fd)
+        yield
+    finally:
+        os.remove(lock_path)
+
+
+class BuildManifest:
+    """
+    ディレクトリ単位のビルドマニフェスト
+
+    出力ファイルごとに、入力ファイルの状態・オプション・出力サイズを記録する。
+    save_every 件の記録がたまるたびに保存する。残りは save() を呼んだときに保存する。
+    """
+
+    def __init__(self, directory: str, save_every: int = 1):
+        self.directory = os.path.abspath(directory)
+        self.path = os.path.join(self.directory, MANIFEST_NAME)
+        self.save_every = save_every
+        with file_lock(self.path + ".lock"):
+            self.entries = self._load()
+        # まだ保存していない記録
+        self._unsaved = {}
+
+    def _load(self) -> dict:
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            # 壊れたマニフェストは無視して作り直す
+            return {}
+
+    def _key(self, path: str) -> str:
+        return os.path.relpath(os.path.abspath(path), self.directory)
+
+    def is_current(self, output: str, inputs, options: dict) -> bool:
+        """output が inputs と options から作られた最新の出力なら True"""
+        entry = self.entries.get(self._key(output))
+        if entry is None or entry["options"] != options:
+            return False
+        if not os.path.exists(output) or os.path.getsize(output) != entry["output_size"]:
+            return False
+
+        # 入力の順番はページ順になるので、並びが変わった場合も作り直す
+        recorded = entry["inputs"]
+        if list(recorded) != [self._key(p) for p in inputs]:
+            return False
+
+        touched = False
+        for path in inputs:
+            state = recorded[self._key(path)]
+            stat = os.stat(path)
+            if stat.st_size != state["size"]:
+                return False
+            if stat.st_mtime_ns != state["mtime_ns"]:
+                # 更新時刻だけ変わった場合は内容ハッシュで判定する
+                if file_digest(path) != state["sha256"]:
+                    return False
+                state["mtime_ns"] = stat.st_mtime_ns
+                touched = True
+
+        if touched:
+            self._update(self._key(output), entry)
+        return True
+
+    def record(self, output: str, inputs, options: dict):
+        """output を inputs と options から作ったことを記録する"""
+        states = {}
+        for path in inputs:
+            stat = os.stat(path)
+            states[self._key(path)] = {
+                "size": stat.st_size,
+                "mtime_ns": stat.st_mtime_ns,
+                "sha256": file_digest(path),
+            }
+        self._update(self._key(output), {
+            "inputs": states,
+            "options": options,
+            "output_size": os.path.getsize(output),
+        })
+
+    def _update(self, key: str, entry: dict):
+        self.entries[key] = entry
+        self._unsaved[key] = entry
+        if len(self._unsaved) >= self.save_every:
+            self.save()
+
+    def save(self):
+        """まだ保存していない記録を書き出す"""
+        if not self._unsaved:
+            return
+        # 同じフォルダを別プロセスで並列に変換している場合(監視モードなど)に
+        # 他の出力の記録を消さないよう、ロックを取ってから読み直して追加する
+        with file_lock(self.path + ".lock"):
+            entries = self._load()
+            entries.update(self._unsaved)
+            with atomic_output(self.path) as tmp_path:
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump(entries, f, ensure_ascii=False, indent=1)
+        self.entries = entries
+        self._unsaved.clear()
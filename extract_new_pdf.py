@@ -1,7 +1,94 @@
-import sys
+import argparse
+import csv
+import json
 import os
+from concurrent.futures import ProcessPoolExecutor
+
 import fitz  # PyMuPDF
 
+import instrument
+from build_manifest import atomic_output
+from instrument import add_profile_arguments, count_input, count_output, profiling, stage
+from merge_engine import DEFAULT_SAVE_MODE, SAVE_MODES, pdf_bytes
+from page_select import SAVE_OPTIONS, select_pages
+
+# extract_new_pdf.py
+# PDFからページ範囲を抜き出して新しいPDFを作る。
+#
+#   1範囲:    extract_new_pdf.py input.pdf 10 20            → input_extracted.pdf
+#   複数範囲: extract_new_pdf.py input.pdf --ranges 1-30 31-62=第2章.pdf 63-
+#             extract_new_pdf.py input.pdf --ranges-file chapters.csv
+#
+# 1範囲では元のPDFのページを選び直して(page_select)保存する。
+# 複数範囲では元のPDFを1回だけ開いて解析し、各範囲を1回の insert_pdf でまとめてコピーする
+# (compact なら保存時に範囲内で重複したフォントや画像を1つにまとめる)。
+# --workers N なら shard_render と同じく、各ワーカープロセスが初期化時に元のPDFを自分で開き、
+# 受け持った範囲のコピー・保存・書き込みまでを行う。MuPDF のドキュメントはスレッド間でも
+# プロセス間でも共有できないため、重いコピーと保存を並列にするにはプロセスに分ける必要がある。
+# 各ワーカーがメモリに持つのは、処理中の1範囲分の出力だけ。
+
+_WORKER = {}
+
+
+def parse_range(text):
+    """
+    "開始-終了"、"開始-"(最後まで)、"ページ" に "=出力名" を付けられる範囲指定を
+    (開始, 終了 | None, 出力名 | None) にする(ページ番号は1始まり)
+    """
+    spec, _, output = text.partition("=")
+    start, dash, end = spec.strip().partition("-")
+    try:
+        start = int(start)
+        end = (int(end) if end.strip() else None) if dash else start
+    except ValueError:
+        raise ValueError(f"範囲の指定が正しくありません: {text}") from None
+    return start, end, output.strip() or None
+
+
+def load_ranges(path):
+    """
+    範囲指定ファイルを読む
+
+    CSV: 1行に 開始,終了[,出力名](見出し行・空行・# で始まる行は読み飛ばす。終了が空なら最後まで)
+    JSON: [{"start": 1, "end": 30, "output": "第1章.pdf"}, ...] または [[1, 30], [31, 62, "第2章.pdf"], ...]
+    """
+    ranges = []
+    if path.lower().endswith(".json"):
+        with open(path, encoding="utf-8") as f:
+            for item in json.load(f):
+                if isinstance(item, dict):
+                    ranges.append((int(item["start"]), item.get("end"), item.get("output")))
+                else:
+                    start, end, *output = item
+                    ranges.append((int(start), end, output[0] if output else None))
+        return [(start, int(end) if end is not None else None, output) for start, end, output in ranges]
+
+    with open(path, encoding="utf-8-sig", newline="") as f:
+        for row in csv.reader(f):
+            row = [cell.strip() for cell in row]
+            if not row or not row[0] or row[0].startswith("#") or not row[0].isdigit():
+                continue
+            end = row[1] if len(row) > 1 else row[0]
+            output = row[2] if len(row) > 2 and row[2] else None
+            ranges.append((int(row[0]), int(end) if end else None, output))
+    return ranges
+
+
+def copy_range(doc, start_page, end_page):
+    """
+    doc の start_page〜end_page(1始まり、範囲外は切り詰める)を1回の insert_pdf でコピーした新しいドキュメント。
+    コピーするページがなければ None
+    """
+    start_idx = max(start_page - 1, 0)
+    end_idx = min(end_page - 1, doc.page_count - 1)
+    if start_idx > end_idx:
+        return None
+    new_doc = fitz.open()
+    with stage("extract"):
+        new_doc.insert_pdf(doc, from_page=start_idx, to_page=end_idx)
+    return new_doc
+
+
 def extract_pages_to_new_pdf(input_pdf_path, start_page, end_page):
     """
     指定されたPDFからページ範囲を抽出して新しいPDFを作成する関数
@@ -17,23 +104,17 @@ def extract_pages_to_new_pdf(input_pdf_path, start_page, end_page):
         base, ext = os.path.splitext(input_pdf_path)
         output_pdf_path = f"{base}_extracted.pdf"
 
-        # ページ番号を0始まりに変換
-        start_idx = start_page - 1
-        end_idx = end_page - 1
-
-        # PDFオープン
+        # PDFオープン・ページ抽出(範囲外は切り詰める)
         doc = fitz.open(input_pdf_path)
-        new_doc = fitz.open()
-
-        # ページ抽出
-        for page_num in range(start_idx, end_idx + 1):
-            if 0 <= page_num < doc.page_count:
-                new_doc.insert_pdf(doc, from_page=page_num, to_page=page_num)
+        with stage("extract"):
+            select_pages(doc, range(max(start_page - 1, 0), min(end_page, doc.page_count)))
 
-        # 保存
-        new_doc.save(output_pdf_path)
-        new_doc.close()
+        # 保存（範囲外のページだけが使っていたオブジェクトは削除する）
+        with stage("save"):
+            doc.save(output_pdf_path, **SAVE_OPTIONS)
         doc.close()
+        count_input([input_pdf_path])
+        count_output(output_pdf_path)
 
         print(f"成功: {input_pdf_path} の {start_page}〜{end_page} ページを '{output_pdf_path}' に保存しました。")
 
@@ -41,14 +122,143 @@ def extract_pages_to_new_pdf(input_pdf_path, start_page, end_page):
         print(f"エラーが発生しました: {e}")
 
 
-if __name__ == "__main__":
+def _range_text(start, end):
+    """範囲の表示("10〜20"、最後までなら "63〜")"""
+    return f"{start}〜{'' if end is None else end}"
+
+
+def _write_file(path, data):
+    with atomic_output(path) as tmp_path:
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+
+
+def save_range(doc, start, end, path, save_mode=DEFAULT_SAVE_MODE):
+    """doc の start〜end ページを path に保存する。コピーするページがなければ False"""
+    new_doc = copy_range(doc, start, end)
+    if new_doc is None:
+        return False
+    with new_doc:
+        data = pdf_bytes(new_doc, save_mode)
+    _write_file(path, data)
+    return True
+
+
+def _init_worker(pdf_path):
+    _WORKER["doc"] = fitz.open(pdf_path)
+
+
+def _save_range_in_worker(start, end, path, save_mode, trace):
+    """ワーカー側で save_range を実行し、(保存したか, 計測結果) を返す"""
+    instrument.reset(trace)
+    return save_range(_WORKER["doc"], start, end, path, save_mode), instrument.export()
+
+
+def split_pdf(input_pdf_path, ranges, output_dir=None, save_mode=DEFAULT_SAVE_MODE, workers=1):
+    """
+    input_pdf_path を1回だけ開き、ranges の範囲ごとに新しいPDFを作成する
+
+    Args:
+        input_pdf_path (str): 元のPDFファイルのパス
+        ranges (list[tuple[int, int | None, str | None]]): (開始, 終了, 出力名)。終了が None なら最後のページまで、
+            出力名が None なら「元の名前_開始-終了.pdf」
+        output_dir (str | None): 出力先フォルダ(省略時は元のPDFと同じフォルダ。出力名の相対パスもここから)
+        save_mode (str): 保存プロファイル(fast / compact / linear)
+        workers (int): 範囲を分担するプロセス数。1以下ならこのプロセスで順に処理する
+
+    Returns:
+        list[str]: 作成したPDFのパス
+    """
+    base = os.path.splitext(os.path.basename(input_pdf_path))[0]
+    output_dir = output_dir or os.path.dirname(os.path.abspath(input_pdf_path))
+    os.makedirs(output_dir, exist_ok=True)
+
+    doc = fitz.open(input_pdf_path)
+    page_count = doc.page_count
+    # (開始, 指定された終了, コピーする最後のページ, 出力パス)
+    targets = []
+    for start, end, output in ranges:
+        last = page_count if end is None else min(end, page_count)
+        targets.append((start, end, last, os.path.join(output_dir, output or f"{base}_{start}-{last}.pdf")))
+    paths = [os.path.normcase(os.path.abspath(path)) for *_, path in targets]
+    if len(set(paths)) != len(paths):
+        doc.close()
+        raise ValueError("出力ファイル名が重複しています")
+    count_input([input_pdf_path])
+
+    written = []
+
+    def report(start, end, last, path, saved):
+        if not saved:
+            # 切り詰める前の、指定どおりの範囲を表示する
+            print(f"スキップ: {_range_text(start, end)} ページは範囲外です(全 {page_count} ページ)")
+            return
+        count_output(path)
+        written.append(path)
+        print(f"成功: {start}〜{last} ページを '{path}' に保存しました。")
+
+    if workers <= 1:
+        with doc:
+            for start, end, last, path in targets:
+                try:
+                    saved = save_range(doc, start, last, path, save_mode)
+                except Exception as e:
+                    print(f"エラーが発生しました: {path}: {e}")
+                    continue
+                report(start, end, last, path, saved)
+    else:
+        doc.close()
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(input_pdf_path,)) as executor:
+            futures = [executor.submit(_save_range_in_worker, start, last, path, save_mode, instrument.tracing())
+                       for start, _, last, path in targets]
+            for (start, end, last, path), future in zip(targets, futures):
+                try:
+                    saved, data = future.result()
+                except Exception as e:
+                    print(f"エラーが発生しました: {path}: {e}")
+                    continue
+                instrument.merge(data)
+                report(start, end, last, path, saved)
+
+    print(f"{len(written)} / {len(targets)} 個のPDFを作成しました。")
+    return written
+
+
+def main(argv=None):
     # コマンドライン引数の解析
-    if len(sys.argv) != 4:
-        print("使い方: python extract.py <input.pdf> <start_page> <end_page>")
-        sys.exit(1)
+    parser = argparse.ArgumentParser(description="PDFからページ範囲を抽出して新しいPDFを作成する")
+    parser.add_argument("input_pdf")
+    parser.add_argument("start_page", type=int, nargs="?", help="抽出開始ページ番号（1始まり）")
+    parser.add_argument("end_page", type=int, nargs="?", help="抽出終了ページ番号（1始まり）")
+    parser.add_argument("--ranges", nargs="+", metavar="START-END[=NAME]",
+                        help="複数の範囲をまとめて抽出する(例: 1-30 31-62=第2章.pdf 63-)")
+    parser.add_argument("--ranges-file", metavar="SPEC",
+                        help="範囲指定ファイル(CSV: 開始,終了[,出力名] / JSON)から複数の範囲をまとめて抽出する")
+    parser.add_argument("--output-dir", metavar="DIR", help="複数範囲の出力先フォルダ(既定: 元のPDFと同じ)")
+    parser.add_argument("--save-mode", choices=sorted(SAVE_MODES), default=DEFAULT_SAVE_MODE,
+                        help=f"複数範囲の保存プロファイル(既定: {DEFAULT_SAVE_MODE})")
+    parser.add_argument("--workers", type=int, default=1, metavar="N",
+                        help="複数範囲のコピー・保存を分担するプロセス数")
+    add_profile_arguments(parser)
+    args = parser.parse_args(argv)
 
-    input_pdf = sys.argv[1]
-    start_page = int(sys.argv[2])
-    end_page = int(sys.argv[3])
+    batch = args.ranges or args.ranges_file
+    if not batch and (args.start_page is None or args.end_page is None):
+        parser.error("start_page と end_page、または --ranges / --ranges-file を指定してください")
 
-    extract_pages_to_new_pdf(input_pdf, start_page, end_page)
+    with profiling(args):
+        if not batch:
+            extract_pages_to_new_pdf(args.input_pdf, args.start_page, args.end_page)
+            return
+        try:
+            ranges = [parse_range(text) for text in args.ranges or []]
+            if args.ranges_file:
+                ranges += load_ranges(args.ranges_file)
+            split_pdf(args.input_pdf, ranges, args.output_dir, args.save_mode, args.workers)
+        except Exception as e:
+            print(f"エラーが発生しました: {e}")
+
+
+if __name__ == "__main__":
+    main()
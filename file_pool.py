@@ -0,0 +1,176 @@
+import contextlib
+import io
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+import instrument
+
+# file_pool.py
+# 互いに独立したファイル単位の処理をプロセスプールに分散する。
+# 各ファイルの print 出力はワーカー側で取り込み、投入した順にまとめて表示するため、
+# 並列に実行してもログが混ざらない。1ファイルが失敗しても残りの処理は続行する。
+# ワーカーでの計測(instrument)も結果と一緒に戻し、親プロセスの集計に加える。
+#
+# ワーカーが異常終了した場合(MuPDF のクラッシュやメモリ不足で強制終了されたときなど)、プールは壊れ、
+# 実行中・待機中のジョブはすべて BrokenProcessPool で終わる。どのジョブが原因かは分からないため、
+# 巻き込まれたジョブを1件ずつ新しい1プロセスのプールで実行し直し(IsolatedRunner)、
+# 単独で実行しても BROKEN_POOL_ATTEMPTS 回異常終了したジョブだけを失敗にする。
+
+BROKEN_POOL_ATTEMPTS = 2
+WORKER_DIED = "ワーカープロセスが異常終了しました"
+
+
+def run_captured(func, args, trace=False):
+    """func(*args) を実行し (成功したか, 出力ログ, エラー内容, 計測結果) を返す"""
+    log = io.StringIO()
+    instrument.reset(trace)
+    try:
+        with contextlib.redirect_stdout(log):
+            func(*args)
+        return True, log.getvalue(), None, instrument.export()
+    except Exception as e:
+        return False, log.getvalue(), f"{type(e).__name__}: {e}", instrument.export()
+
+
+class IsolatedRunner:
+    """
+    壊れたプールに巻き込まれたジョブを、1件ずつ新しい1プロセスのプールで実行し直す
+
+    同時に実行するのは常に1件だけなので、プールが壊れればそのジョブが原因と分かる。
+
+    Args:
+        trace (bool): ワーカーでイベントを記録するか
+    """
+
+    def __init__(self, trace=False):
+        self.trace = trace
+        self._queue = deque()
+        self._current = None  # (executor, future, key, func, args, 異常終了した回数)
+
+    def add(self, key, func, args):
+        """func(*args) を単独実行の待ち行列に加える。key は結果と一緒に返す"""
+        self._queue.append((key, func, args, 0))
+
+    def __bool__(self):
+        return self._current is not None or bool(self._queue)
+
+    def keys(self):
+        """実行中・待機中のジョブの key"""
+        keys = [key for key, _, _, _ in self._queue]
+        if self._current is not None:
+            keys.insert(0, self._current[2])
+        return keys
+
+    def future(self):
+        """実行中のジョブの future(なければ None)"""
+        return None if self._current is None else self._current[1]
+
+    def poll(self, block=False):
+        """
+        実行中のジョブが終わっていれば (key, (成功したか, 出力ログ, エラー内容)) を返し、次のジョブを始める
+
+        Args:
+            block (bool): True なら実行中のジョブが終わるまで待つ
+
+        Returns:
+            tuple | None: 終わったジョブがなければ(異常終了して再実行に回した場合も) None
+        """
+        if self._current is None:
+            if not self._queue:
+                return None
+            key, func, args, died = self._queue.popleft()
+            executor = ProcessPoolExecutor(max_workers=1)
+            future = executor.submit(run_captured, func, args, self.trace)
+            self._current = (executor, future, key, func, args, died)
+        executor, future, key, func, args, died = self._current
+        if not block and not future.done():
+            return None
+        self._current = None
+        try:
+            ok, log, error, data = future.result()
+            instrument.merge(data)
+        except BrokenProcessPool:
+            executor.shutdown(wait=False)
+            died += 1
+            if died < BROKEN_POOL_ATTEMPTS:
+                self._queue.appendleft((key, func, args, died))
+                return None
+            return key, (False, "", WORKER_DIED)
+        except Exception as e:
+            ok, log, error = False, "", f"{type(e).__name__}: {e}"
+        executor.shutdown()
+        return key, (ok, log, error)
+
+
+def run_file_jobs(func, jobs, workers=1, on_success=None):
+    """
+    jobs の各要素 (名前, 引数タプル) について func(*引数) を実行する
+
+    Args:
+        func: ファイル1つ分の処理(プロセス間で渡せるようモジュールの最上位に定義すること)
+        jobs (list[tuple[str, tuple]]): 処理する順の (表示名, 引数)
+        workers (int): ワーカープロセス数。1以下ならこのプロセスで順に実行する
+        on_success: 成功したジョブごとに、終わった時点で (表示名, 引数) を渡して呼ぶ関数(親プロセスで実行)
+
+    Returns:
+        list[tuple[str, str]]: 失敗したジョブの (表示名, エラー内容)
+    """
+    failures = []
+
+    def report(name, ok, log, error):
+        print(log, end="")
+        if not ok:
+            print(f"[NG] {name}: {error}")
+            failures.append((name, error))
+
+    if workers <= 1:
+        for name, args in jobs:
+            try:
+                func(*args)
+            except Exception as e:
+                report(name, False, "", f"{type(e).__name__}: {e}")
+            else:
+                if on_success is not None:
+                    on_success(name, args)
+    else:
+        results = {}
+        printed = 0
+        isolated = IsolatedRunner(instrument.tracing())
+
+        def finish(i, result):
+            nonlocal printed
+            results[i] = result
+            if result[0] and on_success is not None:
+                on_success(*jobs[i])
+            # ログは投入した順に表示する
+            while printed in results:
+                report(jobs[printed][0], *results.pop(printed))
+                printed += 1
+
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(run_captured, func, args, instrument.tracing()): i
+                       for i, (_, args) in enumerate(jobs)}
+            for future in as_completed(futures):
+                i = futures[future]
+                try:
+                    ok, log, error, data = future.result()
+                    instrument.merge(data)
+                except BrokenProcessPool:
+                    # 原因かどうか分からないので、ここでは失敗にしない
+                    isolated.add(i, func, jobs[i][1])
+                    continue
+                except Exception as e:
+                    ok, log, error = False, "", f"{type(e).__name__}: {e}"
+                finish(i, (ok, log, error))
+        if isolated:
+            print(f"{WORKER_DIED}。{len(isolated.keys())} 件を1件ずつ新しいプロセスで再実行します")
+        while isolated:
+            done = isolated.poll(block=True)
+            if done is not None:
+                finish(*done)
+
+    print(f"完了: {len(jobs) - len(failures)} / {len(jobs)} 件")
+    for name, error in failures:
+        print(f"  失敗: {name} ({error})")
+    return failures
@@ -0,0 +1,192 @@
+import contextlib
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+import fitz  # PyMuPDF
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# instrument.py
+# 処理段階(デコード・リサイズ・レンダリング・白紙判定・エンコード・保存など)ごとの回数と時間、
+# ページ数・読み書きしたバイト数・キャッシュヒット・削除した白紙ページなどのカウンタを集計する。
+#
+#   --profile          終了時に段階ごとの表とカウンタ、ピークRSSを表示する
+#   --trace out.json   Chrome のトレース形式で書き出す(Perfetto や chrome://tracing で表示できる)
+#
+# 集計は常に行う(1回あたり数マイクロ秒)。トレースのイベントは --trace のときだけ保持する。
+# --workers などの子プロセスでの集計は、file_pool / shard_render が結果と一緒に親へ戻して合算する。
+
+_lock = threading.Lock()
+_stages = {}        # 段階名 → [回数, 合計秒]
+_counters = Counter()
+_events = None      # --trace のときだけ list
+_thread_names = {}  # (pid, tid) → スレッド名
+
+
+def reset(trace=False):
+    """集計を空にする(trace=True ならトレースのイベントも記録する)"""
+    global _events
+    with _lock:
+        _stages.clear()
+        _counters.clear()
+        _thread_names.clear()
+        _events = [] if trace else None
+
+
+def tracing() -> bool:
+    return _events is not None
+
+
+@contextlib.contextmanager
+def stage(name):
+    """with ブロックの時間を段階 name として記録する(スレッドから呼んでもよい)"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        end = time.perf_counter()
+        with _lock:
+            entry = _stages.setdefault(name, [0, 0.0])
+            entry[0] += 1
+            entry[1] += end - start
+            if _events is not None:
+                thread = threading.current_thread()
+                key = (os.getpid(), thread.ident)
+                _thread_names.setdefault(key, thread.name)
+                _events.append({"name": name, "ph": "X", "pid": key[0], "tid": key[1],
+                                "ts": start * 1e6, "dur": (end - start) * 1e6})
+
+
+def count(name, n=1):
+    """カウンタ name に n を加える"""
+    with _lock:
+        _counters[name] += n
+
+
+def count_input(paths):
+    """入力ファイルの数とバイト数を数える"""
+    for path in paths:
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            continue
+        count("files_read")
+        count("bytes_read", size)
+
+
+def count_output(path):
+    """出力PDFのバイト数とページ数を数える"""
+    if not os.path.isfile(path):
+        return
+    count("bytes_written", os.path.getsize(path))
+    with fitz.open(path) as doc:
+        count("pages_written", doc.page_count)
+
+
+def peak_rss_mb(children=False):
+    """このプロセス(children=True なら終了した子プロセスの最大)のピークRSS(MB)。取得できなければ None"""
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF)
+    # ru_maxrss は Linux では KB、macOS ではバイト
+    scale = 1 if sys.platform == "darwin" else 1024
+    return usage.ru_maxrss * scale / (1024 * 1024)
+
+
+def export():
+    """子プロセスから親へ戻す集計"""
+    with _lock:
+        return {
+            "stages": {name: list(entry) for name, entry in _stages.items()},
+            "counters": dict(_counters),
+            "events": list(_events) if _events is not None else None,
+            "threads": [[pid, tid, name] for (pid, tid), name in _thread_names.items()],
+        }
+
+
+def merge(data):
+    """export() の結果をこのプロセスの集計に加える"""
+    with _lock:
+        for name, (n, seconds) in data["stages"].items():
+            entry = _stages.setdefault(name, [0, 0.0])
+            entry[0] += n
+            entry[1] += seconds
+        _counters.update(data["counters"])
+        if _events is not None and data["events"]:
+            _events.extend(data["events"])
+            for pid, tid, name in data["threads"]:
+                _thread_names.setdefault((pid, tid), name)
+
+
+def summary_table() -> str:
+    """
+    段階ごとの回数・合計時間・平均時間とカウンタ、ピークRSSの表
+
+    スレッドや子プロセスで並列に実行した段階は時間を合計するため、total より長くなることがある。
+    peak_rss_mb_child は終了した子プロセスのうち最大のもの。
+    """
+    with _lock:
+        # total を先頭に、残りは合計時間の長い順
+        stages = sorted(_stages.items(), key=lambda item: (item[0] != "total", -item[1][1]))
+        counters = sorted(_counters.items())
+    lines = [f"{'stage':16s} {'count':>8s} {'total s':>10s} {'avg ms':>10s}"]
+    for name, (n, seconds) in stages:
+        lines.append(f"{name:16s} {n:8d} {seconds:10.3f} {seconds / n * 1000 if n else 0:10.2f}")
+    if counters:
+        lines.append("")
+        for name, value in counters:
+            lines.append(f"{name:16s} {value:>12,}")
+    rss = peak_rss_mb()
+    if rss is not None:
+        lines.append("")
+        lines.append(f"{'peak_rss_mb':16s} {rss:12.1f}")
+        children = peak_rss_mb(children=True)
+        if children:
+            lines.append(f"{'peak_rss_mb_child':16s} {children:12.1f}")
+    return "\n".join(lines)
+
+
+def write_trace(path):
+    """Chrome のトレース形式(JSON)で書き出す"""
+    with _lock:
+        events = list(_events or [])
+        names = [{"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": name}}
+                 for (pid, tid), name in _thread_names.items()]
+        counters = dict(_counters)
+    trace = {
+        "traceEvents": names + events,
+        "displayTimeUnit": "ms",
+        "otherData": {"counters": counters, "peak_rss_mb": peak_rss_mb()},
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(trace, f)
+
+
+def add_profile_arguments(parser):
+    """--profile / --trace を parser に追加する"""
+    parser.add_argument("--profile", action="store_true",
+                        help="終了時に処理段階ごとの時間・カウンタ・ピークRSSを表にして表示する")
+    parser.add_argument("--trace", metavar="OUT.json",
+                        help="処理段階のタイムラインを Chrome のトレース形式で書き出す")
+
+
+@contextlib.contextmanager
+def profiling(args):
+    """main の処理全体を囲み、--profile / --trace に従って結果を出力する"""
+    reset(trace=bool(args.trace))
+    try:
+        with stage("total"):
+            yield
+    finally:
+        if args.profile:
+            print(summary_table())
+        if args.trace:
+            write_trace(args.trace)
+            print(f"トレースを保存しました: {args.trace}")
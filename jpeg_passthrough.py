@@ -0,0 +1,91 @@
+from PIL import Image
+
+from pdf_stream_writer import EncodedImage, encode_image
+from scan_decode import TRANSPOSED_ORIENTATIONS, exif_orientation
+
+# jpeg_passthrough.py
+# 元のJPEGストリームを再エンコードせずにPDFの画像XObjectとして埋め込む。
+# B5への拡大・中央トリミングとEXIFの回転/反転は、画素ではなく
+# PDFの配置行列とクリップ矩形で表現する。
+
+# 埋め込めるJPEGのモードと PDF の色空間
+PASSTHROUGH_COLORSPACES = {
+    "L": "DeviceGray",
+    "RGB": "DeviceRGB",
+    "CMYK": "DeviceCMYK",
+}
+
+# EXIF方向ごとの、格納画像の単位正方形 → 表示向きの単位正方形 の行列 (a, b, c, d, e, f)
+ORIENTATION_MATRICES = {
+    1: (1, 0, 0, 1, 0, 0),
+    2: (-1, 0, 0, 1, 1, 0),     # 左右反転
+    3: (-1, 0, 0, -1, 1, 1),    # 180度
+    4: (1, 0, 0, -1, 0, 1),     # 上下反転
+    5: (0, -1, -1, 0, 1, 1),    # 転置
+    6: (0, -1, 1, 0, 0, 1),     # 時計回りに90度
+    7: (0, 1, 1, 0, 0, 0),      # 反転転置
+    8: (0, 1, -1, 0, 1, 0),     # 反時計回りに90度
+}
+
+
+def load_passthrough_jpeg(path: str):
+    """
+    JPEGファイルをデコードせずに読み込み (EncodedImage, EXIF方向) を返す
+
+    そのまま埋め込めない画像(JPEG以外、未対応のモード)なら None
+    """
+    with Image.open(path) as img:
+        if img.format != "JPEG" or img.mode not in PASSTHROUGH_COLORSPACES:
+            return None
+        orientation = exif_orientation(img)
+        width, height, mode = img.width, img.height, img.mode
+
+    with open(path, "rb") as f:
+        data = f.read()
+
+    # Pillow と同じく Adobe の CMYK JPEG は反転して格納されているものとして扱う
+    decode = (1, 0) * 4 if mode == "CMYK" else None
+    image = EncodedImage(width, height, PASSTHROUGH_COLORSPACES[mode], 8, "DCTDecode", data, decode)
+    return image, orientation
+
+
+def cover_matrix(size, orientation, box):
+    """
+    格納サイズ size の画像を向き補正し、box (x, y, 幅, 高さ) 全体を覆うよう
+    拡大・中央配置する行列を返す(はみ出した部分はクリップで切り落とす)
+    """
+    width, height = size
+    if orientation in TRANSPOSED_ORIENTATIONS:
+        width, height = height, width
+    box_x, box_y, box_w, box_h = box
+
+    scale = max(box_w / width, box_h / height)
+    placed_w = width * scale
+    placed_h = height * scale
+    offset_x = box_x + (box_w - placed_w) / 2
+    offset_y = box_y + (box_h - placed_h) / 2
+
+    a, b, c, d, e, f = ORIENTATION_MATRICES.get(orientation, ORIENTATION_MATRICES[1])
+    return (
+        a * placed_w, b * placed_h,
+        c * placed_w, d * placed_h,
+        e * placed_w + offset_x, f * placed_h + offset_y,
+    )
+
+
+def place_scan(writer, path: str, box, fallback):
+    """
+    スキャン画像をページ上の box に埋め込み、add_page 用の配置を返す
+
+    そのまま埋め込めない画像は fallback(path) で得たボックスサイズの画像を
+    JPEGエンコードして埋め込む。
+    """
+    loaded = load_passthrough_jpeg(path)
+    if loaded is None:
+        image = encode_image(fallback(path))
+        box_x, box_y, box_w, box_h = box
+        return writer.add_image(image), (box_w, 0, 0, box_h, box_x, box_y), box
+
+    image, orientation = loaded
+    image_id = writer.add_image(image)
+    return image_id, cover_matrix((image.width, image.height), orientation, box), box
@@ -1,6 +1,18 @@
+import argparse
+import functools
 import os
-import sys
-from PIL import Image, ImageOps
+from PIL import Image
+
+from build_manifest import BuildManifest, atomic_output
+from file_pool import run_file_jobs
+from instrument import add_profile_arguments, count_input, count_output, profiling, stage
+from jpeg_passthrough import place_scan
+from page_encoding import PageEncoder, add_encoding_arguments, encoder_from_args
+from page_pipeline import ordered_map, pairs
+from pdf_stream_writer import StreamingPdfWriter, pages_within_budget
+from prefetch import DEFAULT_PREFETCH_MB, add_prefetch_arguments, image_sources, prefetched
+from scan_decode import fit_cover, request_draft
+from scan_plan import add_plan_arguments, jpg_folder_cost, list_files, list_subfolders, plan_jobs
 
 # === constant: B5 at 400dpi ===
 DPI = 400
@@ -13,53 +25,134 @@ B5_SIZE = (B5_WIDTH_PX, B5_HEIGHT_PX)
 B4_WIDTH_PX = B5_WIDTH_PX * 2
 B4_HEIGHT_PX = B5_HEIGHT_PX
 B4_SIZE = (B4_WIDTH_PX, B4_HEIGHT_PX)
+B5_PAGE_BYTES = B5_WIDTH_PX * B5_HEIGHT_PX * 3
 
 
-def open_with_orientation(path: str) -> Image.Image:
-    """Read JPG considering EXIF rotation."""
+def make_2in1_b4_page(img1: Image.Image, img2: Image.Image) -> Image.Image:
+    """Combine two B5 images into a single B4 (landscape) page."""
+    canvas = Image.new("RGB", B4_SIZE, (255, 255, 255))
+    canvas.paste(img1, (0, 0))
+    canvas.paste(img2, (B5_WIDTH_PX, 0))
+    return canvas
+
+
+def load_b5_page(path, draft: bool = False, reducing_gap: float | None = None) -> Image.Image:
+    """
+    Read a JPG (path or prefetched file object) as a B5 page (EXIF rotation, resize and
+    center-crop); None gives the white padding page.
+
+    draft: DCT-scaled decode down to B5. reducing_gap: rotate, crop and resample
+    in a single resize (faster, not pixel-identical to the default).
+    """
+    if path is None:
+        return Image.new("RGB", B5_SIZE, (255, 255, 255))
     img = Image.open(path)
-    img = ImageOps.exif_transpose(img)
-    return img.convert("RGB")
+    if draft:
+        request_draft(img, B5_SIZE)
+    with stage("decode"):
+        img.load()
+    with stage("resize"):
+        return fit_cover(img, B5_SIZE, reducing_gap)
+
+
+def load_2in1_sheet(pair, draft: bool = False, reducing_gap: float | None = None) -> Image.Image:
+    """Build one B4 sheet from a (left, right) pair of JPG paths."""
+    left, right = pair
+    return make_2in1_b4_page(load_b5_page(left, draft, reducing_gap),
+                             load_b5_page(right, draft, reducing_gap))
+
+
+def write_2in1_pdf(output_pdf, paths, stream=False, budget_pages=None, jobs=1, draft=False,
+                   passthrough=False, title=None, encoder=None, reducing_gap=None, imposition="canvas",
+                   prefetcher=None):
+    """Write the B4 2in1 PDF for the given JPG paths to output_pdf."""
+    # Each sheet is encoded as colour, grayscale or bilevel depending on its content
+    encoder = encoder or PageEncoder()
+    load_page = functools.partial(load_b5_page, draft=draft, reducing_gap=reducing_gap)
+    if passthrough:
+        # Embed the original JPEG streams; fit, crop and rotation are done with
+        # placement matrices and one clip rectangle per half sheet
+        half_boxes = [(0, 0, B5_WIDTH_PX, B5_HEIGHT_PX), (B5_WIDTH_PX, 0, B5_WIDTH_PX, B5_HEIGHT_PX)]
+        with StreamingPdfWriter(output_pdf, dpi=DPI) as writer:
+            for pair in pairs(paths):
+                placements = [
+                    place_scan(writer, path, box, load_page)
+                    for path, box in zip(pair, half_boxes)
+                    if path is not None
+                ]
+                writer.add_page(B4_WIDTH_PX, B4_HEIGHT_PX, placements)
+        return
 
+    # Read from the prefetched buffers when a prefetcher is given
+    sources = image_sources(paths, prefetcher)
+
+    if imposition == "xobject":
+        # Encode each B5 page on its own and place the two images side by side on the
+        # B4 page: no B4 canvas is composed, and the padding half of an odd count stays empty
+        half_matrices = [(B5_WIDTH_PX, 0, 0, B5_HEIGHT_PX, 0, 0),
+                         (B5_WIDTH_PX, 0, 0, B5_HEIGHT_PX, B5_WIDTH_PX, 0)]
+        with StreamingPdfWriter(output_pdf, dpi=DPI) as writer:
+            encoded_pages = ordered_map(lambda source: encoder.encode(load_page(source)), sources, jobs,
+                                        window=budget_pages)
+            image_ids = []
+            for encoded in encoded_pages:
+                image_ids.append(writer.add_image(encoded))
+                if len(image_ids) == 2:
+                    writer.add_page(B4_WIDTH_PX, B4_HEIGHT_PX, list(zip(image_ids, half_matrices)))
+                    image_ids = []
+            if image_ids:
+                writer.add_page(B4_WIDTH_PX, B4_HEIGHT_PX, list(zip(image_ids, half_matrices)))
+        return
 
-def fill_to_b5(image: Image.Image) -> Image.Image:
-    """Fit image into B5 by resizing and center-cropping."""
-    img = image.convert("RGB")
-    img_ratio = img.width / img.height
-    b5_ratio = B5_WIDTH_PX / B5_HEIGHT_PX
+    if stream:
+        # Build and append one B4 sheet at a time (sheets built in parallel when jobs > 1)
+        window = None if budget_pages is None else max(1, budget_pages // 2)
+        with StreamingPdfWriter(output_pdf, dpi=DPI) as writer:
+            def build_sheet(pair):
+                return encoder.encode(load_2in1_sheet(pair, draft, reducing_gap))
 
-    if img_ratio > b5_ratio:
-        new_height = B5_HEIGHT_PX
-        new_width = int(new_height * img_ratio)
-    else:
-        new_width = B5_WIDTH_PX
-        new_height = int(new_width / img_ratio)
+            sheets = ordered_map(build_sheet, pairs(sources), jobs, window=window)
+            for encoded in sheets:
+                writer.add_image_page(encoded)
+        return
 
-    img = img.resize((new_width, new_height), Image.LANCZOS)
+    # Convert each JPG into B5 image
+    b5_images = list(ordered_map(load_page, sources, jobs))
 
-    left = (new_width - B5_WIDTH_PX) // 2
-    top = (new_height - B5_HEIGHT_PX) // 2
-    right = left + B5_WIDTH_PX
-    bottom = top + B5_HEIGHT_PX
+    # If odd count, add a white B5 blank page
+    if len(b5_images) % 2 == 1:
+        b5_images.append(Image.new("RGB", B5_SIZE, (255, 255, 255)))
 
-    return img.crop((left, top, right, bottom))
+    # Create list of B4 pages (classified and converted on the worker threads)
+    def build_sheet(i):
+        return encoder.prepare(make_2in1_b4_page(b5_images[i], b5_images[i + 1]))
 
+    b4_pages = list(ordered_map(build_sheet, range(0, len(b5_images), 2), jobs))
 
-def make_2in1_b4_page(img1: Image.Image, img2: Image.Image) -> Image.Image:
-    """Combine two B5 images into a single B4 (landscape) page."""
-    canvas = Image.new("RGB", B4_SIZE, (255, 255, 255))
-    canvas.paste(img1, (0, 0))
-    canvas.paste(img2, (B5_WIDTH_PX, 0))
-    return canvas
+    # Save PDF
+    first_page = b4_pages[0]
+    rest_pages = b4_pages[1:]
+
+    with stage("save"):
+        first_page.save(
+            output_pdf,
+            save_all=True,
+            append_images=rest_pages,
+            resolution=DPI,
+            title=title,
+            **encoder.pillow_save_options(b4_pages),
+        )
 
 
-def jpgs_to_pdf_2in1(input_dir):
+def jpgs_to_pdf_2in1(input_dir, stream=False, max_memory=None, jobs=1, draft=False,
+                     passthrough=False, incremental=False, encoder=None, reducing_gap=None,
+                     imposition="canvas", prefetch=0, prefetch_mb=DEFAULT_PREFETCH_MB):
     if not os.path.isdir(input_dir):
         print(f"指定されたディレクトリが存在しません: {input_dir}")
         return
 
-    files = [f for f in os.listdir(input_dir) if f.lower().endswith(".jpg")]
-    files.sort()
+    # Natural order, so that scan2.jpg comes before scan10.jpg
+    files = list_files(input_dir, ".jpg")
 
     if not files:
         print(f"JPGファイルが見つかりません: {input_dir}")
@@ -70,39 +163,90 @@ def jpgs_to_pdf_2in1(input_dir):
     parent_dir = os.path.dirname(os.path.normpath(input_dir))
     output_pdf = os.path.join(parent_dir, f"{dir_name}_2in1_B4.pdf")
 
-    # Convert each JPG into B5 image
-    b5_images = [
-        fill_to_b5(open_with_orientation(os.path.join(input_dir, f)))
-        for f in files
-    ]
-
-    # If odd count, add a white B5 blank page
-    if len(b5_images) % 2 == 1:
-        b5_images.append(Image.new("RGB", B5_SIZE, (255, 255, 255)))
+    # B5 images plus B4 sheets held at once: about two B5 pages per input file
+    budget_pages = pages_within_budget(B5_PAGE_BYTES, max_memory)
+    if budget_pages is not None and len(files) * 2 > budget_pages:
+        stream = True
+
+    paths = [os.path.join(input_dir, f) for f in files]
+
+    # Skip when inputs and options match the manifest next to the output
+    encoder = encoder or PageEncoder()
+    encoder.stats.clear()
+    options = {"tool": "jpgs_to_pdf_b4_2in1", "draft": draft, "passthrough": passthrough,
+               "reducing_gap": reducing_gap, "imposition": imposition,
+               **encoder.options()}
+    manifest = BuildManifest(parent_dir) if incremental else None
+    if manifest is not None and manifest.is_current(output_pdf, paths, options):
+        print(f"変更がないためスキップしました: {output_pdf}")
+        return
 
-    # Create list of B4 pages
-    b4_pages = []
-    for i in range(0, len(b5_images), 2):
-        page = make_2in1_b4_page(b5_images[i], b5_images[i + 1])
-        b4_pages.append(page)
+    # Read the next files in the background while pages are converted (passthrough reads the files itself)
+    prefetcher = None if passthrough else prefetched(paths, prefetch, prefetch_mb)
 
-    # Save PDF
-    first_page = b4_pages[0]
-    rest_pages = b4_pages[1:]
-
-    first_page.save(
-        output_pdf,
-        save_all=True,
-        append_images=rest_pages,
-        resolution=DPI,
-    )
+    # Write to a temporary file and move it into place only when complete
+    with atomic_output(output_pdf) as tmp_pdf:
+        write_2in1_pdf(tmp_pdf, paths, stream, budget_pages, jobs, draft, passthrough,
+                       title=os.path.splitext(os.path.basename(output_pdf))[0], encoder=encoder,
+                       reducing_gap=reducing_gap, imposition=imposition, prefetcher=prefetcher)
+    if manifest is not None:
+        manifest.record(output_pdf, paths, options)
+    count_input(paths)
+    count_output(output_pdf)
 
     print(f"PDFを作成しました: {output_pdf}")
+    if not passthrough:
+        print(f"  {encoder.summary()}")
+    if prefetcher is not None:
+        print(f"  {prefetcher.summary()}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="ディレクトリ内のJPGをB5 2in1のB4 PDFにまとめる")
+    parser.add_argument("input_dirs", nargs="+", metavar="input_dir", help="画像ディレクトリ(複数可)")
+    parser.add_argument("--subfolders", action="store_true",
+                        help="treat each immediate subfolder of the given directories as an image directory")
+    parser.add_argument("--workers", type=int, default=1, metavar="N",
+                        help="number of processes converting folders in parallel (largest folders first)")
+    parser.add_argument("--stream", action="store_true",
+                        help="append one B4 sheet at a time instead of holding every page in memory")
+    parser.add_argument("--max-memory", type=float, metavar="MB",
+                        help="memory budget for page images; switches to --stream when exceeded")
+    parser.add_argument("--jobs", type=int, default=1, metavar="N",
+                        help="worker threads for page conversion (output order is preserved)")
+    parser.add_argument("--draft", action="store_true",
+                        help="DCT-scaled JPEG decode down to the B5 size before resizing")
+    parser.add_argument("--passthrough", action="store_true",
+                        help="embed the original JPEG streams without re-encoding")
+    parser.add_argument("--imposition", choices=["canvas", "xobject"], default="canvas",
+                        help="canvas: compose each B4 sheet as one image / xobject: place the two "
+                             "B5 images side by side without a B4 canvas (smaller, less memory)")
+    parser.add_argument("--reducing-gap", type=float, metavar="GAP",
+                        help="rotate, crop and resample in one resize (faster, slightly different pixels); "
+                             "large reductions are first done by an integer factor leaving GAP (e.g. 3.0)")
+    parser.add_argument("--incremental", action="store_true",
+                        help="do nothing when the JPGs and options are unchanged since the last run")
+    add_encoding_arguments(parser)
+    add_prefetch_arguments(parser)
+    add_plan_arguments(parser)
+    add_profile_arguments(parser)
+    args = parser.parse_args(argv)
+
+    with profiling(args):
+        input_dirs = args.input_dirs
+        if args.subfolders:
+            input_dirs = list_subfolders(input_dirs)
+
+        # Keep going with the remaining folders when one of them fails
+        convert = functools.partial(jpgs_to_pdf_2in1, stream=args.stream, max_memory=args.max_memory,
+                                    jobs=args.jobs, draft=args.draft, passthrough=args.passthrough,
+                                    incremental=args.incremental, encoder=encoder_from_args(args),
+                                    reducing_gap=args.reducing_gap, imposition=args.imposition,
+                                    prefetch=args.prefetch, prefetch_mb=args.prefetch_mb)
+        jobs = plan_jobs([(input_dir, (input_dir,)) for input_dir in input_dirs], jpg_folder_cost,
+                         args.workers, args.plan)
+        run_file_jobs(convert, jobs, args.workers)
 
 
 if __name__ == "__main__":
-    if len(sys.argv) != 2:
-        print("使い方: python jpgs_to_pdf_b4_2in1.py <画像ディレクトリ>")
-        sys.exit(1)
-
-    jpgs_to_pdf_2in1(sys.argv[1])
+    main()
@@ -1,6 +1,18 @@
+import argparse
+import functools
 import os
-import sys
-from PIL import Image, ImageOps
+from PIL import Image
+
+from build_manifest import BuildManifest, atomic_output
+from file_pool import run_file_jobs
+from instrument import add_profile_arguments, count_input, count_output, profiling, stage
+from jpeg_passthrough import place_scan
+from page_encoding import PageEncoder, add_encoding_arguments, encoder_from_args
+from page_pipeline import ordered_map
+from pdf_stream_writer import StreamingPdfWriter, pages_within_budget
+from prefetch import DEFAULT_PREFETCH_MB, add_prefetch_arguments, image_sources, prefetched
+from scan_decode import fit_cover, request_draft
+from scan_plan import add_plan_arguments, jpg_folder_cost, list_files, list_subfolders, plan_jobs
 
 # jpgs_to_pdf_b5.py
 # ディレクトリ内のJPG画像を読み込み、EXIFの回転情報を考慮してB5サイズに拡大・中央トリミングし、1つのPDFにまとめる。
@@ -11,49 +23,32 @@ DPI = 400
 B5_WIDTH_PX = int(182 / 25.4 * DPI)
 B5_HEIGHT_PX = int(257 / 25.4 * DPI)
 B5_SIZE = (B5_WIDTH_PX, B5_HEIGHT_PX)
+B5_PAGE_BYTES = B5_WIDTH_PX * B5_HEIGHT_PX * 3
 
-def open_with_orientation(path: str) -> Image.Image:
-    """EXIFの回転情報を考慮して画像を開く"""
-    img = Image.open(path)
-    img = ImageOps.exif_transpose(img)
-    return img.convert("RGB")
-
-def fill_to_b5(image: Image.Image) -> Image.Image:
+def load_b5_page(path, draft: bool = False, reducing_gap: float | None = None) -> Image.Image:
     """
-    画像をB5サイズに合わせて拡大・中央トリミングする(余白なし)
+    JPG(パスまたは先読みしたファイルオブジェクト)を読み込み、EXIFの回転情報を考慮してB5サイズに拡大・中央トリミングする(余白なし)
+
+    draft=True ならB5に必要な解像度までJPEGを縮小デコードする。
+    reducing_gap を指定すると回転・切り出し・リサンプルを1回の resize で行う(高速・わずかに近似)
     """
-    img = image.convert("RGB")
-    img_ratio = img.width / img.height
-    b5_ratio = B5_WIDTH_PX / B5_HEIGHT_PX
-
-    # 拡大・トリミング方式
-    if img_ratio > b5_ratio:
-        # 横長 → 高さをB5に合わせて横をトリミング
-        new_height = B5_HEIGHT_PX
-        new_width = int(new_height * img_ratio)
-    else:
-        # 縦長 → 幅をB5に合わせて上下をトリミング
-        new_width = B5_WIDTH_PX
-        new_height = int(new_width / img_ratio)
-
-    img = img.resize((new_width, new_height), Image.LANCZOS)
-
-    # 中央をB5サイズで切り出し
-    left = (new_width - B5_WIDTH_PX) // 2
-    top = (new_height - B5_HEIGHT_PX) // 2
-    right = left + B5_WIDTH_PX
-    bottom = top + B5_HEIGHT_PX
-    img = img.crop((left, top, right, bottom))
-
-    return img
-
-def jpgs_to_pdf(input_dir):
+    img = Image.open(path)
+    if draft:
+        request_draft(img, B5_SIZE)
+    with stage("decode"):
+        img.load()
+    with stage("resize"):
+        return fit_cover(img, B5_SIZE, reducing_gap)
+
+def jpgs_to_pdf(input_dir, stream=False, max_memory=None, jobs=1, draft=False, passthrough=False,
+                incremental=False, encoder=None, reducing_gap=None, prefetch=0,
+                prefetch_mb=DEFAULT_PREFETCH_MB):
     if not os.path.isdir(input_dir):
         print(f"指定されたディレクトリが存在しません: {input_dir}")
         return
 
-    files = [f for f in os.listdir(input_dir) if f.lower().endswith('.jpg')]
-    files.sort()
+    # scan2.jpg が scan10.jpg より前になるよう自然順に並べる
+    files = list_files(input_dir, ".jpg")
 
     if not files:
         print(f"JPGファイルが見つかりません: {input_dir}")
@@ -63,17 +58,106 @@ def jpgs_to_pdf(input_dir):
     parent_dir = os.path.dirname(os.path.normpath(input_dir))
     output_pdf = os.path.join(parent_dir, f"{dir_name}.pdf")
 
-    first_image = fill_to_b5(open_with_orientation(os.path.join(input_dir, files[0])))
-    images = [fill_to_b5(open_with_orientation(os.path.join(input_dir, f))) for f in files[1:]]
+    # 全ページを保持するとメモリ予算を超える場合はストリーミング出力に切り替える
+    budget_pages = pages_within_budget(B5_PAGE_BYTES, max_memory)
+    if budget_pages is not None and len(files) > budget_pages:
+        stream = True
+
+    paths = [os.path.join(input_dir, f) for f in files]
+    load_page = functools.partial(load_b5_page, draft=draft, reducing_gap=reducing_gap)
+    # ページごとに カラー/グレー/白黒2値 を判定してエンコードする
+    encoder = encoder or PageEncoder()
+    encoder.stats.clear()
+
+    # 入力とオプションが前回と同じならスキップする(マニフェストは出力先に置く)
+    options = {"tool": "jpgs_to_pdf_b5", "draft": draft, "passthrough": passthrough,
+               "reducing_gap": reducing_gap,
+               **encoder.options()}
+    manifest = BuildManifest(parent_dir) if incremental else None
+    if manifest is not None and manifest.is_current(output_pdf, paths, options):
+        print(f"変更がないためスキップしました: {output_pdf}")
+        return
 
-    first_image.save(output_pdf, save_all=True, append_images=images, resolution=DPI)
+    # prefetch > 0 なら変換中に次のファイルを読み込んでおく(passthrough は元ファイルを直接読む)
+    prefetcher = None if passthrough else prefetched(paths, prefetch, prefetch_mb)
+    sources = image_sources(paths, prefetcher)
+
+    # 一時ファイルに書き出し、完成してから出力ファイルに置き換える
+    with atomic_output(output_pdf) as tmp_pdf:
+        if passthrough:
+            # 元のJPEGを再エンコードせずに埋め込み、B5への拡大・トリミングは配置行列とクリップで行う
+            page_box = (0, 0, B5_WIDTH_PX, B5_HEIGHT_PX)
+            with StreamingPdfWriter(tmp_pdf, dpi=DPI) as writer:
+                for path in paths:
+                    writer.add_page(B5_WIDTH_PX, B5_HEIGHT_PX, [place_scan(writer, path, page_box, load_page)])
+        elif stream:
+            # 1ページずつ変換・エンコードしてPDFに追記する(jobs>1 なら並列に変換し、順番どおりに書く)
+            with StreamingPdfWriter(tmp_pdf, dpi=DPI) as writer:
+                encoded_pages = ordered_map(lambda source: encoder.encode(load_page(source)),
+                                            sources, jobs, window=budget_pages)
+                for encoded in encoded_pages:
+                    writer.add_image_page(encoded)
+        else:
+            images = list(ordered_map(lambda source: encoder.prepare(load_page(source)), sources, jobs))
+            first_image = images[0]
+
+            with stage("save"):
+                first_image.save(tmp_pdf, save_all=True, append_images=images[1:], resolution=DPI,
+                                 title=dir_name, **encoder.pillow_save_options(images))
+    if manifest is not None:
+        manifest.record(output_pdf, paths, options)
+    count_input(paths)
+    count_output(output_pdf)
     print(f"PDFを作成しました: {output_pdf}")
+    if not passthrough:
+        print(f"  {encoder.summary()}")
+    if prefetcher is not None:
+        print(f"  {prefetcher.summary()}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="ディレクトリ内のJPGをB5サイズのPDFにまとめる")
+    parser.add_argument("input_dirs", nargs="+", metavar="input_dir", help="画像ディレクトリ(複数可)")
+    parser.add_argument("--subfolders", action="store_true",
+                        help="指定ディレクトリ直下の各サブフォルダを画像ディレクトリとして処理する")
+    parser.add_argument("--workers", type=int, default=1, metavar="N",
+                        help="フォルダ単位で並列処理するプロセス数(画素数の多いフォルダから順に割り当てる)")
+    parser.add_argument("--stream", action="store_true",
+                        help="1ページずつエンコードしてPDFに追記する(省メモリ)")
+    parser.add_argument("--max-memory", type=float, metavar="MB",
+                        help="ページ画像に使うメモリの上限。超える場合は自動で --stream になる")
+    parser.add_argument("--jobs", type=int, default=1, metavar="N",
+                        help="ページ変換に使うスレッド数(出力順は元の順番のまま)")
+    parser.add_argument("--draft", action="store_true",
+                        help="JPEGをB5に必要な解像度まで縮小デコードしてから変換する(高速・省メモリ)")
+    parser.add_argument("--passthrough", action="store_true",
+                        help="元のJPEGを再エンコードせずにそのまま埋め込む(無劣化・高速)")
+    parser.add_argument("--reducing-gap", type=float, metavar="GAP",
+                        help="回転・切り出し・縮小を1回のリサンプルで行う(高速。結果は既定とわずかに異なる)。"
+                             "大きな縮小はGAP倍を残して先に整数分の1にする(例: 3.0)")
+    parser.add_argument("--incremental", action="store_true",
+                        help="入力JPGとオプションが前回から変わっていなければ何もしない")
+    add_encoding_arguments(parser)
+    add_prefetch_arguments(parser)
+    add_plan_arguments(parser)
+    add_profile_arguments(parser)
+    args = parser.parse_args(argv)
+
+    with profiling(args):
+        input_dirs = args.input_dirs
+        if args.subfolders:
+            input_dirs = list_subfolders(input_dirs)
+
+        # 1つのフォルダが失敗しても残りのフォルダは処理を続ける
+        convert = functools.partial(jpgs_to_pdf, stream=args.stream, max_memory=args.max_memory,
+                                    jobs=args.jobs, draft=args.draft, passthrough=args.passthrough,
+                                    incremental=args.incremental, encoder=encoder_from_args(args),
+                                    reducing_gap=args.reducing_gap, prefetch=args.prefetch,
+                                    prefetch_mb=args.prefetch_mb)
+        jobs = plan_jobs([(input_dir, (input_dir,)) for input_dir in input_dirs], jpg_folder_cost,
+                         args.workers, args.plan)
+        run_file_jobs(convert, jobs, args.workers)
 
 
 if __name__ == "__main__":
-    if len(sys.argv) != 2:
-        print("使い方: python jpgs_to_pdf.py <画像ディレクトリ>")
-        sys.exit(1)
-
-    input_dir = sys.argv[1]
-    jpgs_to_pdf(input_dir)
+    main()
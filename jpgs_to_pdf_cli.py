@@ -0,0 +1,49 @@
+import argparse
+import importlib
+import sys
+
+# jpgs_to_pdf_cli.py
+# 各ツールをサブコマンドとして1プロセスで実行する入口。
+# フォルダごとに `uv run python ...` を起動し直す代わりに、複数の対象をまとめて渡せる。
+# fitz / numpy / PIL などの重いモジュールは、選ばれたサブコマンドのモジュールを
+# 読み込むときに初めて import される(--help だけなら何も読み込まない)。
+#
+# 例: uv run python jpgs_to_pdf_cli.py b5 --incremental --subfolders <対象フォルダ>
+
+# サブコマンド → (モジュール名, 説明)
+SUBCOMMANDS = {
+    "b5": ("jpgs_to_pdf_b5", "JPGフォルダをB5 PDFにする"),
+    "b4-2in1": ("jpgs_to_pdf_b4_2in1", "JPGフォルダをB5 2in1のB4 PDFにする"),
+    "pdf-2in1": ("pdf_b5_to_b4_2in1", "B5 PDFを2in1のB4 PDFにする"),
+    "pdf-2in1-reverse": ("pdf_b5_to_b4_2in1_reverse", "B5 PDFを逆順の2in1 B4 PDFにする"),
+    "folder-2in1": ("pdf_folder_merge_2in1", "フォルダ内のPDFを結合して2in1 B4 PDFにする"),
+    "merge": ("merge_pdfs", "複数のPDFを結合する"),
+    "merge-folder": ("merge_folder_pdfs", "フォルダ内のPDFを結合する"),
+    "extract": ("extract_new_pdf", "PDFからページ範囲を抽出する"),
+    "remove-white": ("batch_remove_white_pages", "'mondai' を含むPDFから白紙ページを削除する"),
+    "process": ("process_pdf_recursive", "フォルダ内のPDFを再帰的に白紙削除・2in1化する(最大400dpi)"),
+    "process-light": ("process_pdf_lightweight", "フォルダ内のPDFを再帰的に白紙削除・2in1化する(ベクター)"),
+    "watch": ("watch_folders", "スキャンフォルダを監視し、書き込みが終わったものからPDFに変換し続ける"),
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="JPG/PDF 変換ツールをまとめて実行する",
+        epilog="各サブコマンドのオプションは <サブコマンド> --help で表示する",
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True, metavar="<サブコマンド>")
+    for name, (_, help_text) in SUBCOMMANDS.items():
+        # オプションの解析はサブコマンドのモジュールに任せる
+        subparsers.add_parser(name, help=help_text, add_help=False)
+
+    args, rest = parser.parse_known_args(argv)
+
+    module_name, _ = SUBCOMMANDS[args.command]
+    module = importlib.import_module(module_name)
+    sys.argv[0] = f"{parser.prog} {args.command}"
+    module.main(rest)
+
+
+if __name__ == "__main__":
+    main()
@@ -21,15 +21,10 @@ echo Processing subfolders...
 echo.
 
 REM ===================================
-REM Loop through subfolders
+REM Process all subfolders in one run
 REM ===================================
-for /d %%F in ("%TARGET%\*") do (
-    echo --- Subfolder: %%~nxF ---
-
-    uv run python jpgs_to_pdf_b5.py "%%F"
-
-    echo.
-)
+uv run python jpgs_to_pdf_cli.py b5 --incremental --subfolders "%TARGET%"
+echo.
 
 echo Done.
 endlocal
@@ -0,0 +1,172 @@
+import hashlib
+import os
+import re
+import time
+
+import fitz  # PyMuPDF
+
+from build_manifest import atomic_output
+from instrument import count_input, count_output, stage
+from prefetch import DEFAULT_PREFETCH_MB, open_pdfs, prefetched
+
+# merge_engine.py
+# 複数のPDFを結合して保存する。保存方法はプロファイルで選ぶ。
+#
+#   fast     そのまま保存する(最速・最大サイズ)
+#   compact  未使用オブジェクトの削除、同一オブジェクトの統合(garbage=4)、
+#            ストリーム圧縮、オブジェクトストリームを使う
+#   linear   Web表示用に線形化する。MuPDF が線形化に対応していない場合は
+#            オブジェクトストリームなしの compact で保存する
+#
+# 同じテンプレートから作ったPDFを結合すると、フォントや画像が入力ごとに複製される。
+# garbage=4 がそれらを1つにまとめる。表示するオブジェクト数は、結合直後と保存したPDFを数えた実際の値
+# (未使用オブジェクトの削除と重複の統合を合わせた削減数)。
+# 内容ハッシュで重複するストリームを数える検出は、全ストリームを読み直すため report_duplicates のときだけ行う。
+# MuPDF が統合した数ではなく、統合できるはずの候補の数である。
+
+SAVE_MODES = {
+    "fast": {},
+    "compact": {"garbage": 4, "deflate": True, "use_objstms": 1},
+    "linear": {"garbage": 4, "deflate": True, "linear": True},
+}
+DEFAULT_SAVE_MODE = "compact"
+
+
+REF_PATTERN = re.compile(r"(\d+) 0 R")
+
+
+def object_digest(doc, xref, memo, visiting=frozenset()):
+    """
+    オブジェクトの内容ハッシュ。参照先 (N 0 R) は番号ではなく参照先の内容ハッシュに置き換えるため、
+    入力ごとに番号が違う同一のフォント・画像・色空間も同じ値になる
+    """
+    if xref in memo:
+        return memo[xref]
+    if xref in visiting:
+        return "cycle"
+    visiting = visiting | {xref}
+    text = REF_PATTERN.sub(lambda m: object_digest(doc, int(m.group(1)), memo, visiting),
+                           doc.xref_object(xref, compressed=True))
+    digest = hashlib.sha256(text.encode())
+    if doc.xref_is_stream(xref):
+        digest.update(doc.xref_stream_raw(xref))
+    memo[xref] = digest.hexdigest()
+    return memo[xref]
+
+
+def duplicate_streams(doc):
+    """
+    内容が同じストリームオブジェクト(フォント・画像・ICCプロファイルなど)を数える
+
+    Returns:
+        tuple[int, int]: (重複しているオブジェクト数, 重複分のバイト数)
+    """
+    memo = {}
+    seen = set()
+    count = 0
+    size = 0
+    for xref in range(1, doc.xref_length()):
+        if not doc.xref_is_stream(xref):
+            continue
+        digest = object_digest(doc, xref, memo)
+        if digest in seen:
+            count += 1
+            size += len(doc.xref_stream_raw(xref))
+        else:
+            seen.add(digest)
+    return count, size
+
+
+def _write(write, save_mode):
+    """write(**options) を save_mode のプロファイルで呼ぶ(線形化できなければ linear なしでやり直す)"""
+    options = SAVE_MODES[save_mode]
+    if save_mode == "linear":
+        try:
+            return write(**options)
+        except Exception as e:
+            print(f"線形化できないため、オブジェクトストリームなしで保存します: {e}")
+            options = {k: v for k, v in options.items() if k != "linear"}
+    return write(**options)
+
+
+def save_pdf(doc, path, save_mode=DEFAULT_SAVE_MODE):
+    """doc を save_mode のプロファイルで保存する"""
+    with stage("save"):
+        _write(lambda **options: doc.save(path, **options), save_mode)
+
+
+def pdf_bytes(doc, save_mode=DEFAULT_SAVE_MODE) -> bytes:
+    """doc を save_mode のプロファイルでバイト列にする(書き込みは呼び出し側が別スレッドで行える)"""
+    with stage("save"):
+        return _write(lambda **options: doc.tobytes(**options), save_mode)
+
+
+def merge_documents(input_pdf_paths, output_pdf_path, save_mode=DEFAULT_SAVE_MODE, prefetch=0,
+                    prefetch_mb=DEFAULT_PREFETCH_MB, report_duplicates=False):
+    """
+    input_pdf_paths を順に結合して output_pdf_path に保存し、サイズと時間を表示する
+
+    prefetch > 0 なら、結合中に次の prefetch 個のPDFをバックグラウンドで読み込んでおく。
+    report_duplicates なら、保存前に内容が同じストリームを数えて表示する。
+
+    Returns:
+        dict: 入力合計・出力サイズ、保存前後のオブジェクト数、検出した重複数、結合・保存にかかった秒数
+    """
+    start = time.perf_counter()
+    merged_doc = fitz.open()
+    prefetcher = prefetched(input_pdf_paths, prefetch, prefetch_mb)
+    for doc in open_pdfs(input_pdf_paths, prefetcher):
+        print(f"追加中: {doc.name}")
+        with doc, stage("merge"):
+            merged_doc.insert_pdf(doc)
+    merge_seconds = time.perf_counter() - start
+
+    dup_count = dup_bytes = None
+    if report_duplicates:
+        with stage("dedup_scan"):
+            dup_count, dup_bytes = duplicate_streams(merged_doc)
+
+    objects_before = merged_doc.xref_length() - 1
+    start = time.perf_counter()
+    with atomic_output(output_pdf_path) as tmp_pdf:
+        save_pdf(merged_doc, tmp_pdf, save_mode)
+    save_seconds = time.perf_counter() - start
+    merged_doc.close()
+    # 保存したPDFのオブジェクト数(相互参照表を読むだけなので軽い)
+    with fitz.open(output_pdf_path) as saved:
+        objects_after = saved.xref_length() - 1
+
+    stats = {
+        "input_bytes": sum(os.path.getsize(p) for p in input_pdf_paths),
+        "output_bytes": os.path.getsize(output_pdf_path),
+        "objects_before": objects_before,
+        "objects_after": objects_after,
+        "duplicates": dup_count,
+        "duplicate_bytes": dup_bytes,
+        "merge_seconds": merge_seconds,
+        "save_seconds": save_seconds,
+    }
+    count_input(input_pdf_paths)
+    count_output(output_pdf_path)
+    print(format_stats(stats, save_mode))
+    if prefetcher is not None:
+        print(f"  {prefetcher.summary()}")
+    return stats
+
+
+def format_stats(stats, save_mode):
+    mb = 1024 * 1024
+    saved = stats["input_bytes"] - stats["output_bytes"]
+    ratio = saved / stats["input_bytes"] * 100 if stats["input_bytes"] else 0.0
+    lines = [
+        f"  保存プロファイル: {save_mode}",
+        f"  サイズ: 入力合計 {stats['input_bytes'] / mb:.2f} MB → 出力 {stats['output_bytes'] / mb:.2f} MB"
+        f" ({saved / mb:.2f} MB 削減, {ratio:.1f}%)",
+        f"  時間: 結合 {stats['merge_seconds']:.2f} 秒 / 保存 {stats['save_seconds']:.2f} 秒",
+    ]
+    lines.insert(2, f"  オブジェクト数: 結合時 {stats['objects_before']} → 保存後 {stats['objects_after']}"
+                    f" ({stats['objects_before'] - stats['objects_after']} 個削減)")
+    if stats["duplicates"] is not None:
+        lines.insert(3, f"  検出した重複ストリーム: {stats['duplicates']} 個"
+                        f" ({stats['duplicate_bytes'] / mb:.2f} MB)")
+    return "\n".join(lines)
@@ -1,8 +1,13 @@
-import sys
+import argparse
 import os
-import fitz  # PyMuPDF
 
-def merge_pdfs_in_folder(input_folder):
+from instrument import add_profile_arguments, profiling
+from merge_engine import DEFAULT_SAVE_MODE, SAVE_MODES, merge_documents
+from prefetch import DEFAULT_PREFETCH_MB, add_prefetch_arguments
+from scan_plan import list_files
+
+def merge_pdfs_in_folder(input_folder, save_mode=DEFAULT_SAVE_MODE, prefetch=0, prefetch_mb=DEFAULT_PREFETCH_MB,
+                         report_duplicates=False):
     """
     指定フォルダ内（再帰なし）の PDF をすべて結合して 1 ファイルにまとめる
 
@@ -10,6 +15,10 @@ def merge_pdfs_in_folder(input_folder):
 
     Args:
         input_folder (str): PDF が入っているフォルダ
+        save_mode (str): 保存プロファイル(fast / compact / linear)
+        prefetch (int): 結合中にバックグラウンドで先読みするPDFの数(0 なら先読みしない)
+        prefetch_mb (float): 先読みで保持する量の上限(MB)
+        report_duplicates (bool): 内容が同じストリームを数えて表示する
     """
 
     try:
@@ -18,34 +27,18 @@ def merge_pdfs_in_folder(input_folder):
             return
 
         # PDFファイル一覧を取得（拡張子 .pdf のみ）
-        pdf_files = [
-            os.path.join(input_folder, f)
-            for f in os.listdir(input_folder)
-            if f.lower().endswith(".pdf")
-        ]
+        pdf_files = [os.path.join(input_folder, f) for f in list_files(input_folder, ".pdf")]
 
         if not pdf_files:
             print("PDF ファイルがフォルダ内にありません。")
             return
 
-        # ファイル名順に並べ替え
-        pdf_files.sort()
-
         # 出力ファイル名を作成
         folder_name = os.path.basename(os.path.abspath(input_folder))
         output_pdf_path = os.path.join(input_folder, f"{folder_name}_merged.pdf")
 
-        merged_doc = fitz.open()
-
-        # PDFを順番に追加
-        for pdf_path in pdf_files:
-            print(f"追加中: {pdf_path}")
-            with fitz.open(pdf_path) as doc:
-                merged_doc.insert_pdf(doc)
-
-        # 保存
-        merged_doc.save(output_pdf_path)
-        merged_doc.close()
+        # PDFを順番に追加して保存
+        merge_documents(pdf_files, output_pdf_path, save_mode, prefetch, prefetch_mb, report_duplicates)
 
         print(f"成功: {len(pdf_files)} 個のPDFを結合して '{output_pdf_path}' に保存しました。")
 
@@ -53,10 +46,22 @@ def merge_pdfs_in_folder(input_folder):
         print(f"エラーが発生しました: {e}")
 
 
-if __name__ == "__main__":
-    if len(sys.argv) < 2:
-        print("使い方: python merge_folder_pdfs.py <folder_path>")
-        sys.exit(1)
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="フォルダ内のPDFを結合して1つのPDFにする")
+    parser.add_argument("input_folders", nargs="+", metavar="folder_path", help="PDFフォルダ(複数可)")
+    parser.add_argument("--save-mode", choices=sorted(SAVE_MODES), default=DEFAULT_SAVE_MODE,
+                        help="保存プロファイル(既定: compact = 不要オブジェクト削除・重複統合・圧縮)")
+    parser.add_argument("--dedup-report", action="store_true",
+                        help="保存前に内容が同じフォント・画像などのストリームを数えて表示する(全ストリームを読むため遅くなる)")
+    add_prefetch_arguments(parser)
+    add_profile_arguments(parser)
+    args = parser.parse_args(argv)
+
+    with profiling(args):
+        for input_folder in args.input_folders:
+            merge_pdfs_in_folder(input_folder, args.save_mode, args.prefetch, args.prefetch_mb,
+                                 args.dedup_report)
 
-    input_folder = sys.argv[1]
-    merge_pdfs_in_folder(input_folder)
+
+if __name__ == "__main__":
+    main()
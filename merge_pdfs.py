@@ -1,14 +1,18 @@
-import sys
+import argparse
 import os
-import fitz  # PyMuPDF
 
-def merge_pdfs(input_pdf_paths):
+from instrument import add_profile_arguments, profiling
+from merge_engine import DEFAULT_SAVE_MODE, SAVE_MODES, merge_documents
+
+def merge_pdfs(input_pdf_paths, save_mode=DEFAULT_SAVE_MODE, report_duplicates=False):
     """
     複数のPDFを結合して1つのPDFにする関数
     出力ファイル名は最初のPDFのファイル名に _merged.pdf を付ける
 
     Args:
         input_pdf_paths (list[str]): 結合対象のPDFファイルパス
+        save_mode (str): 保存プロファイル(fast / compact / linear)
+        report_duplicates (bool): 内容が同じストリームを数えて表示する
     """
 
     try:
@@ -17,17 +21,8 @@ def merge_pdfs(input_pdf_paths):
         base, ext = os.path.splitext(first_pdf)
         output_pdf_path = f"{base}_merged.pdf"
 
-        merged_doc = fitz.open()
-
-        # 入力PDFを順番に追加
-        for pdf_path in input_pdf_paths:
-            print(f"追加中: {pdf_path}")
-            with fitz.open(pdf_path) as doc:
-                merged_doc.insert_pdf(doc)
-
-        # 保存
-        merged_doc.save(output_pdf_path)
-        merged_doc.close()
+        # 入力PDFを順番に追加して保存
+        merge_documents(input_pdf_paths, output_pdf_path, save_mode, report_duplicates=report_duplicates)
 
         print(f"成功: {len(input_pdf_paths)} 個のPDFを結合して '{output_pdf_path}' に保存しました。")
 
@@ -35,10 +30,19 @@ def merge_pdfs(input_pdf_paths):
         print(f"エラーが発生しました: {e}")
 
 
-if __name__ == "__main__":
-    if len(sys.argv) < 2:
-        print("使い方: python merge_pdfs.py <input1.pdf> <input2.pdf> ...")
-        sys.exit(1)
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="複数のPDFを結合して1つのPDFにする")
+    parser.add_argument("input_pdfs", nargs="+", metavar="input.pdf", help="結合するPDF(この順に結合)")
+    parser.add_argument("--save-mode", choices=sorted(SAVE_MODES), default=DEFAULT_SAVE_MODE,
+                        help="保存プロファイル(既定: compact = 不要オブジェクト削除・重複統合・圧縮)")
+    parser.add_argument("--dedup-report", action="store_true",
+                        help="保存前に内容が同じフォント・画像などのストリームを数えて表示する(全ストリームを読むため遅くなる)")
+    add_profile_arguments(parser)
+    args = parser.parse_args(argv)
 
-    input_pdfs = sys.argv[1:]
-    merge_pdfs(input_pdfs)
+    with profiling(args):
+        merge_pdfs(args.input_pdfs, args.save_mode, args.dedup_report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+import io
+import zlib
+from collections import Counter
+
+import numpy as np
+from PIL import Image, TiffImagePlugin
+
+from instrument import stage
+from pdf_stream_writer import EncodedImage
+
+# page_encoding.py
+# ページ画像を カラー / グレー / 白黒2値 に分類し、種類に合った形式でエンコードする。
+#   color   : RGB の JPEG
+#   gray    : 8bit グレーの JPEG(ストリーミング出力では Flate も選べる)
+#   bilevel : 1bit の CCITT G4。白黒のプリントのスキャンはカラーJPEGの数十分の一になる
+#
+# 分類は間引いた画素の NumPy ヒストグラムで行う。
+#   彩度(RGBの最大-最小)が COLOR_CHROMA を超える画素が COLOR_FRACTION 以上 → color
+#   黒と白の間の中間調の画素が BILEVEL_MIDTONES 未満で、薄い線もなければ → bilevel、それ以外 → gray
+# 薄い線: しきい値より明るく FAINT_MAX 以下で、近くに黒い画素がない画素(鉛筆の書き込みなど)。
+# 2値化すると白になって消えるため、FAINT_FRACTION 以上あるページは 2値にしない。
+# 文字の輪郭のアンチエイリアスは必ず黒い画素と隣り合うので、薄い線には数えない。
+#
+# 2値化は書き込みを消すおそれのある非可逆な変換なので、既定は color(全ページをカラーJPEG)。
+# 判定は --encoding auto を指定したときだけ行う。
+
+ENCODINGS = ("auto", "color", "gray", "bilevel")
+DEFAULT_QUALITY = 75
+DEFAULT_THRESHOLD = 160
+
+COLOR_CHROMA = 40
+COLOR_FRACTION = 0.0005
+MIDTONE_RANGE = (64, 192)
+BILEVEL_MIDTONES = 0.02
+FAINT_MAX = 230
+FAINT_FRACTION = 0.0002
+SAMPLE_STEP = 4
+
+
+def _g4_strip(img: Image.Image) -> bytes:
+    """1bit 画像を CCITT G4 で圧縮し、TIFF のストリップ部分だけを取り出す"""
+    buf = io.BytesIO()
+    # ストリップを1本にして、PDF の CCITTFaxDecode にそのまま渡せるようにする
+    img.save(buf, "TIFF", compression="group4", strip_size=(img.width + 7) // 8 * img.height)
+    buf.seek(0)
+    with Image.open(buf) as tiff:
+        offset = tiff.tag_v2[TiffImagePlugin.STRIPOFFSETS][0]
+        length = tiff.tag_v2[TiffImagePlugin.STRIPBYTECOUNTS][0]
+    return buf.getvalue()[offset:offset + length]
+
+
+class PageEncoder:
+    """
+    ページ画像の分類とエンコード
+
+    Args:
+        encoding (str): auto なら分類結果に従う。color(既定) / gray / bilevel なら全ページをその形式にする
+        quality (int): JPEG の品質
+        threshold (int): 2値化のしきい値(これより明るい画素を白にする)
+        gray_filter (str): ストリーミング出力でのグレーページの圧縮(jpeg / flate)
+    """
+
+    def __init__(self, encoding="color", quality=DEFAULT_QUALITY, threshold=DEFAULT_THRESHOLD,
+                 gray_filter="jpeg"):
+        self.encoding = encoding
+        self.quality = quality
+        self.threshold = threshold
+        self.gray_filter = gray_filter
+        self.stats = Counter()
+
+    def classify(self, img: Image.Image, step: int = SAMPLE_STEP) -> str:
+        """
+        ページを color / gray / bilevel のいずれかに分類する
+
+        step 画素おきに間引いて調べる(縮小済みのサムネイルを渡すときは 1)。
+        """
+        if self.encoding != "auto":
+            return self.encoding
+
+        sample = img.resize((max(1, img.width // step), max(1, img.height // step)), Image.NEAREST)
+        if sample.mode == "RGB":
+            rgb = np.asarray(sample)
+            chroma = rgb.max(axis=2) - rgb.min(axis=2)
+            if np.count_nonzero(chroma > COLOR_CHROMA) > COLOR_FRACTION * chroma.size:
+                return "color"
+            sample = sample.convert("L")
+        elif sample.mode != "L":
+            return "color"
+
+        gray = np.asarray(sample)
+        hist = np.bincount(gray.ravel(), minlength=256)
+        low, high = MIDTONE_RANGE
+        if hist[low:high].sum() < BILEVEL_MIDTONES * hist.sum() and not self._has_faint_strokes(gray):
+            return "bilevel"
+        return "gray"
+
+    def _has_faint_strokes(self, gray: np.ndarray) -> bool:
+        """2値化で白になって消える薄い線(黒い画素から離れた明るめの画素)が FAINT_FRACTION 以上あれば True"""
+        dark = gray <= self.threshold
+        # 上下左右と斜めに1画素広げた黒の範囲(文字の輪郭のアンチエイリアスを除く)
+        near = dark.copy()
+        near[1:] |= dark[:-1]
+        near[:-1] |= dark[1:]
+        near[:, 1:] |= near[:, :-1].copy()
+        near[:, :-1] |= near[:, 1:].copy()
+        faint = ~near & (gray <= FAINT_MAX)
+        return np.count_nonzero(faint) >= FAINT_FRACTION * gray.size
+
+    def prepare(self, img: Image.Image) -> Image.Image:
+        """
+        分類に合わせたモード(RGB / L / 1)に変換する
+
+        Image.save(save_all=True) に渡すと、Pillow は L を DCTDecode、1 を CCITT G4 で埋め込む。
+        """
+        with stage("classify"):
+            kind = self.classify(img)
+            self.stats[kind] += 1
+            return self._convert(img, kind)
+
+    def _convert(self, img: Image.Image, kind: str) -> Image.Image:
+        if kind == "color":
+            return img if img.mode == "RGB" else img.convert("RGB")
+        gray = img if img.mode == "L" else img.convert("L")
+        if kind == "gray":
+            return gray
+        return gray.point([255 if v > self.threshold else 0 for v in range(256)], "1")
+
+    def encode(self, img: Image.Image) -> EncodedImage:
+        """分類に合わせた形式で StreamingPdfWriter 用にエンコードする"""
+        page = self.prepare(img)
+        with stage("encode"):
+            return self._encode_prepared(page)
+
+    def encode_as(self, img: Image.Image, kind: str) -> EncodedImage:
+        """分類済みの種類 kind の形式でエンコードする(1ページを帯に分けて書き出すときに使う)"""
+        with stage("encode"):
+            return self._encode_prepared(self._convert(img, kind))
+
+    def _encode_prepared(self, page: Image.Image) -> EncodedImage:
+        if page.mode == "1":
+            # Pillow の 1bit 画像は 1 が白なので、BlackIs1 で黒を 1 として解釈させる
+            parms = f"/K -1 /BlackIs1 true /Columns {page.width} /Rows {page.height}"
+            return EncodedImage(page.width, page.height, "DeviceGray", 1, "CCITTFaxDecode",
+                                _g4_strip(page), decode_parms=parms)
+        if page.mode == "L" and self.gray_filter == "flate":
+            return EncodedImage(page.width, page.height, "DeviceGray", 8, "FlateDecode",
+                                zlib.compress(page.tobytes(), 6))
+
+        buf = io.BytesIO()
+        page.save(buf, "JPEG", quality=self.quality)
+        colorspace = "DeviceGray" if page.mode == "L" else "DeviceRGB"
+        return EncodedImage(page.width, page.height, colorspace, 8, "DCTDecode", buf.getvalue())
+
+    def pillow_save_options(self, pages) -> dict:
+        """
+        prepare() 済みのページを Image.save(save_all=True) するときの追加オプション
+
+        Pillow は先頭ページの保存オプションを全ページに使い回し、1bit ページの TIFF(G4) 圧縮は
+        quality を受け付けない。2値ページを含む場合は quality を渡さず Pillow の既定値(75)になる。
+        """
+        if not any(page.mode == "1" for page in pages):
+            return {"quality": self.quality}
+        if self.quality != DEFAULT_QUALITY:
+            print(f"白黒2値のページを含むため、JPEG 品質は既定の {DEFAULT_QUALITY} になります")
+        return {}
+
+    def options(self) -> dict:
+        """マニフェストに記録する設定"""
+        return {"encoding": self.encoding, "quality": self.quality,
+                "threshold": self.threshold, "gray_filter": self.gray_filter}
+
+    def summary(self) -> str:
+        return (
+            f"エンコード: color={self.stats['color']} gray={self.stats['gray']}"
+            f" bilevel={self.stats['bilevel']}"
+        )
+
+
+def add_encoding_arguments(parser):
+    """--encoding / --quality / --threshold / --gray-filter を parser に追加する"""
+    parser.add_argument("--encoding", choices=ENCODINGS, default="color",
+                        help="ページ画像の形式(既定: color)。auto はページごとに カラー/グレー/白黒2値 を判定する"
+                             "(白黒2値は非可逆。薄い書き込みのあるページはグレーにする)")
+    parser.add_argument("--quality", type=int, default=DEFAULT_QUALITY,
+                        help=f"JPEG の品質(既定: {DEFAULT_QUALITY})")
+    parser.add_argument("--threshold", type=int, default=DEFAULT_THRESHOLD,
+                        help=f"白黒2値化のしきい値 0-255(既定: {DEFAULT_THRESHOLD})")
+    parser.add_argument("--gray-filter", choices=["jpeg", "flate"], default="jpeg",
+                        help="グレーページの圧縮(flate は --stream と --engine band のときのみ有効)")
+
+
+def encoder_from_args(args) -> PageEncoder:
+    return PageEncoder(args.encoding, args.quality, args.threshold, args.gray_filter)
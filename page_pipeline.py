@@ -0,0 +1,43 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# page_pipeline.py
+# ページ変換(デコード・リサイズ・エンコード)をスレッドプールで並列に実行し、
+# 結果は元のページ順のまま返す。Pillow のデコード/リサイズ/JPEGエンコードは
+# GIL を解放するため、スレッドでも複数コアを使える。
+#
+# 注意: PyMuPDF(fitz)のドキュメントはスレッド間で共有できないため、
+# レンダリングは呼び出し側(メインスレッド)で行い、ここにはピクセル列だけを渡すこと。
+
+
+def ordered_map(func, items, jobs=1, window=None):
+    """
+    func を items の各要素に適用した結果を、入力順に返すジェネレータ
+
+    Args:
+        func: 1ページ分の変換関数
+        items: 入力(ジェネレータ可。必要になった分だけ読み進める)
+        jobs (int): ワーカースレッド数。1以下なら逐次処理
+        window (int | None): 同時に処理中・保持中にする件数の上限(既定は jobs * 2)
+    """
+    if jobs <= 1:
+        yield from map(func, items)
+        return
+
+    window = max(1, window or jobs * 2)
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        pending = deque()
+        for item in items:
+            if len(pending) >= window:
+                yield pending.popleft().result()
+            pending.append(executor.submit(func, item))
+        while pending:
+            yield pending.popleft().result()
+
+
+def pairs(items):
+    """[a, b, c] → (a, b), (c, None) のように2つずつ組にする(2in1用)"""
+    # 入力は必要な分だけ読み進める(先読みのイテレータなどをまとめて読み切らない)
+    items = iter(items)
+    for first in items:
+        yield first, next(items, None)
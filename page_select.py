@@ -0,0 +1,25 @@
+# page_select.py
+# 残すページ番号の並び(白紙を除いたもの、kokugo なら逆順)を、開いたドキュメントに1回で適用する。
+#
+# 1ページずつ insert_pdf で新しいPDFへコピーすると、ページごとにリソースをたどり直すため、
+# 共有しているフォントや画像が何度もコピーされ、長いPDFほど遅く大きくなる。
+# Document.select はページツリーを組み替えるだけなので、リソースは元のPDFのまま共有される。
+# 外したページだけが使っていたオブジェクトは、保存時に SAVE_OPTIONS の garbage で取り除く。
+
+# 未使用オブジェクトを削除して番号を詰める。
+# 同一オブジェクトの統合(garbage=3 以上)は画像の多いPDFで保存が数倍遅くなるため、ここでは行わない
+SAVE_OPTIONS = {"garbage": 2}
+
+
+def select_pages(doc, page_order):
+    """
+    doc のページを page_order(元のページ番号。この順に並べる)だけにして doc を返す
+
+    page_order が空なら全ページを削除する(0ページのドキュメントになる)。
+    """
+    page_order = list(page_order)
+    if page_order:
+        doc.select(page_order)
+    elif doc.page_count:
+        doc.delete_pages(range(doc.page_count))
+    return doc
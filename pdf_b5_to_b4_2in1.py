@@ -1,8 +1,18 @@
-import sys
+import argparse
 import os
 import fitz  # PyMuPDF
 from PIL import Image
 
+from band_render import band_2in1
+from instrument import add_profile_arguments, count_input, count_output, profiling, stage
+from page_encoding import PageEncoder, add_encoding_arguments, encoder_from_args
+from page_pipeline import ordered_map
+from pdf_impose import vector_2in1
+from pdf_stream_writer import StreamingPdfWriter
+from pixmap_view import pixmap_image
+from render_cache import add_cache_arguments, cache_from_args, render_pixmap
+from shard_render import sharded_map
+
 # === constant: B5 at 400dpi ===
 DPI = 400
 B5_WIDTH_PX = int(182 / 25.4 * DPI)
@@ -14,19 +24,35 @@ B4_WIDTH_PX = B5_WIDTH_PX * 2
 B4_HEIGHT_PX = B5_HEIGHT_PX
 B4_SIZE = (B4_WIDTH_PX, B4_HEIGHT_PX)
 
+# B5 in points, matching the page size of the raster output
+B5_SIZE_PT = (B5_WIDTH_PX * 72 / DPI, B5_HEIGHT_PX * 72 / DPI)
 
-def render_pdf_page_to_b5(fitz_page):
-    """Render PDF page to a B5-sized PIL image."""
+
+def render_pdf_pixmap(fitz_page, cache=None):
+    """
+    Render PDF page at B5 zoom (through the on-disk render cache when given).
+
+    MuPDF documents must stay on the calling thread; the returned pixmap
+    itself can be handed to the worker threads.
+    """
     zoom_x = B5_WIDTH_PX / fitz_page.rect.width
     zoom_y = B5_HEIGHT_PX / fitz_page.rect.height
     mat = fitz.Matrix(zoom_x, zoom_y)
 
-    pix = fitz_page.get_pixmap(matrix=mat, alpha=False)
-    img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
+    return render_pixmap(fitz_page, cache, matrix=mat)
 
-    # If rendered size differs slightly, resize to exact B5
-    img = img.resize(B5_SIZE, Image.LANCZOS)
-    return img
+
+def pixmap_to_b5(pix):
+    """Turn a rendered pixmap into a B5-sized PIL image."""
+    # Read the pixmap samples in place and resize to exact B5
+    # (this is also the only copy when the rendered size already matches)
+    with stage("resize"):
+        return pixmap_image(pix).resize(B5_SIZE, Image.LANCZOS)
+
+
+def render_pdf_page_to_b5(fitz_page, cache=None):
+    """Render PDF page to a B5-sized PIL image."""
+    return pixmap_to_b5(render_pdf_pixmap(fitz_page, cache))
 
 
 def make_2in1_b4(img1, img2):
@@ -37,7 +63,25 @@ def make_2in1_b4(img1, img2):
     return canvas
 
 
-def pdf_to_2in1(input_pdf):
+def encode_sheets(doc, page_numbers, cache, encoder):
+    """
+    Render a contiguous run of pages and encode them two at a time as B4 sheets.
+
+    Runs inside a shard worker; returns the encoded sheets and the encoder counts.
+    """
+    encoder.stats.clear()
+    sheets = []
+    for i in range(0, len(page_numbers), 2):
+        left = render_pdf_page_to_b5(doc[page_numbers[i]], cache)
+        if i + 1 < len(page_numbers):
+            right = render_pdf_page_to_b5(doc[page_numbers[i + 1]], cache)
+        else:
+            right = Image.new("RGB", B5_SIZE, (255, 255, 255))
+        sheets.append(encoder.encode(make_2in1_b4(left, right)))
+    return sheets, encoder.stats.copy()
+
+
+def pdf_to_2in1(input_pdf, jobs=1, engine="raster", encoder=None, cache=None, render_workers=1, dpi=DPI):
     if not os.path.isfile(input_pdf):
         print("PDFファイルが存在しません:", input_pdf)
         return
@@ -47,30 +91,88 @@ def pdf_to_2in1(input_pdf):
 
     doc = fitz.open(input_pdf)
 
-    # Render each page as B5 image
-    b5_pages = [render_pdf_page_to_b5(page) for page in doc]
-
-    # If odd, add a blank page
-    if len(b5_pages) % 2 == 1:
-        b5_pages.append(Image.new("RGB", B5_SIZE, (255, 255, 255)))
-
-    # Create all B4 (2in1) pages
-    b4_pages = []
-    for i in range(0, len(b5_pages), 2):
-        merged = make_2in1_b4(b5_pages[i], b5_pages[i + 1])
-        b4_pages.append(merged)
-
-    # Save to PDF
-    first = b4_pages[0]
-    rest = b4_pages[1:]
-    first.save(output_pdf, save_all=True, append_images=rest, resolution=DPI)
+    if engine == "vector":
+        # Impose the pages as vector XObjects, no rendering
+        vector_2in1([(doc, i) for i in range(doc.page_count)], output_pdf, B5_SIZE_PT)
+        count_input([input_pdf])
+        count_output(output_pdf)
+        print("2in1 PDF を作成しました:", output_pdf)
+        return
 
+    if cache is not None:
+        cache.stats.clear()
+    encoder = encoder or PageEncoder()
+    encoder.stats.clear()
+
+    if engine == "band":
+        # Render, compress and write each sheet in horizontal strips (no full-size canvas)
+        band_2in1([(doc, i) for i in range(doc.page_count)], output_pdf, encoder, dpi)
+    elif render_workers > 1:
+        # Each worker process opens the PDF itself and renders a contiguous page range;
+        # the encoded sheets come back in page order and are appended as they arrive
+        with StreamingPdfWriter(output_pdf, dpi=DPI) as writer:
+            for sheets, stats in sharded_map(encode_sheets, input_pdf, range(doc.page_count),
+                                             render_workers, (encoder,), cache):
+                encoder.stats.update(stats)
+                for encoded in sheets:
+                    writer.add_image_page(encoded)
+    else:
+        # Render each page as B5 image (resize runs on worker threads when jobs > 1)
+        rendered = (render_pdf_pixmap(page, cache) for page in doc)
+        b5_pages = list(ordered_map(pixmap_to_b5, rendered, jobs))
+
+        # If odd, add a blank page
+        if len(b5_pages) % 2 == 1:
+            b5_pages.append(Image.new("RGB", B5_SIZE, (255, 255, 255)))
+
+        # Create all B4 (2in1) pages, each converted to colour / grayscale / bilevel
+        def build_sheet(i):
+            return encoder.prepare(make_2in1_b4(b5_pages[i], b5_pages[i + 1]))
+
+        b4_pages = list(ordered_map(build_sheet, range(0, len(b5_pages), 2), jobs))
+
+        # Save to PDF
+        first = b4_pages[0]
+        rest = b4_pages[1:]
+        with stage("save"):
+            first.save(output_pdf, save_all=True, append_images=rest, resolution=DPI,
+                       **encoder.pillow_save_options(b4_pages))
+
+    count_input([input_pdf])
+    count_output(output_pdf)
     print("2in1 PDF を作成しました:", output_pdf)
+    print(" ", encoder.summary())
+    if cache is not None:
+        print(" ", cache.summary())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="B5 PDFを2in1のB4 PDFに変換する")
+    parser.add_argument("input_pdfs", nargs="+", metavar="input_pdf", help="入力PDFファイル(複数可)")
+    parser.add_argument("--jobs", type=int, default=1, metavar="N",
+                        help="worker threads for page resizing (page order is preserved)")
+    parser.add_argument("--engine", choices=["raster", "vector", "band"], default="raster",
+                        help="raster: render pages at 400dpi / vector: keep pages as vector XObjects / "
+                             "band: render and compress each sheet in strips (a few MB of memory per sheet)")
+    parser.add_argument("--dpi", type=int, default=DPI,
+                        help=f"render resolution of the band engine (default: {DPI})")
+    parser.add_argument("--render-workers", type=int, default=1, metavar="N",
+                        help="split the rendering of each PDF over N processes, each taking a "
+                             "contiguous page range (raster engine)")
+    add_encoding_arguments(parser)
+    add_cache_arguments(parser)
+    add_profile_arguments(parser)
+    args = parser.parse_args(argv)
+    if args.engine == "band" and args.render_workers > 1:
+        parser.error("--render-workers is not supported with --engine band")
+
+    with profiling(args):
+        encoder = encoder_from_args(args)
+        cache = cache_from_args(args)
+        for input_pdf in args.input_pdfs:
+            pdf_to_2in1(input_pdf, jobs=args.jobs, engine=args.engine, encoder=encoder, cache=cache,
+                        render_workers=args.render_workers, dpi=args.dpi)
 
 
 if __name__ == "__main__":
-    if len(sys.argv) != 2:
-        print("使い方: python pdf_b5_to_b4_2in1.py <入力PDFファイル>")
-        sys.exit(1)
-
-    pdf_to_2in1(sys.argv[1])
+    main()
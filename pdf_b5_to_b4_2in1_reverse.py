@@ -1,8 +1,16 @@
-import sys
+import argparse
 import os
 import fitz  # PyMuPDF
 from PIL import Image
 
+from band_render import band_2in1
+from instrument import add_profile_arguments, count_input, count_output, profiling, stage
+from page_encoding import PageEncoder, add_encoding_arguments, encoder_from_args
+from page_pipeline import ordered_map
+from pdf_impose import vector_2in1
+from pixmap_view import pixmap_image
+from render_cache import add_cache_arguments, cache_from_args, render_pixmap
+
 # === constant: B5 at 400dpi ===
 DPI = 400
 B5_WIDTH_PX = int(182 / 25.4 * DPI)
@@ -14,19 +22,33 @@ B4_WIDTH_PX = B5_WIDTH_PX * 2
 B4_HEIGHT_PX = B5_HEIGHT_PX
 B4_SIZE = (B4_WIDTH_PX, B4_HEIGHT_PX)
 
+# ラスタ版と同じページサイズになるB5(ポイント)
+B5_SIZE_PT = (B5_WIDTH_PX * 72 / DPI, B5_HEIGHT_PX * 72 / DPI)
 
-def render_page_to_b5(page):
-    """Render PDF page to B5-sized PIL image."""
+
+def render_page_pixmap(page, cache=None):
+    """
+    B5倍率でレンダリングした Pixmap を返す(cache があればレンダリングキャッシュを使う)。
+
+    MuPDFのドキュメントは呼び出し元スレッドから出さず、Pixmap だけをワーカーに渡す。
+    """
     zoom_x = B5_WIDTH_PX / page.rect.width
     zoom_y = B5_HEIGHT_PX / page.rect.height
     mat = fitz.Matrix(zoom_x, zoom_y)
 
-    pix = page.get_pixmap(matrix=mat, alpha=False)
-    img = Image.frombytes("RGB", (pix.width, pix.height), pix.samples)
+    return render_pixmap(page, cache, matrix=mat)
+
 
+def pixmap_to_b5(pix):
+    """Pixmap をコピーせずに参照し、B5サイズのPIL画像にする"""
     # 必ずB5に統一
-    img = img.resize(B5_SIZE, Image.LANCZOS)
-    return img
+    with stage("resize"):
+        return pixmap_image(pix).resize(B5_SIZE, Image.LANCZOS)
+
+
+def render_page_to_b5(page):
+    """Render PDF page to B5-sized PIL image."""
+    return pixmap_to_b5(render_page_pixmap(page))
 
 
 def make_2in1_b4_correct(left_img, right_img):
@@ -43,7 +65,7 @@ def make_2in1_b4_correct(left_img, right_img):
     return canvas
 
 
-def pdf_to_2in1_reverse(input_pdf):
+def pdf_to_2in1_reverse(input_pdf, jobs=1, engine="raster", encoder=None, cache=None, dpi=DPI):
     if not os.path.isfile(input_pdf):
         print("PDFファイルが存在しません:", input_pdf)
         return
@@ -56,38 +78,89 @@ def pdf_to_2in1_reverse(input_pdf):
     # === ページを逆順に並べる（3→2→1） ===
     reversed_pages = list(doc)[::-1]
 
-    # === 各ページをB5画像へ ===
-    b5_pages = [render_page_to_b5(p) for p in reversed_pages]
+    if engine == "vector":
+        # === レンダリングせずベクターのまま面付け ===
+        vector_2in1([(doc, p.number) for p in reversed_pages], output_pdf, B5_SIZE_PT)
+        count_input([input_pdf])
+        count_output(output_pdf)
+        print("修正済み 2in1（反転）PDF を作成しました:", output_pdf)
+        return
+
+    if engine == "band":
+        # === B4のキャンバスを作らず、帯ごとにレンダリング・圧縮して書き出す ===
+        encoder = encoder or PageEncoder()
+        encoder.stats.clear()
+        band_2in1([(doc, p.number) for p in reversed_pages], output_pdf, encoder, dpi)
+        count_input([input_pdf])
+        count_output(output_pdf)
+        print("修正済み 2in1（反転）PDF を作成しました:", output_pdf)
+        print(" ", encoder.summary())
+        return
+
+    if cache is not None:
+        cache.stats.clear()
+
+    # === 各ページをB5画像へ（jobs>1 ならリサイズを並列化、順番は維持） ===
+    b5_pages = list(ordered_map(pixmap_to_b5, (render_page_pixmap(p, cache) for p in reversed_pages), jobs))
 
     # === 奇数ページなら白紙追加 ===
     if len(b5_pages) % 2 == 1:
         b5_pages.append(Image.new("RGB", B5_SIZE, (255, 255, 255)))
 
-    # === 正しい縦書き2in1（左右反転せず） ===
-    b4_pages = []
-    for i in range(0, len(b5_pages), 2):
+    # === 正しい縦書き2in1（左右反転せず）、シートごとにカラー/グレー/白黒2値へ変換 ===
+    encoder = encoder or PageEncoder()
+    encoder.stats.clear()
+
+    def build_sheet(i):
         left_page  = b5_pages[i]
         right_page = b5_pages[i + 1]
-        merged = make_2in1_b4_correct(left_page, right_page)
-        b4_pages.append(merged)
+        return encoder.prepare(make_2in1_b4_correct(left_page, right_page))
+
+    b4_pages = list(ordered_map(build_sheet, range(0, len(b5_pages), 2), jobs))
 
     # === PDFとして出力 ===
     first = b4_pages[0]
     rest = b4_pages[1:]
 
-    first.save(
-        output_pdf,
-        save_all=True,
-        append_images=rest,
-        resolution=DPI
-    )
-
+    with stage("save"):
+        first.save(
+            output_pdf,
+            save_all=True,
+            append_images=rest,
+            resolution=DPI,
+            **encoder.pillow_save_options(b4_pages)
+        )
+
+    count_input([input_pdf])
+    count_output(output_pdf)
     print("修正済み 2in1（反転）PDF を作成しました:", output_pdf)
+    print(" ", encoder.summary())
+    if cache is not None:
+        print(" ", cache.summary())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="B5 PDFを逆順の2in1 B4 PDFに変換する")
+    parser.add_argument("input_pdfs", nargs="+", metavar="input_pdf", help="入力PDFファイル(複数可)")
+    parser.add_argument("--jobs", type=int, default=1, metavar="N",
+                        help="ページのリサイズに使うスレッド数(ページ順は保たれる)")
+    parser.add_argument("--engine", choices=["raster", "vector", "band"], default="raster",
+                        help="raster: 400dpiで画像化 / vector: ページをベクターのまま配置 / "
+                             "band: 帯ごとにレンダリング・エンコードする(1シート数MBのメモリ)")
+    parser.add_argument("--dpi", type=int, default=DPI,
+                        help=f"band エンジンのレンダリング解像度(既定: {DPI})")
+    add_encoding_arguments(parser)
+    add_cache_arguments(parser)
+    add_profile_arguments(parser)
+    args = parser.parse_args(argv)
+
+    with profiling(args):
+        encoder = encoder_from_args(args)
+        cache = cache_from_args(args)
+        for input_pdf in args.input_pdfs:
+            pdf_to_2in1_reverse(input_pdf, jobs=args.jobs, engine=args.engine, encoder=encoder,
+                                cache=cache, dpi=args.dpi)
 
 
 if __name__ == "__main__":
-    if len(sys.argv) != 2:
-        print("使い方: python pdf_b5_to_b4_2in1_reverse.py <入力PDFファイル>")
-        sys.exit(1)
-
-    pdf_to_2in1_reverse(sys.argv[1])
+    main()
@@ -1,8 +1,18 @@
+import argparse
 import os
-import sys
 import fitz  # PyMuPDF
 from PIL import Image
 
+from band_render import band_2in1
+from instrument import add_profile_arguments, count_input, count_output, profiling, stage
+from page_encoding import PageEncoder, add_encoding_arguments, encoder_from_args
+from page_pipeline import ordered_map
+from pdf_impose import vector_2in1
+from pixmap_view import pixmap_image
+from prefetch import DEFAULT_PREFETCH_MB, add_prefetch_arguments, open_pdfs, prefetched
+from render_cache import add_cache_arguments, cache_from_args, render_pixmap
+from scan_plan import list_files
+
 # === constant: B5 at 400dpi ===
 DPI = 400
 B5_WIDTH_PX = int(182 / 25.4 * DPI)
@@ -14,19 +24,33 @@ B4_WIDTH_PX = B5_WIDTH_PX * 2
 B4_HEIGHT_PX = B5_HEIGHT_PX
 B4_SIZE = (B4_WIDTH_PX, B4_HEIGHT_PX)
 
+# ラスタ版と同じページサイズになるB5(ポイント)
+B5_SIZE_PT = (B5_WIDTH_PX * 72 / DPI, B5_HEIGHT_PX * 72 / DPI)
 
-def render_page_to_b5(page):
-    """Render PDF page to B5-sized PIL image."""
+
+def render_page_pixmap(page, cache=None):
+    """
+    B5倍率でレンダリングした Pixmap を返す(cache があればレンダリングキャッシュを使う)。
+
+    MuPDFのドキュメントは呼び出し元スレッドから出さず、Pixmap だけをワーカーに渡す。
+    """
     zoom_x = B5_WIDTH_PX / page.rect.width
     zoom_y = B5_HEIGHT_PX / page.rect.height
     mat = fitz.Matrix(zoom_x, zoom_y)
 
-    pix = page.get_pixmap(matrix=mat, alpha=False)
-    img = Image.frombytes("RGB", (pix.width, pix.height), pix.samples)
+    return render_pixmap(page, cache, matrix=mat)
 
+
+def pixmap_to_b5(pix):
+    """Pixmap をコピーせずに参照し、B5サイズのPIL画像にする"""
     # 必ずB5にリサイズ（微妙なズレ補正）
-    img = img.resize(B5_SIZE, Image.LANCZOS)
-    return img
+    with stage("resize"):
+        return pixmap_image(pix).resize(B5_SIZE, Image.LANCZOS)
+
+
+def render_page_to_b5(page):
+    """Render PDF page to B5-sized PIL image."""
+    return pixmap_to_b5(render_page_pixmap(page))
 
 
 def make_2in1_b4(img1, img2):
@@ -37,14 +61,14 @@ def make_2in1_b4(img1, img2):
     return canvas
 
 
-def merge_and_2in1(input_dir):
+def merge_and_2in1(input_dir, jobs=1, engine="raster", encoder=None, cache=None, prefetch=0,
+                   prefetch_mb=DEFAULT_PREFETCH_MB, dpi=DPI):
     if not os.path.isdir(input_dir):
         print("指定されたディレクトリが存在しません:", input_dir)
         return
 
-    # PDFファイルをソート
-    pdf_files = [f for f in os.listdir(input_dir) if f.lower().endswith(".pdf")]
-    pdf_files.sort()
+    # PDFファイルを自然順(2.pdf < 10.pdf)にソート
+    pdf_files = list_files(input_dir, ".pdf")
 
     if not pdf_files:
         print("PDFファイルが見つかりません:", input_dir)
@@ -56,44 +80,104 @@ def merge_and_2in1(input_dir):
     dir_name = os.path.basename(os.path.normpath(input_dir))
     output_pdf = os.path.join(os.path.dirname(input_dir), f"{dir_name}_merged_2in1_B4.pdf")
 
-    # === PDF全ページをB5画像として展開 ===
-    b5_pages = []
+    # === prefetch > 0 なら処理中に次のPDFをバックグラウンドで読み込んでおく ===
+    pdf_paths = [os.path.join(input_dir, name) for name in pdf_files]
+    prefetcher = prefetched(pdf_paths, prefetch, prefetch_mb)
+
+    if engine == "vector":
+        # === 全PDFのページをベクターのまま2in1に面付け ===
+        docs = list(open_pdfs(pdf_paths, prefetcher))
+        pages = [(doc, i) for doc in docs for i in range(doc.page_count)]
+        vector_2in1(pages, output_pdf, B5_SIZE_PT)
+        count_input(pdf_paths)
+        count_output(output_pdf)
+        print("2in1マージPDFを作成しました:", output_pdf)
+        return
+
+    if engine == "band":
+        # === B4のキャンバスを作らず、帯ごとにレンダリング・圧縮して書き出す ===
+        encoder = encoder or PageEncoder()
+        encoder.stats.clear()
+        docs = list(open_pdfs(pdf_paths, prefetcher))
+        pages = [(doc, i) for doc in docs for i in range(doc.page_count)]
+        band_2in1(pages, output_pdf, encoder, dpi)
+        count_input(pdf_paths)
+        count_output(output_pdf)
+        print("2in1マージPDFを作成しました:", output_pdf)
+        print(" ", encoder.summary())
+        return
+
+    if cache is not None:
+        cache.stats.clear()
 
-    for pdf_name in pdf_files:
-        path = os.path.join(input_dir, pdf_name)
-        doc = fitz.open(path)
+    # === PDF全ページをB5画像として展開 ===
+    def rendered_pages():
+        for doc in open_pdfs(pdf_paths, prefetcher):
+            for page in doc:
+                yield render_page_pixmap(page, cache)
 
-        for page in doc:
-            b5_img = render_page_to_b5(page)
-            b5_pages.append(b5_img)
+    # レンダリングはこのスレッドで順に行い、B5へのリサイズを並列化する
+    b5_pages = list(ordered_map(pixmap_to_b5, rendered_pages(), jobs))
 
     # === 奇数なら白紙B5を追加 ===
     if len(b5_pages) % 2 == 1:
         b5_pages.append(Image.new("RGB", B5_SIZE, (255, 255, 255)))
 
-    # === 2in1 B4ページの生成 ===
-    b4_pages = []
-    for i in range(0, len(b5_pages), 2):
-        merged = make_2in1_b4(b5_pages[i], b5_pages[i + 1])
-        b4_pages.append(merged)
+    # === 2in1 B4ページの生成(シートごとにカラー/グレー/白黒2値へ変換) ===
+    encoder = encoder or PageEncoder()
+    encoder.stats.clear()
+
+    def build_sheet(i):
+        return encoder.prepare(make_2in1_b4(b5_pages[i], b5_pages[i + 1]))
+
+    b4_pages = list(ordered_map(build_sheet, range(0, len(b5_pages), 2), jobs))
 
     # === PDF出力 ===
     first = b4_pages[0]
     rest = b4_pages[1:]
 
-    first.save(
-        output_pdf,
-        save_all=True,
-        append_images=rest,
-        resolution=DPI
-    )
-
+    with stage("save"):
+        first.save(
+            output_pdf,
+            save_all=True,
+            append_images=rest,
+            resolution=DPI,
+            **encoder.pillow_save_options(b4_pages)
+        )
+
+    count_input(pdf_paths)
+    count_output(output_pdf)
     print("2in1マージPDFを作成しました:", output_pdf)
+    print(" ", encoder.summary())
+    if cache is not None:
+        print(" ", cache.summary())
+    if prefetcher is not None:
+        print(" ", prefetcher.summary())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="フォルダ内のPDFを結合して2in1 B4 PDFにする")
+    parser.add_argument("input_dirs", nargs="+", metavar="input_dir", help="PDFフォルダ(複数可)")
+    parser.add_argument("--jobs", type=int, default=1, metavar="N",
+                        help="ページのリサイズに使うスレッド数(ページ順は保たれる)")
+    parser.add_argument("--engine", choices=["raster", "vector", "band"], default="raster",
+                        help="raster: 400dpiで画像化 / vector: ページをベクターのまま配置 / "
+                             "band: 帯ごとにレンダリング・エンコードする(1シート数MBのメモリ)")
+    parser.add_argument("--dpi", type=int, default=DPI,
+                        help=f"band エンジンのレンダリング解像度(既定: {DPI})")
+    add_encoding_arguments(parser)
+    add_cache_arguments(parser)
+    add_prefetch_arguments(parser)
+    add_profile_arguments(parser)
+    args = parser.parse_args(argv)
+
+    with profiling(args):
+        encoder = encoder_from_args(args)
+        cache = cache_from_args(args)
+        for input_dir in args.input_dirs:
+            merge_and_2in1(input_dir, jobs=args.jobs, engine=args.engine, encoder=encoder, cache=cache,
+                           prefetch=args.prefetch, prefetch_mb=args.prefetch_mb, dpi=args.dpi)
 
 
 if __name__ == "__main__":
-    if len(sys.argv) != 2:
-        print("使い方: python pdf_folder_merge_2in1.py <PDFフォルダ>")
-        sys.exit(1)
-
-    merge_and_2in1(sys.argv[1])
+    main()
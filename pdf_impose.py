@@ -0,0 +1,40 @@
+import fitz  # PyMuPDF
+
+from instrument import stage
+
+# pdf_impose.py
+# ページをラスタライズせず、ベクターのまま(Form XObject として)2in1 に面付けする。
+# ラスタ版と同じく各ページはB5枠いっぱいに引き伸ばし、奇数ページの最後は右半分を白紙のままにする。
+
+
+def vector_2in1(pages, output_pdf, page_size):
+    """
+    ページを2枚ずつ横に並べたB4(横)PDFを作成する
+
+    Args:
+        pages (list[tuple[fitz.Document, int]]): 並べる順の (ドキュメント, ページ番号)
+        output_pdf (str): 出力PDFファイル
+        page_size (tuple[float, float]): 1面分(B5)の幅と高さ(ポイント)
+    """
+    half_width, height = page_size
+    out = fitz.open()
+
+    for i in range(0, len(pages), 2):
+        with stage("impose"):
+            _impose_sheet(out, pages[i:i + 2], half_width, height)
+
+    with stage("save"):
+        out.save(output_pdf, garbage=3, deflate=True)
+    out.close()
+
+
+def _impose_sheet(out, pair, half_width, height):
+    """pair の1〜2ページを新しいシートの左右に配置する"""
+    sheet = out.new_page(width=half_width * 2, height=height)
+    for slot, (doc, page_number) in enumerate(pair):
+        rect = fitz.Rect(half_width * slot, 0, half_width * (slot + 1), height)
+        try:
+            sheet.show_pdf_page(rect, doc, page_number, keep_proportion=False)
+        except ValueError:
+            # 内容のない(白紙の)ページは show_pdf_page できないので空欄のままにする
+            pass
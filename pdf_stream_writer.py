@@ -0,0 +1,171 @@
+import io
+import os
+from typing import NamedTuple
+
+from PIL import Image
+
+from instrument import stage
+
+# pdf_stream_writer.py
+# ページ画像を1枚ずつエンコードしてPDFファイルへ直接書き出す。
+# Image.save(save_all=True, append_images=...) と違い全ページをメモリに保持しないため、
+# 大量のスキャン画像でもピークメモリは数ページ分に収まる。
+
+
+class EncodedImage(NamedTuple):
+    """PDFの画像XObjectとしてそのまま埋め込めるエンコード済み画像"""
+    width: int
+    height: int
+    colorspace: str
+    bits: int
+    filter: str
+    data: bytes
+    decode: tuple | None = None
+    decode_parms: str | None = None
+
+
+def encode_image(image: Image.Image, quality: int = 75) -> EncodedImage:
+    """画像をJPEG(DCTDecode)にエンコードする"""
+    img = image if image.mode in ("RGB", "L") else image.convert("RGB")
+    buf = io.BytesIO()
+    img.save(buf, "JPEG", quality=quality)
+    colorspace = "DeviceGray" if img.mode == "L" else "DeviceRGB"
+    return EncodedImage(img.width, img.height, colorspace, 8, "DCTDecode", buf.getvalue())
+
+
+def pages_within_budget(page_bytes: int, max_memory_mb: float | None) -> int | None:
+    """max_memory_mb(MB)の予算内で同時に保持できるページ数を返す(予算なしは None)"""
+    if max_memory_mb is None:
+        return None
+    return max(1, int(max_memory_mb * 1024 * 1024 // page_bytes))
+
+
+def _num(value: float) -> bytes:
+    text = f"{value:.4f}".rstrip("0").rstrip(".")
+    return (text or "0").encode()
+
+
+class StreamingPdfWriter:
+    """
+    画像ページを逐次追記するPDFライター
+
+    ページの寸法・配置はピクセル単位で指定し、dpi でポイントに換算する。
+    with 文の途中で例外が起きた場合は書きかけのファイルを削除する。
+    """
+
+    def __init__(self, path: str, dpi: float = 72.0):
+        self.path = path
+        self.dpi = dpi
+        self.page_count = 0
+        self._fp = open(path, "wb")
+        self._offsets: dict[int, int] = {}
+        self._next_id = 1
+        self._page_ids: list[int] = []
+        self._pages_id = self._new_id()
+        self._fp.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self._fp.close()
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+    def _new_id(self) -> int:
+        obj_id = self._next_id
+        self._next_id += 1
+        return obj_id
+
+    def _write_obj(self, obj_id: int, body: bytes, stream: bytes | None = None):
+        self._offsets[obj_id] = self._fp.tell()
+        self._fp.write(b"%d 0 obj\n" % obj_id)
+        if stream is None:
+            self._fp.write(body)
+        else:
+            self._fp.write(b"<<" + body + b" /Length %d>>\nstream\n" % len(stream))
+            self._fp.write(stream)
+            self._fp.write(b"\nendstream")
+        self._fp.write(b"\nendobj\n")
+
+    def add_image(self, image: EncodedImage) -> int:
+        """画像XObjectを書き出し、そのオブジェクト番号を返す"""
+        obj_id = self._new_id()
+        body = (
+            b"/Type /XObject /Subtype /Image /Width %d /Height %d"
+            b" /ColorSpace /%s /BitsPerComponent %d /Filter /%s"
+            % (image.width, image.height, image.colorspace.encode(),
+               image.bits, image.filter.encode())
+        )
+        if image.decode:
+            body += b" /Decode [" + b" ".join(_num(v) for v in image.decode) + b"]"
+        if image.decode_parms:
+            body += b" /DecodeParms <<" + image.decode_parms.encode() + b">>"
+        with stage("write"):
+            self._write_obj(obj_id, body, image.data)
+        return obj_id
+
+    def add_page(self, width_px: float, height_px: float, placements):
+        """
+        ページを追加する
+
+        placements は (画像オブジェクト番号, (a, b, c, d, e, f)[, clip]) のリスト。
+        行列は画像の単位正方形をページ上のピクセル座標(左下原点)へ写す。
+        clip (x, y, 幅, 高さ) を指定すると、その矩形の外側は描画されない。
+        """
+        scale = 72.0 / self.dpi
+        ops = [b"q " + _num(scale) + b" 0 0 " + _num(scale) + b" 0 0 cm"]
+        xobjects = []
+        for i, (image_id, matrix, *clip) in enumerate(placements):
+            op = b"q "
+            if clip and clip[0]:
+                op += b" ".join(_num(v) for v in clip[0]) + b" re W n "
+            op += b" ".join(_num(v) for v in matrix) + b" cm /Im%d Do Q" % i
+            ops.append(op)
+            xobjects.append(b"/Im%d %d 0 R" % (i, image_id))
+        ops.append(b"Q\n")
+
+        contents_id = self._new_id()
+        self._write_obj(contents_id, b"", b"\n".join(ops))
+
+        page_id = self._new_id()
+        self._write_obj(
+            page_id,
+            b"<< /Type /Page /Parent %d 0 R /MediaBox [0 0 %s %s]"
+            b" /Resources << /XObject << %s >> >> /Contents %d 0 R >>"
+            % (self._pages_id, _num(width_px * scale), _num(height_px * scale),
+               b" ".join(xobjects), contents_id),
+        )
+        self._page_ids.append(page_id)
+        self.page_count += 1
+
+    def add_image_page(self, image: EncodedImage):
+        """画像1枚をページ全面に配置したページを追加する"""
+        image_id = self.add_image(image)
+        self.add_page(image.width, image.height,
+                      [(image_id, (image.width, 0, 0, image.height, 0, 0))])
+
+    def close(self):
+        if self._fp.closed:
+            return
+        kids = b" ".join(b"%d 0 R" % page_id for page_id in self._page_ids)
+        self._write_obj(
+            self._pages_id,
+            b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, len(self._page_ids)),
+        )
+        catalog_id = self._new_id()
+        self._write_obj(catalog_id, b"<< /Type /Catalog /Pages %d 0 R >>" % self._pages_id)
+
+        xref_offset = self._fp.tell()
+        self._fp.write(b"xref\n0 %d\n" % self._next_id)
+        self._fp.write(b"0000000000 65535 f \n")
+        for obj_id in range(1, self._next_id):
+            self._fp.write(b"%010d 00000 n \n" % self._offsets[obj_id])
+        self._fp.write(
+            b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%EOF\n"
+            % (self._next_id, catalog_id, xref_offset)
+        )
+        self._fp.close()
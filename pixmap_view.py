@@ -0,0 +1,29 @@
+import numpy as np
+from PIL import Image
+
+# pixmap_view.py
+# MuPDF の Pixmap のサンプルを、コピーせずに NumPy 配列 / PIL 画像として参照する。
+# pix.samples(bytes のコピー)や Image.frombytes を経由しないため、
+# 400dpi のページ1枚あたり数十MBのメモリコピーを省ける。
+#
+# 注意: ビューは元の Pixmap のメモリを直接指している。
+# Pixmap が解放されるとビューは無効になるため、ビューを使い終わるまで pix を保持すること。
+
+PIXMAP_MODES = {1: "L", 3: "RGB", 4: "RGBA"}
+
+
+def pixmap_array(pix) -> np.ndarray:
+    """Pixmap を (高さ, 幅, チャンネル数) の uint8 配列として参照する(コピーなし)"""
+    return np.ndarray(
+        (pix.height, pix.width, pix.n),
+        dtype=np.uint8,
+        buffer=pix.samples_mv,
+        strides=(pix.stride, pix.n, 1),
+    )
+
+
+def pixmap_image(pix) -> Image.Image:
+    """Pixmap を読み取り専用の PIL 画像として参照する(コピーなし)"""
+    mode = PIXMAP_MODES[pix.n]
+    return Image.frombuffer(mode, (pix.width, pix.height), pix.samples_mv,
+                            "raw", mode, pix.stride, 1)
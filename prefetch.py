@@ -0,0 +1,137 @@
+import io
+import os
+import threading
+import time
+from collections import Counter, deque
+
+import fitz  # PyMuPDF
+
+# prefetch.py
+# 入力ファイル(JPG / PDF)をバックグラウンドのスレッドで先読みし、メモリ上のバイト列として順に渡す。
+# ネットワーク共有のフォルダでは読み込み待ちの間CPUが遊び、デコード中はディスクが遊ぶため、
+# 現在のページを変換している間に次の K ファイルを読んでおく。
+#
+# 先読みするのは最大 K ファイルかつ合計 max_mb まで(1ファイルが上限より大きくてもそれ単独なら読む)。
+# 読み終わっていないファイルを待った時間を「待ち時間」として集計するので、
+# 待ち時間が大きければ K や上限を増やし、ほぼ 0 なら減らしてよい。
+
+DEFAULT_PREFETCH_MB = 256
+
+
+class Prefetcher:
+    """
+    paths の内容を先読みし、(パス, バイト列) を paths の順に返すイテラブル
+
+    Args:
+        paths (list[str]): 読み込むファイル(この順に返す)
+        ahead (int): 先読みするファイル数 K
+        max_mb (float): 先読みして保持するバイト数の上限(MB)
+    """
+
+    def __init__(self, paths, ahead=4, max_mb=DEFAULT_PREFETCH_MB):
+        self.paths = list(paths)
+        self.ahead = max(1, ahead)
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.stats = Counter()
+
+    def __iter__(self):
+        buffered = deque()
+        # 読み込み中のファイルも含めた先読み分の (ファイル数, バイト数)
+        reserved = [0, 0]
+        cond = threading.Condition()
+        stop = threading.Event()
+
+        def has_room(size):
+            if stop.is_set() or reserved[0] == 0:
+                return True
+            return reserved[0] < self.ahead and reserved[1] + size <= self.max_bytes
+
+        def reader():
+            for path in self.paths:
+                try:
+                    size = os.path.getsize(path)
+                except OSError:
+                    size = 0
+                with cond:
+                    cond.wait_for(lambda: has_room(size))
+                    if stop.is_set():
+                        return
+                    reserved[0] += 1
+                    reserved[1] += size
+
+                start = time.perf_counter()
+                try:
+                    with open(path, "rb") as f:
+                        data = f.read()
+                except Exception as e:
+                    data = e
+                read_seconds = time.perf_counter() - start
+
+                with cond:
+                    self.stats["read_seconds"] += read_seconds
+                    buffered.append((path, data, size))
+                    cond.notify_all()
+
+        thread = threading.Thread(target=reader, name="prefetch", daemon=True)
+        thread.start()
+        try:
+            for _ in self.paths:
+                with cond:
+                    if not buffered:
+                        start = time.perf_counter()
+                        cond.wait_for(lambda: buffered)
+                        self.stats["stall_seconds"] += time.perf_counter() - start
+                        self.stats["stalls"] += 1
+                    path, data, size = buffered.popleft()
+                    reserved[0] -= 1
+                    reserved[1] -= size
+                    cond.notify_all()
+                if isinstance(data, Exception):
+                    raise data
+                self.stats["files"] += 1
+                self.stats["bytes"] += len(data)
+                yield path, data
+        finally:
+            stop.set()
+            with cond:
+                cond.notify_all()
+            thread.join()
+
+    def summary(self) -> str:
+        return (
+            f"先読み: {self.stats['files']} ファイル {self.stats['bytes'] / (1024 * 1024):.1f} MB"
+            f" (読み込み {self.stats['read_seconds']:.2f} 秒,"
+            f" 待ち {self.stats['stall_seconds']:.2f} 秒 / {self.stats['stalls']} 回)"
+        )
+
+
+def add_prefetch_arguments(parser):
+    """--prefetch / --prefetch-mb を parser に追加する"""
+    parser.add_argument("--prefetch", type=int, default=0, metavar="K",
+                        help="変換中に次の K ファイルをバックグラウンドで読み込んでおく(0 なら先読みしない)")
+    parser.add_argument("--prefetch-mb", type=float, default=DEFAULT_PREFETCH_MB, metavar="MB",
+                        help=f"先読みで保持する量の上限(既定: {DEFAULT_PREFETCH_MB} MB)")
+
+
+def prefetched(paths, ahead=0, max_mb=DEFAULT_PREFETCH_MB):
+    """ahead > 0 なら Prefetcher を返し、0 なら None(先読みしない)"""
+    if ahead <= 0:
+        return None
+    return Prefetcher(paths, ahead, max_mb)
+
+
+def image_sources(paths, prefetcher=None):
+    """Image.open に渡す入力を順に返す(先読みしたものは BytesIO、なければパスのまま)"""
+    if prefetcher is None:
+        return iter(paths)
+    return (io.BytesIO(data) for _, data in prefetcher)
+
+
+def open_pdfs(paths, prefetcher=None):
+    """PDFを順に開いて返す(先読みしたものはメモリ上のバイト列から開く。doc.name は元のパス)"""
+    if prefetcher is None:
+        for path in paths:
+            yield fitz.open(path)
+    else:
+        for path, data in prefetcher:
+            yield fitz.open(path, stream=data)
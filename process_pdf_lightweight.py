@@ -1,39 +1,31 @@
 # process_pdf_lightweight_fixed.py
+import argparse
 import fitz
 import os
-import sys
 
-def is_completely_white(page):
-    text = page.get_text().strip()
-    if text:
-        return False
-
-    xobjs = page.get_xobjects()
-    images = [k for k in xobjs if xobjs[k]["type"] == fitz.PDF_XOBJECT_IMAGE]
-    if images:
-        return False
+from blank_detect import BlankDetector
+from build_manifest import SAVE_EVERY, BuildManifest, atomic_output
+from file_pool import run_file_jobs
+from instrument import add_profile_arguments, count_input, count_output, profiling, stage
+from page_select import SAVE_OPTIONS, select_pages
+from scan_plan import add_plan_arguments, natural_key, pdf_cost, plan_jobs
 
-    drawings = page.get_drawings()
-    if drawings:
-        return False
+# ラスタライズせず、内容ストリームとオブジェクトの有無だけで判定する
+WHITE_DETECTOR = BlankDetector(raster=False)
 
-    return True
+def is_completely_white(page):
+    return WHITE_DETECTOR.is_blank(page)
 
 def clean_and_reorder(pdf_path):
     doc = fitz.open(pdf_path)
     non_white_pages = [i for i, p in enumerate(doc) if not is_completely_white(p)]
-    new_doc = fitz.open()
     filename = os.path.basename(pdf_path).lower()
     if "kokugo" in filename:
         page_order = reversed(non_white_pages)
     else:
         page_order = non_white_pages
 
-    for i in page_order:
-        new_doc.insert_pdf(doc, from_page=i, to_page=i)
-
-    doc.close()
-    return new_doc
+    return select_pages(doc, page_order)
 
 def convert_to_b4_2in1(doc):
     B4_HEIGHT_PT = 72 * 10.12
@@ -51,9 +43,29 @@ def convert_to_b4_2in1(doc):
             new_page.show_pdf_page(right_rect, doc, i + 1)
     return out
 
-def process_folder_recursive(input_dir, output_dir):
+def process_pdf(input_pdf, output_pdf):
+    print("Processing:", input_pdf)
+    WHITE_DETECTOR.stats.clear()
+    cleaned = clean_and_reorder(input_pdf)
+    with stage("impose"):
+        final_doc = convert_to_b4_2in1(cleaned)
+    with atomic_output(output_pdf) as tmp_pdf, stage("save"):
+        final_doc.save(tmp_pdf, **SAVE_OPTIONS)
+    final_doc.close()
+    cleaned.close()
+    count_input([input_pdf])
+    count_output(output_pdf)
+    print(" → Saved:", output_pdf)
+    print("  ", WHITE_DETECTOR.summary())
+
+def process_folder_recursive(input_dir, output_dir, workers=1, incremental=False, plan=None):
+    options = {"tool": "process_pdf_lightweight"}
+    os.makedirs(output_dir, exist_ok=True)
+    manifest = BuildManifest(output_dir, save_every=SAVE_EVERY) if incremental else None
+    jobs = []
     for root, dirs, files in os.walk(input_dir):
-        for file in files:
+        dirs.sort(key=natural_key)
+        for file in sorted(files, key=natural_key):
             if not file.lower().endswith(".pdf"):
                 continue
             input_pdf = os.path.join(root, file)
@@ -62,19 +74,38 @@ def process_folder_recursive(input_dir, output_dir):
             os.makedirs(out_dir, exist_ok=True)
             out_filename = os.path.splitext(file)[0] + "_processed.pdf"
             output_pdf = os.path.join(out_dir, out_filename)
-            print("Processing:", input_pdf)
-            cleaned = clean_and_reorder(input_pdf)
-            final_doc = convert_to_b4_2in1(cleaned)
-            final_doc.save(output_pdf)
-            final_doc.close()
-            cleaned.close()
-            print(" → Saved:", output_pdf)
+            if manifest is not None and manifest.is_current(output_pdf, [input_pdf], options):
+                print("Up to date:", input_pdf)
+                continue
+            jobs.append((input_pdf, (input_pdf, output_pdf)))
+    # largest PDFs first so that one big file does not finish last
+    jobs = plan_jobs(jobs, pdf_cost, workers, plan)
+
+    # record each output as soon as it is written, so an interrupted run keeps the finished ones
+    def record(name, args):
+        input_pdf, output_pdf = args
+        manifest.record(output_pdf, [input_pdf], options)
+
+    try:
+        run_file_jobs(process_pdf, jobs, workers, on_success=record if manifest is not None else None)
+    finally:
+        if manifest is not None:
+            manifest.save()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Remove blank pages and make B4 2in1 PDFs recursively")
+    parser.add_argument("input_dir")
+    parser.add_argument("output_dir")
+    parser.add_argument("--workers", type=int, default=1, metavar="N",
+                        help="number of processes; PDFs are spread across them file by file")
+    parser.add_argument("--incremental", action="store_true",
+                        help="skip PDFs whose input and options are unchanged since the last run")
+    add_plan_arguments(parser)
+    add_profile_arguments(parser)
+    args = parser.parse_args(argv)
 
-def main():
-    if len(sys.argv) < 3:
-        print("Usage: python process_pdf_lightweight_fixed.py <input_dir> <output_dir>")
-        return
-    process_folder_recursive(sys.argv[1], sys.argv[2])
+    with profiling(args):
+        process_folder_recursive(args.input_dir, args.output_dir, args.workers, args.incremental, args.plan)
 
 if __name__ == "__main__":
     main()
@@ -1,52 +1,93 @@
 import fitz  # PyMuPDF
-from PIL import Image
-import numpy as np
+import argparse
+import io
 import os
-import sys
+
+from blank_detect import BlankDetector
+from build_manifest import SAVE_EVERY, BuildManifest, atomic_output
+from file_pool import run_file_jobs
+from instrument import add_profile_arguments, count_input, count_output, profiling, stage
+from page_encoding import DEFAULT_QUALITY
+from page_select import select_pages
+from pixmap_view import pixmap_image
+from render_cache import DEFAULT_CACHE_SIZE_MB, RenderCache, add_cache_arguments, render_pixmap
+from render_plan import plan_page_dpi
+from scan_plan import add_plan_arguments, natural_key, pdf_cost, plan_jobs
+from shard_render import sharded_map
+
+# 白紙判定器（実行全体で段ごとの判定件数を集計する）
+WHITE_DETECTOR = BlankDetector(dpi=100)
+
+# レンダリング解像度の上限（--fixed-dpi なら全ページこの解像度）
+DEFAULT_DPI = 400
+
+# ページ画像の埋め込み方と、そのときの保存オプション
+#   pixmap: レンダリング結果をそのまま(無圧縮)埋め込む
+#   flate : 無劣化のまま Flate で圧縮して保存する
+#   jpeg  : JPEG にして埋め込む(--quality)
+EMBED_SAVE_OPTIONS = {
+    "pixmap": {},
+    "flate": {"deflate": True},
+    "jpeg": {"deflate": True},
+}
 
 
 # ------------------------------------------------------------
-# 1. 完全白紙ページ判定（RGB全255）
+# 1. 完全白紙ページ判定（全画素255）
 # ------------------------------------------------------------
 def is_completely_white(page):
-    pix = page.get_pixmap(dpi=100)  # 低dpiで高速化
-    img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
-    arr = np.asarray(img)
-
-    return arr.max() == 255 and arr.min() == 255
+    # 内容ストリーム → オブジェクト → 100dpiグレースケールの順に判定
+    return WHITE_DETECTOR.is_blank(page)
 
 
 # ------------------------------------------------------------
 # 2. 白紙削除 & kokugo の場合はページ逆順
 # ------------------------------------------------------------
-def clean_and_reorder(pdf_path):
-    doc = fitz.open(pdf_path)
-
+def cleaned_page_order(doc, pdf_path):
+    """白紙を除いたページ番号(元PDFの番号)を出力順に返す"""
     # 白紙削除
     non_white_pages = []
     for i, page in enumerate(doc):
         if not is_completely_white(page):
             non_white_pages.append(i)
 
-    # 新しいPDFへコピー
-    new_doc = fitz.open()
-
     if "kokugo" in os.path.basename(pdf_path).lower():
-        page_order = reversed(non_white_pages)
-    else:
-        page_order = non_white_pages
+        return non_white_pages[::-1]
+    return non_white_pages
 
-    for i in page_order:
-        new_doc.insert_pdf(doc, from_page=i, to_page=i)
 
-    doc.close()
-    return new_doc
+def clean_and_reorder(pdf_path):
+    doc = fitz.open(pdf_path)
+    page_order = cleaned_page_order(doc, pdf_path)
+
+    # 残すページを出力順に並べ替える(ページごとにコピーしない)
+    return select_pages(doc, page_order)
 
 
 # ------------------------------------------------------------
-# 3. B5ページ → 400dpi 2in1 B4 ページ化
+# 3. B5ページ → 2in1 B4 ページ化(最大 dpi、既定400dpi)
 # ------------------------------------------------------------
-def convert_to_b4_2in1(doc):
+def convert_to_b4_2in1(doc, page_numbers=None, cache=None, render_workers=1, dpi=DEFAULT_DPI,
+                       adaptive_dpi=True, embed="pixmap", quality=DEFAULT_QUALITY):
+    """
+    doc のページ(page_numbers があればその順)を2ページずつB4に並べる
+
+    元PDFを開いたまま page_numbers を渡すと、レンダリングキャッシュのキーが元PDFのページ番号になる。
+    render_workers > 1 なら、ファイルから開いた doc を連続したページ範囲ごとに別プロセスで処理する。
+    adaptive_dpi なら、ページごとに貼られた画像の解像度から dpi 以下の解像度を選ぶ(render_plan)。
+    embed はページ画像の埋め込み方(pixmap / flate / jpeg)。
+    """
+    if render_workers > 1 and doc.name:
+        if page_numbers is None:
+            page_numbers = range(doc.page_count)
+        # 各ワーカーが自分の範囲のB4ページを小さなPDFにして返し、ここでは順に連結するだけ
+        out = fitz.open()
+        for data in sharded_map(convert_shard, doc.name, page_numbers, render_workers,
+                                args=(dpi, adaptive_dpi, embed, quality), cache=cache):
+            with fitz.open("pdf", data) as part:
+                out.insert_pdf(part)
+        return out
+
     B4_WIDTH = 728  # 257mm * 2.835 (fitz pixel per point conversion) ではない
     B4_HEIGHT = 1031  # fitzはポイントなので後で調整
 
@@ -57,9 +98,16 @@ def convert_to_b4_2in1(doc):
     # 新PDF
     out = fitz.open()
 
-    pages = [p for p in doc]
+    if page_numbers is None:
+        page_numbers = range(doc.page_count)
+    pages = [doc[i] for i in page_numbers]
     total = len(pages)
 
+    def render(page):
+        # 元の画像より細かくしても情報は増えないので、ページごとに必要な解像度だけでレンダリングする
+        page_dpi = plan_page_dpi(page, dpi) if adaptive_dpi else dpi
+        return render_pixmap(page, cache, dpi=page_dpi)
+
     # 2ページずつ処理
     for i in range(0, total, 2):
         left_page = pages[i]
@@ -67,27 +115,94 @@ def convert_to_b4_2in1(doc):
         # 新規B4ページ
         new_page = out.new_page(width=B4_WIDTH_PT, height=B4_HEIGHT_PT)
 
-        # 左ページを400dpiレンダリング
-        left_pix = left_page.get_pixmap(dpi=400)
+        # 左ページをレンダリング
+        left_pix = render(left_page)
         left_rect = fitz.Rect(0, 0, B4_WIDTH_PT / 2, B4_HEIGHT_PT)
-        new_page.insert_image(left_rect, pixmap=left_pix)
+        embed_pixmap(new_page, left_rect, left_pix, embed, quality)
 
         # 右ページがあれば挿入
         if i + 1 < total:
             right_page = pages[i + 1]
-            right_pix = right_page.get_pixmap(dpi=400)
+            right_pix = render(right_page)
             right_rect = fitz.Rect(B4_WIDTH_PT / 2, 0, B4_WIDTH_PT, B4_HEIGHT_PT)
-            new_page.insert_image(right_rect, pixmap=right_pix)
+            embed_pixmap(new_page, right_rect, right_pix, embed, quality)
 
     return out
 
 
+def embed_pixmap(page, rect, pix, embed="pixmap", quality=DEFAULT_QUALITY):
+    """pix を page の rect に埋め込む(jpeg なら JPEG のストリームとして埋め込む)"""
+    with stage("embed"):
+        if embed == "jpeg":
+            # MuPDF の JPEG エンコーダより Pillow のほうが数倍速い
+            buf = io.BytesIO()
+            pixmap_image(pix).save(buf, "JPEG", quality=quality)
+            page.insert_image(rect, stream=buf.getvalue())
+        else:
+            page.insert_image(rect, pixmap=pix)
+
+
+def convert_shard(doc, page_numbers, cache, dpi, adaptive_dpi, embed, quality):
+    """ワーカープロセスで1シャード分をB4 2in1にし、PDFのバイト列で返す"""
+    part = convert_to_b4_2in1(doc, page_numbers, cache, dpi=dpi, adaptive_dpi=adaptive_dpi,
+                              embed=embed, quality=quality)
+    try:
+        return part.tobytes(**EMBED_SAVE_OPTIONS[embed])
+    finally:
+        part.close()
+
+
 # ------------------------------------------------------------
 # 再帰処理でフォルダ内すべてのPDFを処理
 # ------------------------------------------------------------
-def process_folder_recursive(input_dir, output_dir):
+def process_pdf(input_pdf, output_pdf, tolerance=0, cache_dir=None, cache_size=DEFAULT_CACHE_SIZE_MB,
+                render_workers=1, dpi=DEFAULT_DPI, adaptive_dpi=True, embed="pixmap", quality=DEFAULT_QUALITY):
+    """PDF 1ファイルを白紙削除・並べ替え・2in1化して保存する"""
+    print(f"Processing: {input_pdf}")
+    WHITE_DETECTOR.tolerance = tolerance
+    WHITE_DETECTOR.stats.clear()
+    # ワーカープロセスでも使えるよう、キャッシュはファイルごとにフォルダから開く
+    cache = RenderCache(cache_dir, cache_size) if cache_dir else None
+
+    # Step1, Step2（元PDFは開いたまま、残すページ番号だけを決める）
+    doc = fitz.open(input_pdf)
+    page_order = cleaned_page_order(doc, input_pdf)
+
+    # Step3
+    final_doc = convert_to_b4_2in1(doc, page_order, cache, render_workers, dpi, adaptive_dpi, embed, quality)
+
+    # Save（一時ファイル経由で置き換え、中断時に書きかけを残さない）
+    with atomic_output(output_pdf) as tmp_pdf, stage("save"):
+        final_doc.save(tmp_pdf, **EMBED_SAVE_OPTIONS[embed])
+    final_doc.close()
+    doc.close()
+    count_input([input_pdf])
+    count_output(output_pdf)
+
+    print(f" → Saved: {output_pdf}")
+    print(f"   {WHITE_DETECTOR.summary()}")
+    if cache is not None:
+        print(f"   {cache.summary()}")
+    print()
+
+
+def process_folder_recursive(input_dir, output_dir, workers=1, tolerance=0, incremental=False,
+                             cache_dir=None, cache_size=DEFAULT_CACHE_SIZE_MB, render_workers=1,
+                             dpi=DEFAULT_DPI, adaptive_dpi=True, embed="pixmap", quality=DEFAULT_QUALITY,
+                             plan=None):
+    # 入力PDFとオプションが前回と同じ出力はスキップする（マニフェストは output_dir に置く）
+    options = {"tool": "process_pdf_recursive", "tolerance": tolerance, "dpi": dpi,
+               "adaptive_dpi": adaptive_dpi, "embed": embed}
+    if embed == "jpeg":
+        options["quality"] = quality
+    os.makedirs(output_dir, exist_ok=True)
+    manifest = BuildManifest(output_dir, save_every=SAVE_EVERY) if incremental else None
+    skipped = 0
+
+    jobs = []
     for root, dirs, files in os.walk(input_dir):
-        for file in files:
+        dirs.sort(key=natural_key)
+        for file in sorted(files, key=natural_key):
             if not file.lower().endswith(".pdf"):
                 continue
 
@@ -101,34 +216,63 @@ def process_folder_recursive(input_dir, output_dir):
             out_name = os.path.splitext(file)[0] + "_processed.pdf"
             output_pdf = os.path.join(out_dir, out_name)
 
-            print(f"Processing: {input_pdf}")
+            if manifest is not None and manifest.is_current(output_pdf, [input_pdf], options):
+                skipped += 1
+                continue
+
+            jobs.append((input_pdf, (input_pdf, output_pdf, tolerance, cache_dir, cache_size,
+                                      render_workers, dpi, adaptive_dpi, embed, quality)))
 
-            # Step1, Step2
-            cleaned_doc = clean_and_reorder(input_pdf)
+    if skipped:
+        print(f"変更がないためスキップ: {skipped} ファイル")
 
-            # Step3
-            final_doc = convert_to_b4_2in1(cleaned_doc)
+    # workers > 1 ならページ数の多いPDFから順にプロセスへ分散（ログはファイルごとにまとめて出力）
+    jobs = plan_jobs(jobs, pdf_cost, workers, plan)
 
-            # Save
-            final_doc.save(output_pdf)
-            final_doc.close()
-            cleaned_doc.close()
+    # 終わったファイルから順にマニフェストに記録する(中断しても、終わった分は次回スキップされる)
+    def record(name, args):
+        input_pdf, output_pdf, *_ = args
+        manifest.record(output_pdf, [input_pdf], options)
 
-            print(f" → Saved: {output_pdf}\n")
+    try:
+        run_file_jobs(process_pdf, jobs, workers, on_success=record if manifest is not None else None)
+    finally:
+        if manifest is not None:
+            manifest.save()
 
 
 # ------------------------------------------------------------
 # メイン
 # ------------------------------------------------------------
-def main():
-    if len(sys.argv) < 3:
-        print("使い方: python process_pdf_recursive.py <input_dir> <output_dir>")
-        return
-
-    input_dir = sys.argv[1]
-    output_dir = sys.argv[2]
-
-    process_folder_recursive(input_dir, output_dir)
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="フォルダ内のPDFを再帰的に白紙削除・2in1化する")
+    parser.add_argument("input_dir")
+    parser.add_argument("output_dir")
+    parser.add_argument("--tolerance", type=int, default=0,
+                        help="白とみなす明るさの許容幅（0なら255のみ白）")
+    parser.add_argument("--workers", type=int, default=1, metavar="N",
+                        help="PDFをファイル単位で並列処理するプロセス数")
+    parser.add_argument("--render-workers", type=int, default=1, metavar="N",
+                        help="1つのPDFのレンダリングを連続したページ範囲ごとに分担するプロセス数")
+    parser.add_argument("--dpi", type=int, default=DEFAULT_DPI,
+                        help=f"レンダリング解像度の上限（既定: {DEFAULT_DPI}）")
+    parser.add_argument("--fixed-dpi", action="store_true",
+                        help="貼られた画像の解像度に合わせず、全ページを --dpi でレンダリングする")
+    parser.add_argument("--embed", choices=sorted(EMBED_SAVE_OPTIONS), default="pixmap",
+                        help="ページ画像の埋め込み方（pixmap: 無圧縮 / flate: 無劣化で圧縮 / jpeg: JPEG）")
+    parser.add_argument("--quality", type=int, default=DEFAULT_QUALITY,
+                        help=f"--embed jpeg のときのJPEGの品質（既定: {DEFAULT_QUALITY}）")
+    parser.add_argument("--incremental", action="store_true",
+                        help="入力PDFとオプションが前回から変わっていないファイルはスキップする")
+    add_cache_arguments(parser)
+    add_plan_arguments(parser)
+    add_profile_arguments(parser)
+    args = parser.parse_args(argv)
+
+    with profiling(args):
+        process_folder_recursive(args.input_dir, args.output_dir, args.workers, args.tolerance,
+                                 args.incremental, args.cache_dir, args.cache_size, args.render_workers,
+                                 args.dpi, not args.fixed_dpi, args.embed, args.quality, args.plan)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,205 @@
+import hashlib
+import os
+import struct
+import zlib
+from collections import Counter
+
+import fitz  # PyMuPDF
+
+from build_manifest import atomic_output, file_digest
+from instrument import count, stage
+
+# render_cache.py
+# PDFページのレンダリング結果(Pixmap)をローカルディスクにキャッシュする。
+# キーは 元PDFの内容ハッシュ・ページ番号・変換行列・dpi・色空間 で、
+# 同じPDFから通常版と逆順版の2in1を作るときなど、同じページを2度レンダリングしない。
+#
+# サンプルは zlib で圧縮して保存する。合計サイズが上限を超えたら、
+# 最後に使われた時刻(ヒット時に更新する mtime)が古いものから削除する。
+# 複数プロセスから同時に使ってもよい(書き込みは一時ファイル経由、読めなければミス扱い)。
+
+DEFAULT_CACHE_SIZE_MB = 2048
+
+# 幅, 高さ, チャンネル数, alpha, dpi(x), dpi(y)
+_HEADER = struct.Struct("<IIBBII")
+
+
+class RenderCache:
+    """
+    ページレンダリングのディスクキャッシュ
+
+    Args:
+        directory (str): キャッシュを置くフォルダ
+        max_mb (float): キャッシュ全体のサイズ上限(MB)
+        level (int): zlib の圧縮レベル
+    """
+
+    def __init__(self, directory, max_mb=DEFAULT_CACHE_SIZE_MB, level=1):
+        self.directory = directory
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.level = level
+        self.stats = Counter()
+        self._digests = {}
+        self._total = None
+        os.makedirs(directory, exist_ok=True)
+
+    def document_digest(self, doc):
+        """ファイルから開いたPDFの内容ハッシュ(メモリ上のPDFなら None)"""
+        path = doc.name
+        if not path or not os.path.isfile(path):
+            return None
+        stat = os.stat(path)
+        state = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+        if state not in self._digests:
+            self._digests[state] = file_digest(path)
+        return self._digests[state]
+
+    def _entry_path(self, page, matrix, dpi, colorspace, alpha):
+        digest = self.document_digest(page.parent)
+        if digest is None:
+            return None
+        key = "|".join([
+            digest,
+            str(page.number),
+            ",".join(f"{v:.6f}" for v in tuple(matrix)),
+            str(dpi),
+            colorspace.name,
+            str(int(alpha)),
+        ])
+        name = hashlib.sha256(key.encode()).hexdigest()
+        return os.path.join(self.directory, name[:2], name + ".pix")
+
+    def get_pixmap(self, page, matrix=None, dpi=None, colorspace=fitz.csRGB, alpha=False):
+        """page.get_pixmap と同じ引数でレンダリングし、キャッシュにあればそれを返す"""
+        matrix = fitz.Matrix(1, 1) if matrix is None else fitz.Matrix(matrix)
+        path = self._entry_path(page, matrix, dpi, colorspace, alpha)
+
+        if path is not None:
+            pix = self._load(path, colorspace)
+            if pix is not None:
+                self.stats["hit"] += 1
+                count("cache_hit")
+                return pix
+
+        pix = page.get_pixmap(matrix=matrix, dpi=dpi, colorspace=colorspace, alpha=alpha)
+        self.stats["miss"] += 1
+        count("cache_miss")
+        if path is not None:
+            self._store(path, pix)
+        return pix
+
+    def _load(self, path, colorspace):
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path)  # 最近使ったものとして残す
+        except OSError:
+            return None
+        # クラッシュで途中までしか書かれなかったファイル(長さ0を含む)は、ミスとして扱って削除する
+        if len(data) < _HEADER.size:
+            self._discard(path, len(data))
+            return None
+        try:
+            width, height, n, alpha, xres, yres = _HEADER.unpack_from(data)
+            samples = zlib.decompress(memoryview(data)[_HEADER.size:])
+        except (struct.error, zlib.error):
+            self._discard(path, len(data))
+            return None
+        if len(samples) != width * height * n:
+            self._discard(path, len(data))
+            return None
+        pix = fitz.Pixmap(colorspace, width, height, samples, bool(alpha))
+        pix.set_dpi(xres, yres)
+        return pix
+
+    def _discard(self, path, size):
+        """壊れたエントリを削除する"""
+        try:
+            os.remove(path)
+        except OSError:
+            return
+        self.stats["corrupt"] += 1
+        if self._total is not None:
+            self._total -= size
+
+    def _store(self, path, pix):
+        header = _HEADER.pack(pix.width, pix.height, pix.n, int(pix.alpha), pix.xres, pix.yres)
+        data = header + zlib.compress(pix.samples_mv, self.level)
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with atomic_output(path) as tmp_path:
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+        self.stats["written_bytes"] += len(data)
+
+        if self._total is None:
+            self._total = sum(size for _, size, _ in self._entries())
+        else:
+            self._total += len(data)
+        if self._total > self.max_bytes:
+            self._evict()
+
+    def _entries(self):
+        """(パス, サイズ, mtime) の一覧"""
+        entries = []
+        for sub in os.scandir(self.directory):
+            if not sub.is_dir():
+                continue
+            for entry in os.scandir(sub.path):
+                if entry.name.endswith(".pix"):
+                    try:
+                        stat = entry.stat()
+                    except OSError:
+                        continue
+                    entries.append((entry.path, stat.st_size, stat.st_mtime_ns))
+        return entries
+
+    def _evict(self):
+        """古いものから削除して上限の9割まで減らす"""
+        entries = sorted(self._entries(), key=lambda e: e[2])
+        total = sum(size for _, size, _ in entries)
+        target = self.max_bytes * 0.9
+        for path, size, _ in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            self.stats["evicted"] += 1
+        self._total = total
+
+    def summary(self) -> str:
+        text = (
+            f"レンダリングキャッシュ: hit={self.stats['hit']} miss={self.stats['miss']}"
+            f" (書き込み {self.stats['written_bytes'] / (1024 * 1024):.1f} MB,"
+            f" 削除 {self.stats['evicted']} 件)"
+        )
+        if self.stats["corrupt"]:
+            text += f" 壊れたエントリ {self.stats['corrupt']} 件を削除"
+        return text
+
+
+def add_cache_arguments(parser):
+    """--cache-dir / --cache-size を parser に追加する"""
+    parser.add_argument("--cache-dir", metavar="DIR",
+                        help="レンダリング結果をこのフォルダにキャッシュし、同じページの再レンダリングを省く")
+    parser.add_argument("--cache-size", type=float, default=DEFAULT_CACHE_SIZE_MB, metavar="MB",
+                        help=f"キャッシュの上限サイズ(既定: {DEFAULT_CACHE_SIZE_MB} MB)。超えたら古いものから削除する")
+
+
+def cache_from_args(args):
+    """--cache-dir が指定されていれば RenderCache を返す(なければ None)"""
+    if not args.cache_dir:
+        return None
+    return RenderCache(args.cache_dir, args.cache_size)
+
+
+def render_pixmap(page, cache=None, matrix=None, dpi=None, colorspace=fitz.csRGB, alpha=False):
+    """cache があればキャッシュ経由で、なければそのまま page をレンダリングする"""
+    with stage("render"):
+        if cache is not None:
+            return cache.get_pixmap(page, matrix=matrix, dpi=dpi, colorspace=colorspace, alpha=alpha)
+        matrix = fitz.Identity if matrix is None else matrix
+        return page.get_pixmap(matrix=matrix, dpi=dpi, colorspace=colorspace, alpha=alpha)
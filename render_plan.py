@@ -0,0 +1,56 @@
+import math
+
+from instrument import count
+
+# render_plan.py
+# ページに貼られた画像の解像度を調べ、元の細部を失わない最低のレンダリング解像度を決める。
+#
+# スキャンしたPDFは 150〜300dpi のJPEGをページに1枚貼っただけのことが多く、400dpi でレンダリングしても
+# 元の画素を引き伸ばすだけで、時間・メモリ・出力サイズが最大で4倍になる。
+#   - 画像の実効解像度 = 画像の画素数 / ページ上に配置された大きさ(回転・傾きも考慮)
+#   - ページ上の画像のうち最も高い実効解像度を DPI_STEP 単位に切り上げ、[MIN_DPI, 上限] に収める
+#   - 見えるテキスト・図形・注釈のあるページ、画像のないページはベクターなので上限の解像度のまま
+# OCR の透明テキスト(描画モード3)は表示されないため、ベクターとはみなさない。
+
+DPI_STEP = 50
+MIN_DPI = 100
+
+
+def image_dpi(page):
+    """ページ上の画像の実効解像度の最大値。画像がなければ None"""
+    best = None
+    for item in page.get_images(full=True):
+        xref, width, height = item[0], item[2], item[3]
+        for _, matrix in page.get_image_rects(xref, transform=True):
+            # 変換行列は画像の単位正方形をページに写すので、各辺の長さが配置された大きさ(ポイント)
+            placed_w = math.hypot(matrix.a, matrix.b)
+            placed_h = math.hypot(matrix.c, matrix.d)
+            if placed_w <= 0 or placed_h <= 0:
+                continue
+            dpi = max(width * 72 / placed_w, height * 72 / placed_h)
+            best = dpi if best is None else max(best, dpi)
+    return best
+
+
+def has_vector_content(page):
+    """見えるテキスト・図形・注釈があれば True(どの解像度でもレンダリングで細部が失われうる)"""
+    if page.first_annot is not None or page.first_widget is not None:
+        return True
+    if any(span["type"] != 3 and span["opacity"] > 0 for span in page.get_texttrace()):
+        return True
+    return bool(page.get_drawings())
+
+
+def plan_page_dpi(page, max_dpi=400):
+    """page をレンダリングする解像度(max_dpi 以下)"""
+    if has_vector_content(page):
+        count("dpi_vector_pages")
+        return max_dpi
+    source = image_dpi(page)
+    if source is None:
+        count("dpi_vector_pages")
+        return max_dpi
+    dpi = min(max_dpi, max(MIN_DPI, math.ceil(source / DPI_STEP) * DPI_STEP))
+    if dpi < max_dpi:
+        count("dpi_reduced_pages")
+    return dpi
@@ -0,0 +1,188 @@
+import math
+
+from PIL import Image
+
+# scan_decode.py
+# スキャン画像のデコード計画。
+# 出力サイズ(B5など)を先に決め、JPEGは libjpeg の DCT スケーリング(1/2, 1/4, 1/8)で
+# 必要な解像度ぎりぎりまで縮小デコードする。LANCZOS は残りのわずかな縮小だけを担当する。
+#
+# 拡大・中央トリミング(余白なし)は fit_cover にまとめてある。
+# 既定では exif_transpose → resize → crop の従来の結果と画素単位で同じになるようにしたまま、
+# 途中のコピーと、切り落とす列のリサンプルを省く。
+
+EXIF_ORIENTATION = 0x0112
+
+# 90度・270度の回転を含むEXIF方向(幅と高さが入れ替わる)
+TRANSPOSED_ORIENTATIONS = {5, 6, 7, 8}
+
+# EXIF方向ごとの、格納画像 → 表示向き の変換(ImageOps.exif_transpose と同じ)
+ORIENTATION_TRANSPOSE = {
+    2: Image.Transpose.FLIP_LEFT_RIGHT,
+    3: Image.Transpose.ROTATE_180,
+    4: Image.Transpose.FLIP_TOP_BOTTOM,
+    5: Image.Transpose.TRANSPOSE,
+    6: Image.Transpose.ROTATE_270,
+    7: Image.Transpose.TRANSVERSE,
+    8: Image.Transpose.ROTATE_90,
+}
+
+
+def exif_orientation(img: Image.Image) -> int:
+    """EXIFの方向タグ(1〜8)を返す。無ければ1"""
+    return img.getexif().get(EXIF_ORIENTATION, 1)
+
+
+# 縮小デコード後に許す不足分の割合。
+# 400dpiのB5(2866x4047)に対し 6000x8000 のスキャンは約1.98倍しかないため、
+# 数%の不足を許さないと 1/2 デコードが使えない。
+DRAFT_SLACK = 0.02
+
+
+def plan_draft_size(src_size, target_size, orientation=1, slack=DRAFT_SLACK):
+    """
+    向き補正後に target_size へ拡大・中央トリミング(余白なし)するとき、
+    生の向きで最低限必要なデコードサイズを返す。縮小デコードの余地がなければ None
+
+    Args:
+        src_size (tuple[int, int]): JPEGの格納サイズ(向き補正前)
+        target_size (tuple[int, int]): 出力サイズ(向き補正後)
+        orientation (int): EXIFの方向タグ
+        slack (float): 必要サイズに対して許す不足分の割合
+    """
+    width, height = src_size
+    target_w, target_h = target_size
+    if orientation in TRANSPOSED_ORIENTATIONS:
+        target_w, target_h = target_h, target_w
+
+    scale = max(target_w / width, target_h / height) * (1 - slack)
+    if scale > 0.5:
+        return None
+    return math.ceil(width * scale), math.ceil(height * scale)
+
+
+def request_draft(img: Image.Image, target_size) -> int:
+    """
+    JPEGなら target_size に足りる範囲で縮小デコードを予約し、縮小率の分母(1, 2, 4, 8)を返す
+
+    Image.open 直後(ピクセルを読む前)に呼ぶこと。JPEG以外は何もしない。
+    """
+    if img.format != "JPEG":
+        return 1
+    request = plan_draft_size(img.size, target_size, exif_orientation(img))
+    if request is None:
+        return 1
+
+    original_width = img.width
+    img.draft(img.mode, request)
+    return original_width // img.width
+
+
+def plan_cover(src_size, target_size):
+    """
+    src_size の画像を target_size 全体を覆うよう拡大し、中央を切り出すときの
+    ((拡大後の幅, 高さ), (切り出しの左, 上)) を返す
+    """
+    width, height = src_size
+    target_w, target_h = target_size
+    img_ratio = width / height
+
+    if img_ratio > target_w / target_h:
+        # 横長 → 高さを合わせて左右を切り落とす
+        new_h = target_h
+        new_w = int(new_h * img_ratio)
+    else:
+        # 縦長 → 幅を合わせて上下を切り落とす
+        new_w = target_w
+        new_h = int(new_w / img_ratio)
+
+    return (new_w, new_h), ((new_w - target_w) // 2, (new_h - target_h) // 2)
+
+
+def cover_resize(img: Image.Image, target_size) -> Image.Image:
+    """
+    img.resize(拡大後のサイズ, LANCZOS).crop(中央) と画素単位で同じ画像を返す
+
+    Pillow の resize は横方向・縦方向の順に1次元ずつリサンプルし、間で8bitに丸める。
+    左右を切り落とす場合は横方向だけ拡大してから切り出し、縦方向は残る列だけを処理する。
+    (resize の box 引数はフィルタの中心を浮動小数で計算し直すため、結果が1〜2階調ずれる)
+    """
+    (new_w, new_h), (left, top) = plan_cover(img.size, target_size)
+    target_w, target_h = target_size
+
+    if new_w > target_w:
+        wide = img.resize((new_w, img.height), Image.LANCZOS)
+        return wide.crop((left, 0, left + target_w, img.height)).resize(target_size, Image.LANCZOS)
+
+    resized = img.resize((new_w, new_h), Image.LANCZOS)
+    if resized.size == tuple(target_size):
+        return resized
+    return resized.crop((left, top, left + target_w, top + target_h))
+
+
+def _source_box(box, display_size, orientation):
+    """表示向きの矩形 (x0, y0, x1, y1) を格納画像の座標に戻す"""
+    x0, y0, x1, y1 = box
+    width, height = display_size
+    return {
+        1: (x0, y0, x1, y1),
+        2: (width - x1, y0, width - x0, y1),
+        3: (width - x1, height - y1, width - x0, height - y0),
+        4: (x0, height - y1, x1, height - y0),
+        5: (y0, x0, y1, x1),
+        6: (y0, width - x1, y1, width - x0),
+        7: (height - y1, width - x1, height - y0, width - x0),
+        8: (height - y1, x0, height - y0, x1),
+    }[orientation]
+
+
+def single_pass_cover(img: Image.Image, target_size, orientation=1, reducing_gap=None) -> Image.Image:
+    """
+    向き補正・切り出し・リサンプルを1回の resize で行う
+
+    切り出し範囲を格納画像の座標で計算し、resize(box=...) で必要な範囲だけをリサンプルしてから
+    出力サイズの画像を回転する。reducing_gap を指定すると大きな縮小を先に整数分の1で行う。
+    cover_resize とは1〜2階調の差が出る。
+    """
+    display_size = img.size
+    if orientation in TRANSPOSED_ORIENTATIONS:
+        display_size = display_size[::-1]
+
+    (new_w, new_h), (left, top) = plan_cover(display_size, target_size)
+    target_w, target_h = target_size
+    scale_x = display_size[0] / new_w
+    scale_y = display_size[1] / new_h
+    # 拡大後の大きさが切り捨てで1画素足りない場合があるので、範囲を画像の内側に収める
+    box = (max(0.0, left * scale_x), max(0.0, top * scale_y),
+           min(display_size[0], (left + target_w) * scale_x), min(display_size[1], (top + target_h) * scale_y))
+
+    size = (target_h, target_w) if orientation in TRANSPOSED_ORIENTATIONS else (target_w, target_h)
+    out = img.resize(size, Image.LANCZOS, box=_source_box(box, display_size, orientation),
+                     reducing_gap=reducing_gap)
+    if orientation in ORIENTATION_TRANSPOSE:
+        out = out.transpose(ORIENTATION_TRANSPOSE[orientation])
+    return out
+
+
+def fit_cover(img: Image.Image, target_size, reducing_gap=None) -> Image.Image:
+    """
+    Image.open した画像を EXIF の向きに補正し、target_size に拡大・中央トリミングした RGB 画像を返す
+
+    reducing_gap が None なら exif_transpose → convert("RGB") → resize → crop と
+    画素単位で同じ結果になる。数値を指定すると single_pass_cover で1回の resize にまとめる(高速・近似)。
+    """
+    orientation = exif_orientation(img)
+    if orientation not in ORIENTATION_TRANSPOSE:
+        orientation = 1
+    # L は拡大してから RGB にしても同じ結果になるので、1チャンネルのまま処理する
+    if img.mode not in ("RGB", "L"):
+        img = img.convert("RGB")
+
+    if reducing_gap is None:
+        if orientation != 1:
+            img = img.transpose(ORIENTATION_TRANSPOSE[orientation])
+        out = cover_resize(img, target_size)
+    else:
+        out = single_pass_cover(img, target_size, orientation, reducing_gap)
+
+    return out if out.mode == "RGB" else out.convert("RGB")
@@ -0,0 +1,119 @@
+import heapq
+import json
+import os
+import re
+
+import fitz  # PyMuPDF
+from PIL import Image
+
+# scan_plan.py
+# フォルダ・ファイル単位のジョブを並列に処理する前に、各ジョブの重さを見積もって実行順を決める。
+#
+# ディレクトリ順に投入すると、最後のほうに大きなフォルダがあった場合、他のワーカーが
+# 手すきになってもその1件だけが長く残る。重いものから順に投入すれば(LPT)、全体の所要時間は
+# 理想値(合計 / ワーカー数、または最大の1件)に近づく。
+#
+#   JPGフォルダ: 画素数の合計(メガピクセル。JPEGはヘッダだけを読む)
+#   PDF        : ページ数
+#
+# --plan out.json で見積もりと実行順、予測した所要時間を書き出せる(コストの単位は上のとおり)。
+# ファイル名は自然順(scan2.jpg < scan10.jpg)に並べる。
+
+_DIGITS = re.compile(r"(\d+)")
+
+
+def natural_key(name):
+    """数字の部分を数値として比べるソートキー(大文字・小文字は区別しない)"""
+    return [int(part) if part.isdigit() else part.casefold() for part in _DIGITS.split(name)]
+
+
+def list_files(directory, extension):
+    """directory 直下の extension のファイル名を自然順で返す"""
+    names = [entry.name for entry in os.scandir(directory)
+             if entry.is_file() and entry.name.lower().endswith(extension)]
+    return sorted(names, key=natural_key)
+
+
+def list_subfolders(parents):
+    """parents の直下のフォルダを自然順で返す"""
+    return [entry.path for parent in parents
+            for entry in sorted(os.scandir(parent), key=lambda e: natural_key(e.name)) if entry.is_dir()]
+
+
+def jpg_folder_cost(folder):
+    """JPGフォルダの見積もり(ファイル数・バイト数・画素数。コストはメガピクセル)"""
+    files = size = pixels = 0
+    for entry in os.scandir(folder):
+        if not (entry.is_file() and entry.name.lower().endswith(".jpg")):
+            continue
+        files += 1
+        size += entry.stat().st_size
+        try:
+            with Image.open(entry.path) as img:
+                pixels += img.width * img.height
+        except OSError:
+            pass
+    return {"files": files, "bytes": size, "pixels": pixels, "cost": pixels / 1e6}
+
+
+def pdf_cost(path):
+    """PDFの見積もり(バイト数・ページ数。コストはページ数)"""
+    try:
+        with fitz.open(path) as doc:
+            pages = doc.page_count
+    except Exception:
+        pages = 0
+    return {"files": 1, "bytes": os.path.getsize(path), "pages": pages, "cost": pages}
+
+
+def makespan(costs, workers):
+    """costs をこの順に、空いたワーカーへ順に割り当てたときの所要時間(コストの単位)"""
+    finish = [0.0] * max(1, workers)
+    for cost in costs:
+        heapq.heapreplace(finish, finish[0] + cost)
+    return max(finish)
+
+
+def plan_jobs(jobs, estimate, workers=1, plan_path=None):
+    """
+    jobs の重さを見積もり、workers > 1 なら重いものから順に並べ替えて返す
+
+    Args:
+        jobs (list[tuple[str, tuple]]): run_file_jobs に渡す (表示名, 引数)
+        estimate: 表示名を受け取り、"cost" を含む見積もりの dict を返す関数
+        workers (int): ワーカープロセス数
+        plan_path (str | None): 見積もりと実行順を JSON で書き出すファイル
+
+    Returns:
+        list[tuple[str, tuple]]: 実行する順の jobs
+    """
+    if workers <= 1 and not plan_path:
+        return jobs
+
+    estimates = [estimate(name) for name, _ in jobs]
+    order = sorted(range(len(jobs)), key=lambda i: -estimates[i]["cost"]) if workers > 1 else range(len(jobs))
+    costs = [e["cost"] for e in estimates]
+    total = sum(costs)
+    ideal = max(total / max(1, workers), max(costs, default=0))
+    plan = {
+        "workers": workers,
+        "total_cost": total,
+        "ideal_makespan": ideal,
+        "directory_order_makespan": makespan(costs, workers),
+        "planned_makespan": makespan([costs[i] for i in order], workers),
+        "jobs": [{"name": jobs[i][0], **estimates[i]} for i in order],
+    }
+    print(f"実行計画: {len(jobs)} 件 (ワーカー {workers}) 予測所要コスト {plan['planned_makespan']:.1f}"
+          f" / ディレクトリ順 {plan['directory_order_makespan']:.1f} / 理想 {ideal:.1f}")
+
+    if plan_path:
+        with open(plan_path, "w", encoding="utf-8") as f:
+            json.dump(plan, f, ensure_ascii=False, indent=1)
+        print(f"実行計画を保存しました: {plan_path}")
+    return [jobs[i] for i in order]
+
+
+def add_plan_arguments(parser):
+    """--plan を parser に追加する"""
+    parser.add_argument("--plan", metavar="OUT.json",
+                        help="ジョブの見積もり(ファイル数・画素数・ページ数)と実行順を JSON で書き出す")
@@ -0,0 +1,74 @@
+import math
+from concurrent.futures import ProcessPoolExecutor
+
+import fitz  # PyMuPDF
+
+import instrument
+from render_cache import RenderCache
+
+# shard_render.py
+# 1つの大きなPDFのレンダリングを複数プロセスで分担する。
+# MuPDFのドキュメントはスレッド間でもプロセス間でも共有できないため、各ワーカーは
+# 初期化時に同じPDFを自分で開き、連続したページ範囲(シャード)を受け持つ。
+# 結果はシャードの順に返すので、ページ順も2in1の左右の組み合わせも保たれる。
+#
+# シャードの長さは偶数にそろえ、2in1のシートがシャードをまたがないようにする。
+# ワーカーからはエンコード済みのデータだけを受け取り、ピクセル列は受け渡さない。
+
+# 1シャードのページ数の上限(ワーカーが返す結果を小さく保ち、負荷を均等にする)
+SHARD_PAGES = 32
+
+_WORKER = {}
+
+
+def _init_worker(pdf_path, cache_dir, cache_mb):
+    _WORKER["doc"] = fitz.open(pdf_path)
+    _WORKER["cache"] = RenderCache(cache_dir, cache_mb) if cache_dir else None
+
+
+def _run_shard(func, page_numbers, args, trace):
+    """ワーカー側で func を1シャード分実行し、(結果, キャッシュの集計, 計測結果) を返す"""
+    cache = _WORKER["cache"]
+    if cache is not None:
+        cache.stats.clear()
+    instrument.reset(trace)
+    result = func(_WORKER["doc"], page_numbers, cache, *args)
+    return result, cache.stats.copy() if cache is not None else None, instrument.export()
+
+
+def shard_ranges(page_numbers, workers, align=2):
+    """
+    page_numbers を連続した範囲に分ける
+
+    各範囲の長さは align の倍数(最後の範囲だけ端数を含む)で、SHARD_PAGES を超えない。
+    """
+    page_numbers = list(page_numbers)
+    size = math.ceil(len(page_numbers) / max(1, workers))
+    size = max(align, min(size, SHARD_PAGES))
+    size = math.ceil(size / align) * align
+    return [page_numbers[i:i + size] for i in range(0, len(page_numbers), size)]
+
+
+def sharded_map(func, pdf_path, page_numbers, workers, args=(), cache=None):
+    """
+    func(doc, シャードのページ番号, cache, *args) を各シャードについてワーカープロセスで実行し、
+    結果をシャードの順に返すジェネレータ
+
+    Args:
+        func: シャード1つ分の処理(プロセス間で渡せるようモジュールの最上位に定義すること)
+        pdf_path (str): ワーカーが開くPDF
+        page_numbers: 処理するページ番号(この順に分割する)
+        workers (int): ワーカープロセス数
+        args (tuple): func に渡す追加の引数
+        cache (RenderCache | None): ワーカーも同じキャッシュフォルダを使い、ヒット数などをここへ集計する
+    """
+    shards = shard_ranges(page_numbers, workers)
+    initargs = (pdf_path, None, None) if cache is None else \
+        (pdf_path, cache.directory, cache.max_bytes / (1024 * 1024))
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=initargs) as executor:
+        for result, stats, data in executor.map(_run_shard, [func] * len(shards), shards,
+                                                [args] * len(shards), [instrument.tracing()] * len(shards)):
+            if stats is not None:
+                cache.stats.update(stats)
+            instrument.merge(data)
+            yield result
@@ -0,0 +1,59 @@
+import os
+import sys
+import unittest
+
+import fitz  # PyMuPDF
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from blank_detect import BlankDetector  # noqa: E402
+
+# tests/test_blank_detect.py
+#   python -m unittest discover tests
+
+
+def page_with_contents(doc, contents):
+    """内容ストリームが contents だけのページを doc に追加する"""
+    page = doc.new_page()
+    page.insert_text((10, 10), " ")
+    doc.update_stream(page.get_contents()[0], contents)
+    return page
+
+
+def inline_image(gray):
+    """1x1 画素・明るさ gray のインライン画像をページ中央付近に描く内容ストリーム"""
+    return b"q 100 0 0 100 50 50 cm BI /W 1 /H 1 /BPC 8 /CS /G ID " + bytes([gray]) + b" EI Q"
+
+
+class BlankDetectorTest(unittest.TestCase):
+    def setUp(self):
+        self.doc = fitz.open()
+
+    def tearDown(self):
+        self.doc.close()
+
+    def test_empty_page_is_blank(self):
+        detector = BlankDetector()
+        self.assertTrue(detector.is_blank(self.doc.new_page()))
+        self.assertEqual(detector.stats["content"], 1)
+
+    def test_inline_image_page_is_not_blank(self):
+        detector = BlankDetector()
+        self.assertFalse(detector.is_blank(page_with_contents(self.doc, inline_image(0))))
+        self.assertEqual(detector.stats["raster"], 1)
+
+    def test_inline_image_page_without_raster_is_not_blank(self):
+        detector = BlankDetector(raster=False)
+        self.assertFalse(detector.is_blank(page_with_contents(self.doc, inline_image(0))))
+
+    def test_white_inline_image_is_blank(self):
+        self.assertTrue(BlankDetector().is_blank(page_with_contents(self.doc, inline_image(255))))
+
+    def test_name_sh_is_not_an_operator(self):
+        detector = BlankDetector()
+        self.assertTrue(detector.is_blank(page_with_contents(self.doc, b"/sh gs")))
+        self.assertEqual(detector.stats["objects"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
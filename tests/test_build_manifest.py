@@ -0,0 +1,66 @@
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import unittest
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import jpgs_to_pdf_b5  # noqa: E402
+from build_manifest import MANIFEST_NAME, BuildManifest  # noqa: E402
+
+# tests/test_build_manifest.py
+#   python -m unittest discover tests
+
+
+def record_outputs(directory, worker, count):
+    """別プロセスから directory のマニフェストへ count 件の出力を1件ずつ記録する"""
+    source = os.path.join(directory, "in.pdf")
+    for i in range(count):
+        output = os.path.join(directory, f"out{worker}_{i}.pdf")
+        with open(output, "wb") as f:
+            f.write(b"%PDF")
+        BuildManifest(directory).record(output, [source], {})
+
+
+def load_entries(directory):
+    with open(os.path.join(directory, MANIFEST_NAME), encoding="utf-8") as f:
+        return json.load(f)
+
+
+class ConcurrentRecordTest(unittest.TestCase):
+    def test_parallel_records_are_kept(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            with open(os.path.join(tmp, "in.pdf"), "wb") as f:
+                f.write(b"%PDF")
+            with ProcessPoolExecutor(max_workers=8) as executor:
+                list(executor.map(record_outputs, [tmp] * 8, range(8), [8] * 8))
+            self.assertEqual(len(load_entries(tmp)), 64)
+            self.assertFalse(os.path.exists(os.path.join(tmp, MANIFEST_NAME + ".lock")))
+
+    def test_parallel_incremental_subfolders(self):
+        # make_b5.bat と同じ --subfolders --incremental を --workers で並列に実行する
+        with tempfile.TemporaryDirectory() as tmp:
+            for i in range(8):
+                folder = os.path.join(tmp, f"scan{i}")
+                os.makedirs(folder)
+                Image.new("RGB", (64, 90), (255, 255, 255)).save(os.path.join(folder, "p1.jpg"))
+            argv = ["--subfolders", "--incremental", "--workers", "4", tmp]
+
+            with contextlib.redirect_stdout(io.StringIO()):
+                jpgs_to_pdf_b5.main(argv)
+            self.assertEqual(sorted(load_entries(tmp)), [f"scan{i}.pdf" for i in range(8)])
+
+            log = io.StringIO()
+            with contextlib.redirect_stdout(log):
+                jpgs_to_pdf_b5.main(argv)
+            self.assertEqual(log.getvalue().count("変更がないためスキップしました"), 8)
+
+
+if __name__ == "__main__":
+    unittest.main()
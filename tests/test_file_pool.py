@@ -0,0 +1,40 @@
+import contextlib
+import io
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from file_pool import WORKER_DIED, run_file_jobs  # noqa: E402
+
+# tests/test_file_pool.py
+#   python -m unittest discover tests
+
+
+def crash_or_print(n):
+    """n が負ならワーカープロセスごと異常終了し、それ以外は n を表示する"""
+    if n < 0:
+        os._exit(1)
+    print(f"job {n}")
+
+
+class RunFileJobsTest(unittest.TestCase):
+    def test_crashing_job_does_not_fail_the_others(self):
+        jobs = [(f"job{n}", (n,)) for n in [0, 1, -1, 2, 3, 4, 5, 6, 7, 8, 9]]
+        succeeded = []
+        log = io.StringIO()
+        with contextlib.redirect_stdout(log):
+            failures = run_file_jobs(crash_or_print, jobs, workers=2,
+                                     on_success=lambda name, args: succeeded.append(name))
+
+        self.assertEqual(failures, [("job-1", WORKER_DIED)])
+        self.assertEqual(sorted(succeeded), sorted(name for name, (n,) in jobs if n >= 0))
+        self.assertIn("完了: 10 / 11 件", log.getvalue())
+        # 再実行したジョブのログも投入した順に並ぶ
+        printed = [line for line in log.getvalue().splitlines() if line.startswith("job ")]
+        self.assertEqual(printed, [f"job {n}" for n in range(10)])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,50 @@
+import os
+import sys
+import unittest
+
+from PIL import Image, ImageDraw
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from page_encoding import PageEncoder  # noqa: E402
+
+# tests/test_page_encoding.py
+#   python -m unittest discover tests
+
+PAGE_SIZE = (2866, 4047)  # B5 400dpi
+
+
+def worksheet(pencil=None):
+    """黒い文字行のあるプリント。pencil を指定すると、その濃さの細い線を行間に書き込む"""
+    img = Image.new("RGB", PAGE_SIZE, (255, 255, 255))
+    draw = ImageDraw.Draw(img)
+    for y in range(300, 3800, 120):
+        draw.rectangle((300, y, 2500, y + 30), fill=(0, 0, 0))
+        if pencil is not None:
+            draw.line((300, y + 60, 2500, y + 100), fill=(pencil, pencil, pencil), width=3)
+    return img
+
+
+class ClassifyTest(unittest.TestCase):
+    def test_default_is_color(self):
+        self.assertEqual(PageEncoder().classify(worksheet()), "color")
+
+    def test_printed_text_is_bilevel(self):
+        self.assertEqual(PageEncoder("auto").classify(worksheet()), "bilevel")
+
+    def test_faint_pencil_is_not_bilevel(self):
+        # しきい値(160)より明るい鉛筆の線は、2値化すると消えてしまう
+        for pencil in (175, 200, 225):
+            with self.subTest(pencil=pencil):
+                self.assertEqual(PageEncoder("auto").classify(worksheet(pencil)), "gray")
+
+    def test_faint_pencil_survives_encoding(self):
+        encoder = PageEncoder("auto")
+        page = encoder.prepare(worksheet(175))
+        self.assertEqual(page.mode, "L")
+        # 1行目の文字と2行目の文字の間(鉛筆の線だけがある帯)
+        self.assertEqual(page.crop((300, 331, 2500, 419)).getextrema(), (175, 255))
+
+
+if __name__ == "__main__":
+    unittest.main()
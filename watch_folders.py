@@ -0,0 +1,220 @@
+import argparse
+import functools
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+import instrument
+from file_pool import WORKER_DIED, IsolatedRunner, run_captured
+from instrument import add_profile_arguments, profiling
+from jpgs_to_pdf_b4_2in1 import jpgs_to_pdf_2in1
+from jpgs_to_pdf_b5 import jpgs_to_pdf
+from page_encoding import add_encoding_arguments, encoder_from_args
+from scan_plan import list_subfolders
+
+# watch_folders.py
+# 監視フォルダの直下にスキャナーが作るJPGフォルダを見張り、書き込みが終わったものから順にPDFへ変換する常駐モード。
+#
+#   - 一定間隔でサブフォルダのJPG一覧(名前・サイズ・更新時刻)を調べ、新しいフォルダや変わったフォルダを見つける
+#   - 最後の変化から --quiet 秒たったフォルダを「スキャン完了」とみなして変換する
+#   - 変換は起動したままのワーカープロセス(最大 --workers 個)で行うため、PIL / numpy / fitz の import は
+#     最初の1回だけで、1フォルダごとのコールドスタートがない
+#   - 変換には --incremental を付けるので、再起動しても変換済みで変わっていないフォルダは作り直さない
+#   - 監視フォルダが一時的に読めない(ネットワーク共有の切断など)ときは警告を出して次の確認で再試行する
+#   - ワーカーが異常終了してプールが壊れたら、新しいプールを作り直して監視を続ける。
+#     巻き込まれた変換は1件ずつ新しいプロセスで実行し直し(file_pool.IsolatedRunner)、
+#     単独でも異常終了したフォルダだけを失敗とする
+#
+# 例: uv run python jpgs_to_pdf_cli.py watch --tool b5 b4-2in1 --quiet 30 <監視フォルダ>
+
+TOOLS = {
+    "b5": jpgs_to_pdf,
+    "b4-2in1": jpgs_to_pdf_2in1,
+}
+
+
+def folder_signature(folder):
+    """フォルダ内のJPGの (名前, サイズ, 更新時刻) の一覧。読めなければ None"""
+    try:
+        entries = list(os.scandir(folder))
+    except OSError:
+        return None
+    signature = []
+    for entry in entries:
+        if entry.is_file() and entry.name.lower().endswith(".jpg"):
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            signature.append((entry.name, stat.st_size, stat.st_mtime_ns))
+    return tuple(sorted(signature))
+
+
+class FolderWatcher:
+    """
+    サブフォルダの変化を追い、静かになったフォルダを変換ジョブとして返す
+
+    Args:
+        roots (list[str]): 監視するフォルダ(直下のサブフォルダが1回分のスキャン)
+        quiet (float): 最後の変化からこの秒数たったらスキャン完了とみなす
+    """
+
+    def __init__(self, roots, quiet=30.0):
+        self.roots = roots
+        self.quiet = quiet
+        self.seen = {}       # フォルダ → (シグネチャ, 最後に変化した時刻)
+        self.done = {}       # フォルダ → 最後に変換したときのシグネチャ
+        self.running = set()
+
+    def poll(self, now=None):
+        """静かになって変換が必要になったフォルダの一覧を返す"""
+        now = time.time() if now is None else now
+        ready = []
+        for folder in list_subfolders(self.roots):
+            signature = folder_signature(folder)
+            if not signature:
+                continue
+            previous = self.seen.get(folder)
+            if previous is None:
+                # 初めて見たフォルダは、中のファイルの最新の更新時刻から静かな時間を数える
+                changed_at = max(mtime for _, _, mtime in signature) / 1e9
+                self.seen[folder] = (signature, changed_at)
+            elif previous[0] != signature:
+                self.seen[folder] = (signature, now)
+                print(f"[変化] {folder} ({len(signature)} ファイル)")
+            changed_at = self.seen[folder][1]
+
+            if folder in self.running or self.done.get(folder) == signature:
+                continue
+            if now - changed_at >= self.quiet:
+                ready.append((folder, signature))
+        return ready
+
+
+def watch(roots, tools=("b5",), quiet=30.0, interval=5.0, workers=1, once=False, **tool_options):
+    """
+    roots の直下のフォルダを監視し、静かになったものを tools で変換し続ける
+
+    once=True なら、その時点で静かなフォルダを変換し終えたら終了する。
+    """
+    watcher = FolderWatcher(roots, quiet)
+    convert_funcs = [functools.partial(TOOLS[name], incremental=True, **tool_options) for name in tools]
+    pending = {}   # future → (フォルダ, シグネチャ, 投入時刻, 変換関数)
+    isolated = IsolatedRunner(instrument.tracing())  # プールの異常終了に巻き込まれた変換を1件ずつ実行し直す
+    crashed = set()  # 単独で実行しても異常終了したフォルダ
+    executor = ProcessPoolExecutor(max_workers=workers)
+
+    def submit(convert, folder):
+        nonlocal executor
+        try:
+            return executor.submit(run_captured, convert, (folder,), instrument.tracing())
+        except BrokenProcessPool:
+            executor.shutdown(wait=False)
+            executor = ProcessPoolExecutor(max_workers=workers)
+            return executor.submit(run_captured, convert, (folder,), instrument.tracing())
+
+    def converting(folder):
+        return (any(f_folder == folder for f_folder, _, _, _ in pending.values())
+                or any(f_folder == folder for f_folder, _, _ in isolated.keys()))
+
+    print(f"監視を開始しました: {', '.join(roots)} (静止 {quiet:g} 秒, ワーカー {workers})")
+    try:
+        while True:
+            try:
+                ready = watcher.poll()
+            except OSError as e:
+                print(f"[警告] 監視フォルダを読めませんでした。次の確認で再試行します: {e}")
+                ready = []
+            for folder, signature in ready:
+                watcher.running.add(folder)
+                submitted = time.time()
+                for convert in convert_funcs:
+                    pending[submit(convert, folder)] = (folder, signature, submitted, convert)
+                print(f"[変換開始] {folder}")
+
+            # 終わったジョブを集める。プールの異常終了に巻き込まれたものは、原因か分からないので単独で実行し直す
+            finished = []
+            pool_broken = False
+            for future in [f for f in pending if f.done()]:
+                folder, signature, submitted, convert = pending.pop(future)
+                try:
+                    ok, log, error, data = future.result()
+                    instrument.merge(data)
+                except BrokenProcessPool:
+                    pool_broken = True
+                    isolated.add((folder, signature, submitted), convert, (folder,))
+                    continue
+                finished.append(((folder, signature, submitted), (ok, log, error)))
+            if pool_broken:
+                print(f"[再試行] {WORKER_DIED}。巻き込まれた変換を1件ずつ新しいプロセスで実行し直します")
+                executor.shutdown(wait=False)
+                executor = ProcessPoolExecutor(max_workers=workers)
+            while (done := isolated.poll()) is not None:
+                finished.append(done)
+
+            # 結果を表示する(同じフォルダの全ツールが終わったら完了)
+            for (folder, signature, submitted), (ok, log, error) in finished:
+                print(log, end="")
+                if error == WORKER_DIED:
+                    crashed.add(folder)
+                elif not ok:
+                    print(f"[NG] {folder}: {error}")
+                if converting(folder):
+                    continue
+
+                watcher.running.discard(folder)
+                if folder in crashed:
+                    crashed.discard(folder)
+                    print(f"[NG] {folder}: {WORKER_DIED}(フォルダが変わるまで変換しません)")
+                else:
+                    print(f"[完了] {folder} ({time.time() - submitted:.1f} 秒)")
+                watcher.done[folder] = signature
+
+            if once and not pending and not isolated:
+                break
+            # 次の確認まで待つ(変換が終わればすぐに結果を表示する)
+            running = list(pending)
+            if isolated.future() is not None:
+                running.append(isolated.future())
+            if running:
+                wait(running, timeout=interval, return_when=FIRST_COMPLETED)
+            else:
+                time.sleep(interval)
+    except KeyboardInterrupt:
+        print("監視を終了します")
+    finally:
+        executor.shutdown()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="スキャンフォルダを監視し、書き込みが終わったものからPDFに変換する")
+    parser.add_argument("roots", nargs="+", metavar="watch_dir",
+                        help="監視するフォルダ(直下のサブフォルダを1回分のスキャンとして変換する)")
+    parser.add_argument("--tool", nargs="+", choices=sorted(TOOLS), default=["b5"],
+                        help="変換に使うツール(複数指定可。既定: b5)")
+    parser.add_argument("--quiet", type=float, default=30.0, metavar="SEC",
+                        help="最後の変化からこの秒数たったフォルダをスキャン完了とみなす(既定: 30)")
+    parser.add_argument("--interval", type=float, default=5.0, metavar="SEC",
+                        help="フォルダを調べる間隔(既定: 5)")
+    parser.add_argument("--workers", type=int, default=1, metavar="N",
+                        help="同時に変換するフォルダ数(ワーカープロセス数)")
+    parser.add_argument("--jobs", type=int, default=1, metavar="N",
+                        help="1フォルダの変換に使うスレッド数")
+    parser.add_argument("--draft", action="store_true",
+                        help="JPEGをB5に必要な解像度まで縮小デコードしてから変換する")
+    parser.add_argument("--max-memory", type=float, metavar="MB",
+                        help="1フォルダの変換で使うページ画像のメモリ上限")
+    parser.add_argument("--once", action="store_true",
+                        help="その時点でスキャンが終わっているフォルダを変換したら終了する")
+    add_encoding_arguments(parser)
+    add_profile_arguments(parser)
+    args = parser.parse_args(argv)
+
+    with profiling(args):
+        watch(args.roots, args.tool, args.quiet, args.interval, args.workers, args.once,
+              jobs=args.jobs, draft=args.draft, max_memory=args.max_memory, encoder=encoder_from_args(args))
+
+
+if __name__ == "__main__":
+    main()